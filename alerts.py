@@ -0,0 +1,130 @@
+import os
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from rag import REDIS_URL
+from cohort import record_alert, slug
+
+# Every level-3 alert goes to one capped stream for all patients and to a
+# stream for the patient's surgeon. A doctor whose postop:doctor:<id> hash
+# has a "surgeon" field reads that surgeon's stream, others read them all.
+# Each doctor has their own consumer group, so every doctor sees every
+# alert routed to them, acks are tracked per doctor, and unacked alerts are
+# re-delivered if a reader dies.
+ALERT_STREAM = os.getenv("ALERT_STREAM", "postop:alerts")
+ALERT_SURGEON_STREAM = ALERT_STREAM + ":surgeon:{}"   # surgeon slug (cohort.slug)
+ALERT_STREAM_MAXLEN = int(os.getenv("ALERT_STREAM_MAXLEN", "100000"))
+ALERT_GROUP = "doctor:{}"                              # per doctor user_id
+# How far back a doctor's feed starts the first time they read it
+ALERT_FIRST_READ_BACKLOG_S = int(os.getenv("ALERT_FIRST_READ_BACKLOG_S", str(24 * 3600)))
+ALERT_CLAIM_IDLE_MS = int(os.getenv("ALERT_CLAIM_IDLE_MS", "60000"))
+ALERT_FEED_BLOCK_MS = int(os.getenv("ALERT_FEED_BLOCK_MS", "15000"))
+ALERT_FEED_MAX_CONN = int(os.getenv("ALERT_FEED_MAX_CONN", "20"))
+
+_feed_pool: Optional[redis.BlockingConnectionPool] = None
+_groups = set()   # (stream, group) pairs this process already created
+
+
+def get_feed_redis() -> redis.Redis:
+    """
+    Blocking XREADGROUP calls hold a connection for up to block_ms, so feeds
+    use their own small pool without the request pool's socket timeout.
+    """
+    global _feed_pool
+    if _feed_pool is None:
+        _feed_pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL, max_connections=ALERT_FEED_MAX_CONN, socket_timeout=None,
+            socket_keepalive=True, decode_responses=False)
+    return redis.Redis(connection_pool=_feed_pool)
+
+
+async def close_feed_redis():
+    global _feed_pool
+    if _feed_pool is not None:
+        await _feed_pool.disconnect()
+        _feed_pool = None
+
+
+def alert_stream(surgeon: str = "") -> str:
+    """The stream a doctor reads: their surgeon's, or the one with every alert."""
+    return ALERT_SURGEON_STREAM.format(slug(surgeon)) if surgeon else ALERT_STREAM
+
+
+async def ensure_group(r, stream: str, doctor: str) -> str:
+    group = ALERT_GROUP.format(doctor)
+    if (stream, group) in _groups:
+        return group
+    start = f"{int((time.time() - ALERT_FIRST_READ_BACKLOG_S) * 1000)}-0"
+    try:
+        await r.xgroup_create(stream, group, id=start, mkstream=True)
+    except ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+    _groups.add((stream, group))
+    return group
+
+
+async def publish_alert(r, patient_id: str, message: str, surgeon: str = "",
+                        source: str = "chat", reason: str = "") -> str:
+    now = time.time()
+    fields = {
+        "ts": str(int(now)),
+        "patient_id": patient_id,
+        "surgeon": surgeon,
+        "source": source,
+        "reason": reason,
+        "message": message,
+    }
+    pipe = r.pipeline(transaction=False)
+    pipe.xadd(ALERT_STREAM, fields, maxlen=ALERT_STREAM_MAXLEN, approximate=True)
+    if surgeon:
+        pipe.xadd(alert_stream(surgeon), fields, maxlen=ALERT_STREAM_MAXLEN, approximate=True)
+    # Feeds the "recently alerted" patient list (cohort.py)
+    record_alert(pipe, patient_id, int(now * 1000), reason)
+    entry_id = (await pipe.execute())[0]
+    return entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+
+
+def _decode(entries) -> List[Dict[str, Any]]:
+    out = []
+    for entry_id, fields in entries or []:
+        if fields is None:  # trimmed from the stream while pending
+            continue
+        d = {k.decode(): v.decode() for k, v in fields.items()}
+        d["id"] = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        d["ts"] = int(d.get("ts", 0))
+        out.append(d)
+    return out
+
+
+async def read_alerts(r, doctor: str, surgeon: str = "", count: int = 20,
+                      block_ms: int = 0) -> List[Dict[str, Any]]:
+    """
+    Returns alerts for this doctor: first ones delivered earlier but left
+    unacknowledged for ALERT_CLAIM_IDLE_MS (e.g. a closed tab), then new ones
+    (waiting up to block_ms).
+    """
+    stream = alert_stream(surgeon)
+    group = await ensure_group(r, stream, doctor)
+    claimed = await r.xautoclaim(stream, group, doctor,
+                                 min_idle_time=ALERT_CLAIM_IDLE_MS, start_id="0-0", count=count)
+    alerts = _decode(claimed[1] if claimed else [])
+    if alerts:
+        return alerts
+    resp = await r.xreadgroup(group, doctor, {stream: ">"},
+                              count=count, block=block_ms or None)
+    return _decode(resp[0][1]) if resp else []
+
+
+async def ack_alerts(r, doctor: str, ids: List[str], surgeon: str = "") -> int:
+    if not ids:
+        return 0
+    return await r.xack(alert_stream(surgeon), ALERT_GROUP.format(doctor), *ids)
+
+
+def alert_event(alert: Dict[str, Any]) -> str:
+    return f"id: {alert['id']}\nevent: alert\ndata: {json.dumps(alert, ensure_ascii=False)}\n\n"
@@ -0,0 +1,118 @@
+import os
+import json
+import uuid
+from typing import Any, Dict, Optional
+
+import numpy as np
+from redisvl.index import AsyncSearchIndex
+from redisvl.query import VectorQuery
+from redisvl.query.filter import Tag
+
+from rag import get_redis, get_rag
+
+# Opt-in: reusing answers is a clinical-safety decision, not just a perf one
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))   # cosine similarity
+ANSWER_CACHE_TTL_S = int(os.getenv("ANSWER_CACHE_TTL_S", str(24 * 3600)))
+
+ANSWER_CACHE_PREFIX = "postop:anscache:"
+
+
+def _prefix(gen: int) -> str:
+    return f"{ANSWER_CACHE_PREFIX}g{gen}:" if gen else ANSWER_CACHE_PREFIX
+
+
+def _schema(dims: int, gen: int = 0) -> Dict[str, Any]:
+    # Cached question vectors only compare within one embedding model, so each
+    # index generation (rag.IndexGeneration) gets its own cache index
+    suffix = f":g{gen}" if gen else ""
+    return {
+        "index": {"name": f"postop:anscache:index{suffix}", "prefix": _prefix(gen), "storage_type": "hash"},
+        "fields": [
+            {"name": "patient_id", "type": "tag"},
+            {"name": "pver", "type": "tag"},
+            {"name": "embedding", "type": "vector", "attrs": {
+                "dims": dims, "algorithm": "flat", "distance_metric": "cosine", "datatype": "float32",
+            }},
+        ],
+    }
+
+
+class AnswerCache:
+    """
+    Semantic cache of parsed /chat answers, scoped to (patient, data version).
+
+    A question whose embedding is within ANSWER_CACHE_THRESHOLD of an earlier
+    one from the same patient, asked against the same profile version, gets
+    the earlier answer back. Level-3 / alerting answers are never stored, and
+    a profile change bumps the version so older entries stop matching.
+    """
+    def __init__(self, dims: int, gen: int = 0, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 ttl_s: int = ANSWER_CACHE_TTL_S):
+        self.gen = gen
+        self.index = AsyncSearchIndex.from_dict(_schema(dims, gen))
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def init(self, r):
+        await self.index.set_client(r)
+        if not await self.index.exists():
+            await self.index.create(overwrite=False)
+
+    async def lookup(self, patient_id: str, version: str, qvec) -> Optional[Dict[str, Any]]:
+        q = VectorQuery(
+            vector=list(map(float, qvec)),
+            vector_field_name="embedding",
+            return_fields=["response", "vector_distance"],
+            filter_expression=(Tag("patient_id") == patient_id) & (Tag("pver") == version),
+            num_results=1,
+            dtype="float32",
+        )
+        try:
+            results = await self.index.query(q)
+        except Exception as e:
+            print(f"Warning: answer cache lookup failed: {e}")
+            return None
+        if results and 1.0 - float(results[0]["vector_distance"]) >= self.threshold:
+            raw = results[0].get("response")
+            if isinstance(raw, (bytes, bytearray)):
+                raw = raw.decode()
+            if raw:
+                self.hits += 1
+                return json.loads(raw)
+        self.misses += 1
+        return None
+
+    async def store(self, r, patient_id: str, version: str, qvec, result: Dict[str, Any]):
+        if result.get("triage_level") not in (1, 2) or result.get("alert_sent"):
+            return
+        key = f"{_prefix(self.gen)}{patient_id}:{uuid.uuid4().hex}"
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "patient_id": patient_id,
+            "pver": version,
+            "response": json.dumps(result, ensure_ascii=False),
+            "embedding": np.asarray(qvec, dtype="float32").tobytes(),
+        })
+        pipe.expire(key, self.ttl_s)
+        await pipe.execute()
+        self.stores += 1
+
+    def stats(self) -> dict:
+        return {"enabled": ANSWER_CACHE_ENABLED, "hits": self.hits,
+                "misses": self.misses, "stores": self.stores}
+
+
+_cache: Optional[AnswerCache] = None
+
+async def get_answer_cache() -> AnswerCache:
+    global _cache
+    rag = await get_rag()
+    if _cache is None or _cache.gen != rag.generation.gen:
+        cache = AnswerCache(rag.generation.dims, rag.generation.gen)
+        await cache.init(await get_redis())
+        _cache = cache
+    return _cache
@@ -1,18 +1,29 @@
 import os, time, asyncio, json, re, jwt
-import numpy as np
-from typing import Optional, List
+from typing import Any, Optional, List
+from dataclasses import dataclass, field
 from pydantic import BaseModel
 
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-
-from rag import PatientRAG, get_redis
-from llm_client import chat_llm
-
-VECTOR_FIELD = "embedding"   
-TEXT_FIELD = "text"       
+from fastapi.responses import FileResponse, StreamingResponse, Response, JSONResponse
+from contextlib import asynccontextmanager
+
+from rag import RAG_TOP_K, get_redis, get_rag, close_redis, watch_index_generation, get_patient_version, build_patient_docs, embed_query, get_batcher, get_embed_cache, close_embedder
+from llm_client import chat_llm, stream_llm, FALLBACK_RESPONSE
+from intents import classify
+from profiles import get_profile_cache, NewPatient
+from redflags import compile_red_flags
+from prompts import build_prompt, log_prompt
+from memory import load_history, format_history, record_turns, close_memory
+from ratelimit import take_patient, take_doctor, acquire_llm_slot, release_llm_slot, record_admission, LLM_SHED_RETRY_AFTER_S
+from triage_stream import TriageStreamParser
+from answer_cache import get_answer_cache, ANSWER_CACHE_ENABLED
+from metrics import stage, monitor_loop_lag, render as render_metrics, STAGE_SECONDS, TRIAGE_LEVELS, JSON_PARSE_FAILURES, ALERTS, CACHE_LOOKUPS
+from alerts import publish_alert, read_alerts, ack_alerts, alert_event, get_feed_redis, close_feed_redis, ALERT_FEED_BLOCK_MS
+from warmup import warm, is_ready, status as warmup_status
+from cohort import index_patient, list_patients, facets as cohort_facets
+from bulk_import import import_patients, parse_csv, parse_ndjson, aiter_lines, IMPORT_BATCH_SIZE
 
 def extract_json(text: str) -> Optional[dict]:
     """Extracts JSON from a string, handling markdown fences."""
@@ -58,7 +69,27 @@ def normalize_patient_doc(doc: dict) -> dict:
 JWT_SECRET = os.getenv("JWT_SECRET", "supersecret-dev-key")
 JWT_ALG = os.getenv("JWT_ALG", "HS256")
 
-app = FastAPI(title="Post-Op Chatbot (Gemini + Redis)")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started_at = time.perf_counter()
+    # One pool + one validated index per worker, reused by every request
+    await get_rag()
+    if ANSWER_CACHE_ENABLED:
+        await get_answer_cache()
+    # Uvicorn only starts accepting connections once startup finishes
+    await warm(started_at)
+    lag_task = asyncio.create_task(monitor_loop_lag())
+    # Follows index generation swaps made by reindex.py
+    index_task = asyncio.create_task(watch_index_generation())
+    yield
+    lag_task.cancel()
+    index_task.cancel()
+    await close_memory()
+    await close_embedder()
+    await close_feed_redis()
+    await close_redis()
+
+app = FastAPI(title="Post-Op Chatbot (Gemini + Redis)", lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 app.add_middleware(
     CORSMiddleware,
@@ -71,6 +102,37 @@ app.add_middleware(
 def root():
     return FileResponse("index.html")
 
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+@app.get("/ready")
+async def ready():
+    # Green only once this worker has loaded and warmed the embedding model
+    body = warmup_status()
+    if not is_ready():
+        return JSONResponse(body, status_code=503)
+    return body
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus exposition, aggregated over all gunicorn workers in multiprocess mode
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/stats")
+async def stats():
+    # Per-worker counters, useful when chasing latency
+    return {
+        "pid": os.getpid(),
+        "embedding": get_batcher().stats(),
+        "embedding_cache": get_embed_cache().stats(),
+        "context_store": (await get_rag()).local.stats(),
+        "index_generation": (await get_rag()).generation.__dict__,
+        "profiles": get_profile_cache().stats(),
+        "answer_cache": (await get_answer_cache()).stats() if ANSWER_CACHE_ENABLED else {"enabled": False},
+    }
+
 class Login(BaseModel):
     user_id: str
     password: str
@@ -92,22 +154,18 @@ async def verify_token(authorization: Optional[str] = Header(None)) -> str:
 @app.post("/auth/login")
 async def login(body: Login):
     r = await get_redis()
+    profiles = get_profile_cache()
     patient_name = "" 
     
     # patient
-    ukey = f"postop:user:{body.user_id}"
-    data = await r.hgetall(ukey)
-    if data and data.get(b"password", b"").decode() == body.password:
-        patient_id = data[b"patient_id"].decode()
+    data = await profiles.get_user(r, body.user_id)
+    if data and data.get("password", "") == body.password:
+        patient_id = data["patient_id"]
         token = jwt.encode({"role":"patient","patient_id": patient_id, "iat": int(time.time())}, JWT_SECRET, algorithm=JWT_ALG)
         
-        try:
-            patient_profile_raw = await r.hget(f"postop:patient:{patient_id}", "profile")
-            if patient_profile_raw:
-                profile_data = json.loads(patient_profile_raw.decode())
-                patient_name = profile_data.get("name", "")
-        except Exception:
-            patient_name = "" 
+        profile = await profiles.get_profile(r, patient_id)
+        if profile:
+            patient_name = profile.name
             
         return {
             "access_token": token, 
@@ -118,10 +176,9 @@ async def login(body: Login):
         }
 
     # doctor
-    dkey = f"postop:doctor:{body.user_id}"
-    data = await r.hgetall(dkey)
-    if data and data.get(b"password", b"").decode() == body.password:
-        doctor_name = data.get(b"name", b"Doctor").decode() # <-- NEW
+    data = await profiles.get_doctor(r, body.user_id)
+    if data and data.get("password", "") == body.password:
+        doctor_name = data.get("name", "Doctor")
         token = jwt.encode({"role":"doctor","user_id": body.user_id, "iat": int(time.time())}, JWT_SECRET, algorithm=JWT_ALG)
         return {
             "access_token": token, 
@@ -148,21 +205,15 @@ async def require_doctor(authorization: Optional[str] = Header(None)) -> str:
     payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
     if payload.get("role") != "doctor":
         raise HTTPException(403, "Doctor role required")
-    return payload.get("user_id") or "doctor"
+    doctor = payload.get("user_id") or "doctor"
+    allowed, retry_after = await take_doctor(await get_redis(), doctor)
+    if not allowed:
+        record_admission("shed_doctor_rate")
+        raise too_many_requests(retry_after, "Too many requests, please slow down.")
+    return doctor
 
-class NewPatient(BaseModel):
-    user_id: str
-    password: str = "test123"
-    patient_id: str
-    name: str
-    age: int
-    surgeon: str
-    procedure: str
-    emergency_name: str
-    emergency_phone: str
-    allergies: list[str] = []
-    medications: list[dict]  
-    red_flags: list[str] = []
+def too_many_requests(retry_after: int, detail: str) -> HTTPException:
+    return HTTPException(429, detail, headers={"Retry-After": str(retry_after)})
 
 @app.post("/admin/add_patient")
 async def add_patient(p: NewPatient, doctor: str = Depends(require_doctor)):
@@ -184,103 +235,255 @@ async def add_patient(p: NewPatient, doctor: str = Depends(require_doctor)):
             detail=f"Patient ID '{p.patient_id}' already exists."
         )
 
-    await r.hset(user_key, mapping={"password": p.password, "patient_id": p.patient_id})
-    profile = {
-        "name": p.name, "age": p.age, "surgeon": p.surgeon, "procedure": p.procedure,
-        "emergency_contact": {"name": p.emergency_name, "phone": p.emergency_phone},
-        "allergies": p.allergies,
-        "medications": p.medications,
-        "red_flags": p.red_flags,
-    }
-    await r.hset(patient_key, mapping={"profile": json.dumps(profile)})
-
-    pr = PatientRAG(); await pr.init(r)
-    docs = []
-    def add(kind, text):
-        docs.append({"id": f"postop:doc:{p.patient_id}:{kind}:{int(time.time())}",
-                     "patient_id": p.patient_id, "kind": kind, "text": text})
-    add("summary", f"{p.name} ({p.age}y). Procedure: {p.procedure} by {p.surgeon}.")
-    add("contacts", f"Emergency: {p.emergency_name} {p.emergency_phone}")
-    if p.allergies:
-        add("allergies", "Allergies: " + ", ".join(p.allergies))
-    if p.medications:
-        meds_lines = [f"{m['name']} {m['dose']} {m['freq']}" for m in p.medications]
-        add("meds", "Medication plan: " + "; ".join(meds_lines))
-    if p.red_flags:
-        add("red_flags", "Critical symptoms: " + "; ".join(p.red_flags))
-
-    from rag import embed
-    vecs = embed([d["text"] for d in docs])
-
-    for d, v in zip(docs, vecs):
-        d[TEXT_FIELD] = d.pop("text")
-        d[VECTOR_FIELD] = np.asarray(v, dtype="float32").tobytes()
-
-    await pr.index.load(docs)
+    profile = p.profile()
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(user_key, mapping={"password": p.password, "patient_id": p.patient_id})
+    pipe.hset(patient_key, mapping={"profile": json.dumps(profile)})
+    index_patient(pipe, p.patient_id, profile)
+    await pipe.execute()
+
+    pr = await get_rag()
+    await pr.upsert_docs(r, build_patient_docs(p.patient_id, profile), full=True)
+    get_profile_cache().invalidate(patient_id=p.patient_id, user_id=p.user_id)
 
     return {"status":"ok","patient_id": p.patient_id}
 
 
-@app.post("/chat")
-async def chat(body: ChatMsg, patient_id: str = Depends(verify_token)):
+@app.post("/admin/import")
+async def import_patients_endpoint(request: Request, format: Optional[str] = None,
+                                   batch_size: int = IMPORT_BATCH_SIZE,
+                                   doctor: str = Depends(require_doctor)):
+    """
+    Bulk onboarding. Body is NDJSON (one NewPatient object per line) or CSV
+    with a header row; format comes from ?format= or the Content-Type.
+    """
+    ctype = request.headers.get("content-type", "").lower()
+    fmt = format or ("csv" if "csv" in ctype else "ndjson")
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(400, "format must be 'ndjson' or 'csv'")
+
     r = await get_redis()
-    rag = PatientRAG(); await rag.init(r)
-
-    hits = await rag.search(r, patient_id, body.message, k=6)
-    ctx_lines = []
-    for h in hits:
-        text = h.get("text")
-        if isinstance(text, (bytes, bytearray)): text = text.decode()
-        ctx_lines.append(f"- {text}")
-    context = "\n".join(ctx_lines) if ctx_lines else "(no context)"
-
-    # Build contact_hint
-    contact = ""
-    for line in ctx_lines:
-        if "Emergency:" in line:
-            contact = line.replace("- ","")
-            break
-
-    system = f"""
-        You are a post-operative patient assistant. Use ONLY the provided patient context.
-        You MUST return a JSON object with keys: "triage_level", "assistant", and "alert".
-
-        --- Triage Rules ---
-        - Level 1: Routine/self-care guidance based on meds/instructions in context.
-        - Level 2: Give Level 1 advice AND ask the patient to schedule an appointment with their clinician.
-        - Level 3: Inform the patient they will be contacted *shortly* by their emergency contact (listed in the context). Set "alert": true.
-
-        --- Special Conversational Rules ---
-        - If the user says "hi", "hello", or "hey":
-        - Set "triage_level": 1.
-        - Set "assistant": "Hello! I'm here to help with your post-operative questions. We are here for you if you need anything."
-        - Set "alert": false.
-        - If the user says "thanks" or "thank you":
-        - Set "triage_level": 1.
-        - Set "assistant": "You're very welcome! We are here for you if you have any other questions."
-        - Set "alert": false.
-        - If the user says "bye" or "goodbye":
-        - Set "triage_level": 1.
-        - Set "assistant": "Goodbye! Take care and please remember to stay on track with your prescribed medications. We are here for you."
-        - Set "alert": false.
-
-        --- General Rules ---
-        - For all other medical or recovery questions, use the Triage Rules.
-        - **NEVER** mention medications, dosage, or frequency unless the patient explicitly asks about their medication OR the response is a sign-off (Bye/Goodbye).
-        - Never invent medications; quote names/dose/frequency only from context.
-        - If info is missing, say so and include clinician contact.
-        - Always sound caring and reassuring.
-
-        PATIENT CONTEXT:
-        {context}
+    lines = aiter_lines(request.stream())
+    rows = parse_csv(lines) if fmt == "csv" else parse_ndjson(lines)
+    report = await import_patients(r, rows, batch_size=max(1, min(batch_size, 5000)))
+    return {"status": "ok", **report.as_dict()}
+
+
+@app.get("/doctor/patients")
+async def doctor_patients(surgeon: str = "", procedure: str = "", alerted: bool = False,
+                          since: Optional[int] = None, limit: int = 50, cursor: Optional[str] = None,
+                          doctor: str = Depends(require_doctor)):
+    """
+    Patients newest first, optionally filtered by surgeon and/or procedure.
+    alerted=true lists patients who raised an alert (since= epoch seconds),
+    most recent alert first. Pass next_cursor back as cursor for the next page;
+    a page can be short when filters are combined, so stop when next_cursor is null.
+    """
+    r = await get_redis()
+    try:
+        return await list_patients(r, surgeon=surgeon, procedure=procedure, alerted=alerted,
+                                   since_ms=(since or 0) * 1000, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+@app.get("/doctor/patients/facets")
+async def doctor_patient_facets(doctor: str = Depends(require_doctor)):
+    """Surgeons and procedures with patient counts, for the list filters."""
+    return await cohort_facets(await get_redis())
+
+
+class AlertAck(BaseModel):
+    ids: List[str]
+
+async def doctor_surgeon(doctor: str) -> str:
+    """The surgeon whose patients' alerts this doctor gets ("" = every patient)."""
+    data = await get_profile_cache().get_doctor(await get_redis(), doctor)
+    return (data or {}).get("surgeon", "")
+
+@app.get("/doctor/alerts")
+async def doctor_alerts(count: int = 20, block_ms: int = 0, doctor: str = Depends(require_doctor)):
+    """
+    Next alerts for this doctor: their surgeon's patients, or every patient
+    for doctors without a surgeon (alerts.py). block_ms > 0
+    long-polls until an alert arrives. Delivered alerts stay pending until
+    acknowledged via /doctor/alerts/ack.
     """
+    count = max(1, min(count, 100))
+    block_ms = max(0, min(block_ms, 60000))
+    surgeon = await doctor_surgeon(doctor)
+    r = get_feed_redis() if block_ms else await get_redis()
+    return {"alerts": await read_alerts(r, doctor, surgeon, count=count, block_ms=block_ms)}
+
+@app.post("/doctor/alerts/ack")
+async def doctor_alerts_ack(body: AlertAck, doctor: str = Depends(require_doctor)):
+    r = await get_redis()
+    return {"acked": await ack_alerts(r, doctor, body.ids, await doctor_surgeon(doctor))}
+
+@app.get("/doctor/alerts/stream")
+async def doctor_alerts_stream(request: Request, doctor: str = Depends(require_doctor)):
+    """Server-sent events feed of alerts for this doctor (ack them via /doctor/alerts/ack)."""
+    surgeon = await doctor_surgeon(doctor)
+
+    async def events():
+        r = get_feed_redis()
+        yield ": connected\n\n"
+        while not await request.is_disconnected():
+            alerts = await read_alerts(r, doctor, surgeon, count=50, block_ms=ALERT_FEED_BLOCK_MS)
+            if not alerts:
+                yield ": keepalive\n\n"
+            for alert in alerts:
+                yield alert_event(alert)
 
-    raw = chat_llm(system, body.message)
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-    data = extract_json(raw) 
+
+def small_talk_response(patient_id: str, intent: dict) -> dict:
+    TRIAGE_LEVELS.labels("1").inc()
+    return {
+        "patient_id": patient_id,
+        "context_used": [],
+        "answer": intent["reply"],
+        "contact_hint": "",
+        "triage_level": 1,
+        "alert_sent": False,
+        "red_flags": [],
+    }
+
+@dataclass
+class ChatContext:
+    version: str
+    qvec: Any = None
+    qvec_model: str = ""      # embedding model qvec came from (the index generation's)
+    contact: str = ""
+    ctx_lines: List[str] = field(default_factory=list)
+    system: str = ""
+    user: str = ""
+    cached: Optional[dict] = None
+    history: str = ""
+    red_flags: List[str] = field(default_factory=list)
+    alert_task: Optional[asyncio.Task] = None
+
+    @property
+    def urgent(self) -> bool:
+        return bool(self.red_flags)
+
+    async def alert_done(self) -> bool:
+        """Waits for the red-flag alert started in prepare_chat; True if it went out."""
+        if self.alert_task is None:
+            return False
+        try:
+            await self.alert_task
+            return True
+        except Exception as e:
+            print(f"Warning: red-flag alert failed: {e}")
+            return False
+
+async def screen_chat(r, patient_id: str, message: str) -> ChatContext:
+    """
+    Loads the profile and screens the message for red flags, starting the
+    alert right away (in parallel with the rest). Runs before admission
+    control so urgent messages are never shed.
+    """
+    # One version read keeps the profile and context caches fresh across workers
+    with stage("profile"):
+        version = await get_patient_version(r, patient_id)
+        profile = await get_profile_cache().get_profile(r, patient_id, version)
+    with stage("red_flags"):
+        matcher = profile.red_flag_matcher if profile else compile_red_flags([])
+        red_flags = matcher.match(message)
+    alert_task = None
+    if red_flags:
+        alert_task = asyncio.create_task(
+            push_alert(r, patient_id, message, source="red_flag", reason="; ".join(red_flags)))
+    return ChatContext(version=version, contact=profile.contact_hint if profile else "",
+                       red_flags=red_flags, alert_task=alert_task)
+
+async def admit_chat(r, patient_id: str, ctx: ChatContext):
+    """Per-patient token bucket; red-flag messages always pass."""
+    if ctx.urgent:
+        record_admission("urgent")
+        return
+    allowed, retry_after = await take_patient(r, patient_id)
+    if not allowed:
+        record_admission("shed_patient_rate")
+        raise too_many_requests(retry_after, "You're sending messages very quickly. Please wait a moment and try again. "
+                                             "If this is an emergency, call your emergency contact.")
+    record_admission("admitted")
+
+async def acquire_llm(r, ctx: ChatContext) -> str:
+    """A global LLM slot; when all are busy, non-urgent requests get a 429."""
+    with stage("llm_admission"):
+        lease = await acquire_llm_slot(r, urgent=ctx.urgent)
+    if lease is None:
+        record_admission("shed_llm_capacity")
+        raise too_many_requests(LLM_SHED_RETRY_AFTER_S, "The assistant is very busy right now. Please try again shortly. "
+                                                        "If this is an emergency, call your emergency contact.")
+    return lease
+
+async def prepare_chat(r, patient_id: str, message: str, ctx: ChatContext) -> ChatContext:
+    """Embeds the question, checks the answer cache, retrieves context and builds the prompt."""
+    with stage("rag_init"):
+        rag = await get_rag()
+    with stage("embed"):
+        ctx.qvec_model = rag.generation.model
+        ctx.qvec = await embed_query(message, r, ctx.qvec_model)
+    version = ctx.version
+
+    # Rolling summary + last few turns only (memory.py), so the prompt stays bounded
+    with stage("memory"):
+        ctx.history = format_history(await load_history(r, patient_id))
+
+    # A red-flag message always gets a fresh answer. So does a message with
+    # conversation behind it: "is that normal?" means something else each time
+    if ANSWER_CACHE_ENABLED and not ctx.urgent and not ctx.history:
+        with stage("answer_cache"):
+            cached = await (await get_answer_cache()).lookup(patient_id, version, ctx.qvec)
+        CACHE_LOOKUPS.labels("answer", "hit" if cached else "miss").inc()
+        if cached:
+            ctx.cached = {**cached, "patient_id": patient_id, "alert_sent": False}
+            TRIAGE_LEVELS.labels(str(cached.get("triage_level"))).inc()
+            return ctx
+
+    with stage("vector_query"):
+        hits = await rag.search(r, patient_id, message, k=RAG_TOP_K, version=version,
+                                qvec=ctx.qvec, qvec_model=ctx.qvec_model)
+
+    # Level 3 answers name the emergency contact, so it is always in context
+    prompt = build_prompt(hits, message, ctx.history, pinned=[ctx.contact])
+    log_prompt(patient_id, prompt)
+    ctx.system, ctx.user, ctx.ctx_lines = prompt.system, prompt.user, prompt.ctx_lines
+    return ctx
+
+async def remember_answer(r, patient_id: str, ctx: ChatContext, raw: str, result: dict):
+    # Fallback answers (LLM deadline passed) are not worth reusing, nor are
+    # answers that depended on the conversation so far
+    if ANSWER_CACHE_ENABLED and raw != FALLBACK_RESPONSE and not ctx.history:
+        try:
+            await (await get_answer_cache()).store(r, patient_id, ctx.version, ctx.qvec, result)
+        except Exception as e:
+            print(f"Warning: answer cache store failed: {e}")
+
+async def remember_turns(r, patient_id: str, message: str, result: dict):
+    try:
+        await record_turns(r, patient_id, message, result.get("answer") or "")
+    except Exception as e:
+        print(f"Warning: conversation memory write failed: {e}")
+
+async def push_alert(r, patient_id: str, message: str, source: str = "chat", reason: str = ""):
+    ALERTS.labels(source).inc()
+    with stage("alert"):
+        profile = await get_profile_cache().get_profile(r, patient_id)
+        await publish_alert(r, patient_id, message,
+                            surgeon=profile.surgeon if profile else "", source=source, reason=reason)
+
+async def finish_chat(r, patient_id: str, message: str, raw: str, ctx_lines: List[str],
+                      contact: str, alert_sent: bool = False, red_flags: List[str] = ()) -> dict:
+    """Parses the model output, raises the alert if needed and builds the /chat response."""
+    with stage("extract_json"):
+        data = extract_json(raw) 
 
     triage_level = None
-    alert_sent = False
     answer_text = raw # Default to raw text if parsing fails
 
     if data:
@@ -288,27 +491,147 @@ async def chat(body: ChatMsg, patient_id: str = Depends(verify_token)):
         triage_level = int(data.get("triage_level")) if "triage_level" in data else None
         answer_text = data.get("assistant") or "I found some information but could not formulate a reply."
 
-        if data.get("alert") and triage_level == 3:
-            # simulate alert: push to Redis list
-            await r.lpush(f"postop:alerts:{patient_id}", json.dumps({
-                "ts": int(time.time()),
-                "patient_id": patient_id,
-                "message": body.message
-            }))
+        if data.get("alert") and triage_level == 3 and not alert_sent:
+            await push_alert(r, patient_id, message)
             alert_sent = True
     else:
-        # Parsing failed, use the original fallback logic
-        low = body.message.lower()
-        if any(k in low for k in ["chest pain","shortness of breath","severe pain","fever 39","fever 40","yellowing"]):
-            triage_level = 3
-            alert_sent = True
-            await r.lpush(f"postop:alerts:{patient_id}", json.dumps({"ts": int(time.time()), "patient_id": patient_id, "message": body.message}))
+        JSON_PARSE_FAILURES.inc()
+
+    # The red-flag matcher (redflags.py) already alerted; whatever the model
+    # said, the answer is level 3
+    if red_flags:
+        triage_level = 3
 
+    TRIAGE_LEVELS.labels(str(triage_level)).inc()
     return {
         "patient_id": patient_id,
         "context_used": ctx_lines,
         "answer": answer_text, 
         "contact_hint": contact,
         "triage_level": triage_level,
-        "alert_sent": alert_sent
+        "alert_sent": alert_sent,
+        "red_flags": list(red_flags),
     }
+
+
+@app.post("/chat")
+async def chat(body: ChatMsg, patient_id: str = Depends(verify_token)):
+    # Small talk gets its canonical reply without touching RAG or the LLM
+    intent = classify(body.message)
+    if intent:
+        return small_talk_response(patient_id, intent)
+
+    with stage("get_redis"):
+        r = await get_redis()
+    ctx = await screen_chat(r, patient_id, body.message)
+    await admit_chat(r, patient_id, ctx)
+    ctx = await prepare_chat(r, patient_id, body.message, ctx)
+    if ctx.cached:
+        await remember_turns(r, patient_id, body.message, ctx.cached)
+        return ctx.cached
+
+    lease = await acquire_llm(r, ctx)
+    try:
+        with stage("llm"):
+            raw = await chat_llm(ctx.system, ctx.user)
+    finally:
+        await release_llm_slot(r, lease)
+
+    alert_sent = await ctx.alert_done()
+    result = await finish_chat(r, patient_id, body.message, raw, ctx.ctx_lines, ctx.contact,
+                               alert_sent=alert_sent, red_flags=ctx.red_flags)
+    await remember_answer(r, patient_id, ctx, raw, result)
+    await remember_turns(r, patient_id, body.message, result)
+    return result
+
+
+def sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(body: ChatMsg, patient_id: str = Depends(verify_token)):
+    """
+    Server-sent events version of /chat:
+      event: meta   {"triage_level", "alert", "alert_sent"} as soon as the keys appear
+      event: token  {"text": delta} for the assistant text as it is generated
+      event: done   the same payload /chat returns
+    Admission (rate limit, LLM capacity) is decided before the stream opens,
+    so a shed request gets a plain 429 with Retry-After.
+    """
+    intent = classify(body.message)
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    if intent:
+        async def small_talk():
+            yield sse("token", {"text": intent["reply"]})
+            yield sse("done", small_talk_response(patient_id, intent))
+        return StreamingResponse(small_talk(), media_type="text/event-stream", headers=headers)
+
+    r = await get_redis()
+    ctx = await screen_chat(r, patient_id, body.message)
+    await admit_chat(r, patient_id, ctx)
+    ctx = await prepare_chat(r, patient_id, body.message, ctx)
+    if ctx.cached:
+        await remember_turns(r, patient_id, body.message, ctx.cached)
+        async def cached():
+            yield sse("token", {"text": ctx.cached.get("answer", "")})
+            yield sse("done", ctx.cached)
+        return StreamingResponse(cached(), media_type="text/event-stream", headers=headers)
+    # Released when the stream ends; if the client vanishes before it starts,
+    # the lease expires on its own (ratelimit.LLM_LEASE_MS)
+    lease = await acquire_llm(r, ctx)
+
+    async def events():
+        try:
+            async for event in stream_answer(r, patient_id, body.message, ctx):
+                yield event
+        finally:
+            await release_llm_slot(r, lease)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+STREAM_CUT_NOTE = ("Sorry, my answer was interrupted. If your symptoms are worsening, "
+                   "please contact your care team directly.")
+
+async def stream_answer(r, patient_id: str, message: str, ctx: ChatContext):
+    """SSE events for an admitted, uncached chat message."""
+    parser = TriageStreamParser()
+    # Red flags were alerted on before the model was even asked
+    alert_sent = ctx.alert_task is not None
+    if ctx.red_flags:
+        yield sse("meta", {"triage_level": 3, "alert": True, "alert_sent": True,
+                           "red_flags": ctx.red_flags})
+    t0 = time.perf_counter()
+    first = True
+    async for chunk in stream_llm(ctx.system, ctx.user):
+        if first:
+            STAGE_SECONDS.labels("llm_first_token").observe(time.perf_counter() - t0)
+            first = False
+        for kind, payload in parser.feed(chunk):
+            if kind == "token":
+                yield sse("token", {"text": payload})
+                continue
+            # Level 3: alert the care team now rather than after the full answer
+            if payload["triage_level"] == 3 and payload["alert"] is not False and not alert_sent:
+                await push_alert(r, patient_id, message)
+                alert_sent = True
+            yield sse("meta", {**payload, "alert_sent": alert_sent})
+    STAGE_SECONDS.labels("llm").observe(time.perf_counter() - t0)
+
+    raw = parser.raw
+    truncated = extract_json(raw) is None
+    if truncated:
+        # The stream was cut off (or wasn't JSON): answer with the text the
+        # patient already saw plus a pointer to the care team, never a raw fragment
+        JSON_PARSE_FAILURES.inc()
+        note = (" " if parser.assistant else "") + STREAM_CUT_NOTE
+        yield sse("token", {"text": note})
+        raw = json.dumps({"triage_level": parser.triage_level or 2,
+                          "assistant": parser.assistant + note, "alert": bool(parser.alert)})
+    if ctx.alert_task is not None:
+        alert_sent = await ctx.alert_done()
+    result = await finish_chat(r, patient_id, message, raw, ctx.ctx_lines, ctx.contact,
+                               alert_sent=alert_sent, red_flags=ctx.red_flags)
+    yield sse("done", result)
+    if not truncated:
+        await remember_answer(r, patient_id, ctx, raw, result)
+    await remember_turns(r, patient_id, message, result)
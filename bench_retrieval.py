@@ -0,0 +1,60 @@
+# bench_retrieval.py
+# Compares per-chat retrieval latency: HNSW index query vs in-process context store.
+# Run `python seed.py` first.
+import argparse, asyncio, time
+import numpy as np
+
+from rag import get_redis, get_rag, embed, get_patient_version
+from seed import PATIENTS
+
+QUERIES = [
+    "is this pain normal",
+    "when do I take my meds",
+    "I have a fever",
+    "can I shower",
+    "who do I call in an emergency",
+    "my leg is swollen",
+]
+
+
+def summarize(name, samples):
+    ms = np.array(samples) * 1000
+    print(f"{name:8s} n={len(ms):5d}  mean={ms.mean():7.3f}ms  p50={np.percentile(ms, 50):7.3f}ms  "
+          f"p95={np.percentile(ms, 95):7.3f}ms  p99={np.percentile(ms, 99):7.3f}ms")
+
+
+async def main(rounds: int, k: int):
+    r = await get_redis()
+    rag = await get_rag()
+    qvecs = embed(QUERIES)  # embed once so only retrieval is timed
+    pids = [p["patient_id"] for p in PATIENTS]
+
+    timings = {"redis": [], "local": []}
+    overlap = []
+    for _ in range(rounds):
+        for pid in pids:
+            version = await get_patient_version(r, pid)
+            for qv in qvecs:
+                t0 = time.perf_counter()
+                a = await rag.index_search(pid, qv, k)
+                timings["redis"].append(time.perf_counter() - t0)
+
+                t0 = time.perf_counter()
+                b = await rag.local_search(r, pid, qv, k, version)
+                timings["local"].append(time.perf_counter() - t0)
+
+                ids_a = {h["id"] for h in a}
+                ids_b = {h["id"] for h in b}
+                overlap.append(len(ids_a & ids_b) / max(1, len(ids_a)))
+
+    summarize("redis", timings["redis"])
+    summarize("local", timings["local"])
+    print(f"top-{k} agreement: {np.mean(overlap):.3f}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=50)
+    ap.add_argument("-k", type=int, default=6)
+    args = ap.parse_args()
+    asyncio.run(main(args.rounds, args.k))
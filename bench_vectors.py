@@ -0,0 +1,114 @@
+# bench_vectors.py
+# Recall and memory of compact vector formats against exact float32 search.
+#   python bench_vectors.py --docs 20000 --queries 500
+#   python bench_vectors.py --texts            # embed the seed patients' docs instead
+#   python bench_vectors.py --redis-url redis://localhost:6379   # also FT.INFO sizes
+import time, asyncio, argparse
+import numpy as np
+
+from vecformat import RERANK_CANDIDATES, quantize_int8, int8_scores, search_int8
+
+DIMS = 384
+
+
+def synthetic(n: int, dims: int, seed: int = 0) -> np.ndarray:
+    # Clustered rather than uniform, closer to how sentence embeddings behave
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 50), dims))
+    x = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dims))
+    return (x / np.linalg.norm(x, axis=1, keepdims=True)).astype(np.float32)
+
+
+def seed_texts():
+    from rag import build_patient_docs, embed
+    from seed import PATIENTS
+    texts = [d["text"] for p in PATIENTS for d in build_patient_docs(p["patient_id"], p["profile"])]
+    queries = ["is this pain normal", "when do I take my meds", "I have a fever",
+               "can I shower", "who do I call in an emergency", "my leg is swollen"]
+    return embed(texts), embed(queries)
+
+
+def topk(scores: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-scores)[:k]
+
+
+def run(docs: np.ndarray, queries: np.ndarray, k: int):
+    exact = [set(topk(docs @ q, k)) for q in queries]
+    f16 = docs.astype(np.float16)
+    codes, scales = quantize_int8(docs)
+
+    variants = {
+        "float32": (docs.nbytes, lambda q: topk(docs @ q, k)),
+        "float16": (f16.nbytes, lambda q: topk(f16.astype(np.float32) @ q, k)),
+        "int8": (codes.nbytes + scales.nbytes, lambda q: topk(int8_scores(codes, scales, q), k)),
+        f"int8+rerank{RERANK_CANDIDATES}": (
+            codes.nbytes + scales.nbytes,
+            lambda q: search_int8(codes, scales, q, k, exact_rows=lambda idx: docs[idx])[0]),
+    }
+    print(f"{len(docs)} docs x {docs.shape[1]} dims, {len(queries)} queries, k={k}")
+    for name, (nbytes, search) in variants.items():
+        t0 = time.perf_counter()
+        hits = [search(q) for q in queries]
+        ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        recall = np.mean([len(exact[i] & set(h)) / k for i, h in enumerate(hits)])
+        print(f"{name:16s} recall@{k}={recall:.4f}  bytes/vec={nbytes / len(docs):7.1f}  "
+              f"total={nbytes / 2**20:8.2f}MB  query={ms:.3f}ms")
+
+
+async def run_redis(url: str, docs: np.ndarray, queries: np.ndarray, k: int):
+    """Loads the docs into a throwaway index per dtype and reports FT.INFO memory."""
+    import redis.asyncio as redis
+    from redisvl.index import AsyncSearchIndex
+    from redisvl.query import VectorQuery
+    from rag import SCHEMA_PATH, VECTOR_FIELD, create_index
+    from vecformat import to_bytes
+
+    r = redis.Redis.from_url(url)
+    exact = [set(topk(docs @ q, k)) for q in queries]
+    for dtype in ("float32", "float16"):
+        index = AsyncSearchIndex.from_yaml(SCHEMA_PATH)
+        index.schema.index.name = f"bench:vec:{dtype}"
+        index.schema.index.prefix = f"bench:vec:{dtype}:"
+        await index.set_client(r)
+        await create_index(index, dtype=dtype, overwrite=True)
+        pipe = r.pipeline(transaction=False)
+        for i, v in enumerate(docs):
+            pipe.hset(f"{index.prefix}{i}", mapping={"patient_id": "bench", "kind": "bench",
+                                                     "text": str(i), VECTOR_FIELD: to_bytes(v, dtype)})
+        await pipe.execute()
+        while int((await index.info()).get("indexing", 0)):
+            await asyncio.sleep(0.2)
+
+        samples, recalls = [], []
+        for qi, q in enumerate(queries):
+            vq = VectorQuery(vector=to_bytes(q, dtype), vector_field_name=VECTOR_FIELD,
+                             return_fields=["text"], num_results=k)
+            t0 = time.perf_counter()
+            res = await index.query(vq)
+            samples.append(time.perf_counter() - t0)
+            recalls.append(len(exact[qi] & {int(h["text"]) for h in res}) / k)
+        info = await index.info()
+        print(f"redis {dtype:8s} recall@{k}={np.mean(recalls):.4f}  "
+              f"vector_index_sz_mb={float(info.get('vector_index_sz_mb', 0)):.2f}  "
+              f"p50={np.percentile(samples, 50) * 1000:.3f}ms  p95={np.percentile(samples, 95) * 1000:.3f}ms")
+        await index.delete(drop=True)
+    await r.aclose()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare float32 / float16 / int8 vector storage")
+    ap.add_argument("--docs", type=int, default=20000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=6)
+    ap.add_argument("--texts", action="store_true", help="embed the seed patients' docs")
+    ap.add_argument("--redis-url", help="also build FLOAT32/FLOAT16 indexes on this server")
+    args = ap.parse_args()
+
+    if args.texts:
+        docs, queries = seed_texts()
+    else:
+        docs = synthetic(args.docs, DIMS)
+        queries = synthetic(args.queries, DIMS, seed=1)
+    run(docs, queries, args.k)
+    if args.redis_url:
+        asyncio.run(run_redis(args.redis_url, docs, queries, args.k))
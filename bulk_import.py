@@ -0,0 +1,234 @@
+# bulk_import.py
+# Bulk patient onboarding from NDJSON or CSV.
+#   python bulk_import.py discharges.ndjson
+#   python bulk_import.py discharges.csv --format csv --batch-size 500
+import os, io, csv, json, time, codecs, asyncio, argparse
+from dataclasses import dataclass, field, asdict
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, List, Tuple, Union
+
+from pydantic import ValidationError
+
+from rag import get_redis, get_rag, aembed, build_patient_docs, VERSION_KEY, DOC_SET_KEY
+from profiles import NewPatient
+from cohort import index_patient, now_ms
+from vecformat import to_bytes
+
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "200"))     # patients per pipeline
+IMPORT_EMBED_CHUNK = int(os.getenv("IMPORT_EMBED_CHUNK", "256"))   # texts per encode call
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))    # errors kept in the report
+
+CSV_LIST_FIELDS = ("allergies", "red_flags")
+
+
+@dataclass
+class ImportReport:
+    received: int = 0
+    imported: int = 0
+    failed: int = 0
+    docs: int = 0
+    seconds: float = 0.0
+    rows_per_sec: float = 0.0
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+
+    def error(self, row: int, msg: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "error": msg})
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+# A parsed row is either a dict or a parse error message
+Row = Tuple[int, Union[Dict[str, Any], str]]
+
+
+async def _aiter(lines: Union[Iterable[str], AsyncIterable[str]]) -> AsyncIterator[str]:
+    if hasattr(lines, "__aiter__"):
+        async for line in lines:
+            yield line
+    else:
+        for line in lines:
+            yield line
+
+
+async def aiter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """Splits a byte stream (e.g. Request.stream()) into text lines."""
+    # Incremental, so a character split across two chunks decodes once both arrive
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    async for chunk in chunks:
+        buf += decoder.decode(chunk) if isinstance(chunk, (bytes, bytearray)) else chunk
+        *lines, buf = buf.split("\n")
+        for line in lines:
+            yield line
+    buf += decoder.decode(b"", final=True)
+    for line in buf.split("\n"):
+        if line:
+            yield line
+
+
+async def parse_ndjson(lines) -> AsyncIterator[Row]:
+    n = 0
+    async for line in _aiter(lines):
+        line = line.strip()
+        if not line:
+            continue
+        n += 1
+        try:
+            obj = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield n, f"invalid JSON: {e.msg}"
+            continue
+        yield n, obj if isinstance(obj, dict) else "expected a JSON object"
+
+
+def _csv_row(rec: Dict[str, str]) -> Dict[str, Any]:
+    """
+    CSV columns match NewPatient. List columns are ';'-separated; medications
+    is either a JSON array or 'name|dose|freq; name|dose|freq'.
+    """
+    row: Dict[str, Any] = {k: v for k, v in rec.items() if k and v not in (None, "")}
+    for k in CSV_LIST_FIELDS:
+        if k in row:
+            row[k] = [s.strip() for s in row[k].split(";") if s.strip()]
+    meds = row.get("medications", "")
+    if meds.lstrip().startswith("["):
+        row["medications"] = json.loads(meds)
+    else:
+        out = []
+        for item in filter(None, (s.strip() for s in meds.split(";"))):
+            parts = [p.strip() for p in item.split("|")] + ["", ""]
+            out.append({"name": parts[0], "dose": parts[1], "freq": parts[2]})
+        row["medications"] = out
+    return row
+
+
+async def parse_csv(lines) -> AsyncIterator[Row]:
+    header = None
+    pending = ""
+    n = 0
+    async for line in _aiter(lines):
+        pending += line if not pending else "\n" + line
+        # An odd number of quotes means a quoted field continues on the next line
+        if pending.count('"') % 2:
+            continue
+        text, pending = pending.rstrip("\r"), ""
+        if not text.strip():
+            continue
+        values = next(csv.reader(io.StringIO(text)))
+        if header is None:
+            header = [h.strip() for h in values]
+            continue
+        n += 1
+        try:
+            yield n, _csv_row(dict(zip(header, values)))
+        except (ValueError, TypeError) as e:
+            yield n, f"bad medications column: {e}"
+    if pending.strip():
+        yield n + 1, "unterminated quoted field"
+
+
+async def _embed_chunked(texts: List[str], model: str):
+    out = []
+    for i in range(0, len(texts), IMPORT_EMBED_CHUNK):
+        out.extend(await aembed(texts[i:i + IMPORT_EMBED_CHUNK], model))
+    return out
+
+
+async def _import_batch(r, batch: List[Tuple[int, NewPatient]], report: ImportReport):
+    # One round trip for all duplicate checks in the batch
+    pipe = r.pipeline(transaction=False)
+    for _, p in batch:
+        pipe.exists(f"postop:user:{p.user_id}")
+        pipe.exists(f"postop:patient:{p.patient_id}")
+    flags = await pipe.execute()
+
+    accepted: List[Tuple[NewPatient, dict]] = []
+    for i, (row, p) in enumerate(batch):
+        if flags[2 * i]:
+            report.error(row, f"Login user_id '{p.user_id}' already exists.")
+        elif flags[2 * i + 1]:
+            report.error(row, f"Patient ID '{p.patient_id}' already exists.")
+        else:
+            accepted.append((p, p.profile()))
+    if not accepted:
+        return
+
+    docs = [d for p, prof in accepted for d in build_patient_docs(p.patient_id, prof)]
+    generation = (await get_rag()).generation   # model, vector field + dtype of the active index
+    vecs = await _embed_chunked([d["text"] for d in docs], generation.model)
+
+    added = now_ms()
+    pipe = r.pipeline(transaction=False)
+    for p, prof in accepted:
+        pipe.hset(f"postop:user:{p.user_id}", mapping={"password": p.password, "patient_id": p.patient_id})
+        pipe.hset(f"postop:patient:{p.patient_id}", mapping={"profile": json.dumps(prof)})
+        index_patient(pipe, p.patient_id, prof, added)
+        pipe.incr(VERSION_KEY.format(p.patient_id))
+    for d, v in zip(docs, vecs):
+        pipe.hset(d["id"], mapping={
+            "patient_id": d["patient_id"], "kind": d["kind"], "text": d["text"],
+            generation.field: to_bytes(v, generation.dtype),
+        })
+        pipe.sadd(DOC_SET_KEY.format(d["patient_id"]), d["id"])
+    await pipe.execute()
+    report.imported += len(accepted)
+    report.docs += len(docs)
+
+
+async def import_patients(r, rows: AsyncIterable[Row], batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """Validates rows with NewPatient and writes them in fixed-size pipelined batches."""
+    report = ImportReport()
+    t0 = time.perf_counter()
+    batch: List[Tuple[int, NewPatient]] = []
+    seen_users, seen_patients = set(), set()
+
+    async for row, obj in rows:
+        report.received += 1
+        if isinstance(obj, str):
+            report.error(row, obj)
+            continue
+        try:
+            p = NewPatient.model_validate(obj)
+        except ValidationError as e:
+            report.error(row, "; ".join(
+                f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        if p.user_id in seen_users or p.patient_id in seen_patients:
+            report.error(row, "duplicate user_id or patient_id within the import")
+            continue
+        seen_users.add(p.user_id)
+        seen_patients.add(p.patient_id)
+        batch.append((row, p))
+        if len(batch) >= batch_size:
+            await _import_batch(r, batch, report)
+            batch = []
+    if batch:
+        await _import_batch(r, batch, report)
+
+    report.seconds = round(time.perf_counter() - t0, 3)
+    report.rows_per_sec = round(report.received / report.seconds, 1) if report.seconds else 0.0
+    return report
+
+
+async def main(path: str, fmt: str, batch_size: int):
+    r = await get_redis()
+    with open(path, encoding="utf-8") as f:
+        lines = (line.rstrip("\n") for line in f)
+        rows = parse_csv(lines) if fmt == "csv" else parse_ndjson(lines)
+        report = await import_patients(r, rows, batch_size)
+    for e in report.errors:
+        print(f"row {e['row']}: {e['error']}")
+    print(f"Imported {report.imported}/{report.received} patients ({report.docs} docs, "
+          f"{report.failed} failed) in {report.seconds}s, {report.rows_per_sec} rows/s.")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Bulk-import patients from NDJSON or CSV")
+    ap.add_argument("path")
+    ap.add_argument("--format", choices=["ndjson", "csv"])
+    ap.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = ap.parse_args()
+    fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+    asyncio.run(main(args.path, fmt, args.batch_size))
@@ -0,0 +1,257 @@
+# cohort.py
+# Secondary indexes for the doctor patient list.
+#   python cohort.py --backfill      # index patients created before the indexes existed
+#
+# Every patient is a member of a few sorted sets (all patients, per surgeon,
+# per procedure, last alert), and the fields a list row needs are copied
+# next to the JSON profile in postop:patient:<id>. Listing is then a ranged
+# read of one sorted set plus one HMGET per row, whatever the patient count.
+import os, json, time, base64, asyncio, argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+from textutil import normalize_text
+
+PATIENT_KEY = "postop:patient:{}"
+COHORT_ALL_KEY = "postop:cohort:all"              # zset: patient_id -> added (ms)
+COHORT_SURGEON_KEY = "postop:cohort:surgeon:{}"   # zset per surgeon slug, same scores
+COHORT_PROCEDURE_KEY = "postop:cohort:procedure:{}"
+COHORT_ALERT_KEY = "postop:cohort:alerts"         # zset: patient_id -> last alert (ms)
+COHORT_LABELS_KEY = "postop:cohort:labels:{}"     # hash per facet: slug -> display name
+FACETS = ("surgeon", "procedure")
+SUMMARY_FIELDS = ("name", "age", "surgeon", "procedure", "added", "last_alert", "last_alert_reason")
+COHORT_PAGE_MAX = int(os.getenv("COHORT_PAGE_MAX", "100"))
+# When two filters are combined, at most this many members of the smaller
+# set are examined per request; a short page then comes back with a cursor
+COHORT_SCAN_BUDGET = int(os.getenv("COHORT_SCAN_BUDGET", "2000"))
+
+
+def slug(value: str) -> str:
+    return normalize_text(value).replace(" ", "-")
+
+
+def _facet_key(facet: str, value: str) -> str:
+    return (COHORT_SURGEON_KEY if facet == "surgeon" else COHORT_PROCEDURE_KEY).format(slug(value))
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def index_patient(pipe, patient_id: str, profile: Dict[str, Any], added_ms: Optional[int] = None,
+                  previous: Optional[Dict[str, str]] = None):
+    """
+    Queues the index writes for one patient on `pipe`. `previous` holds the
+    surgeon/procedure the patient was indexed under, if they may have changed.
+    """
+    added_ms = added_ms or now_ms()
+    key = PATIENT_KEY.format(patient_id)
+    pipe.hset(key, mapping={"name": profile.get("name", ""), "age": profile.get("age") or "",
+                            "surgeon": profile.get("surgeon", ""), "procedure": profile.get("procedure", "")})
+    pipe.hsetnx(key, "added", added_ms)
+    # NX keeps the original "added" time when a patient is re-indexed
+    pipe.zadd(COHORT_ALL_KEY, {patient_id: added_ms}, nx=True)
+    for facet in FACETS:
+        value = profile.get(facet) or ""
+        old = (previous or {}).get(facet)
+        if old is not None and slug(old) != slug(value):
+            pipe.zrem(_facet_key(facet, old), patient_id)
+        if value:
+            pipe.zadd(_facet_key(facet, value), {patient_id: added_ms}, nx=True)
+            pipe.hsetnx(COHORT_LABELS_KEY.format(facet), slug(value), value)
+
+
+async def reindex_patient(r, patient_id: str, profile: Dict[str, Any]):
+    """index_patient for a patient that may already be indexed (seed re-runs, profile edits)."""
+    old = await r.hmget(PATIENT_KEY.format(patient_id), "surgeon", "procedure", "added")
+    previous = {f: v.decode() for f, v in zip(FACETS, old) if v is not None}
+    pipe = r.pipeline(transaction=False)
+    index_patient(pipe, patient_id, profile, int(old[2]) if old[2] else None, previous)
+    await pipe.execute()
+
+
+def record_alert(pipe, patient_id: str, ts_ms: int, reason: str = ""):
+    """Queues the last-alert update; GT keeps the newest when alerts race."""
+    pipe.zadd(COHORT_ALERT_KEY, {patient_id: ts_ms}, gt=True)
+    pipe.hset(PATIENT_KEY.format(patient_id), mapping={"last_alert": ts_ms, "last_alert_reason": reason})
+
+
+def encode_cursor(score: float, member: str) -> str:
+    return base64.urlsafe_b64encode(f"{int(score)}:{member}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Raises ValueError on a malformed cursor."""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    score, member = raw.split(":", 1)
+    return int(score), member
+
+
+async def _page(r, key: str, count: int, cursor: Optional[str], since_ms: int) -> List[Tuple[str, float]]:
+    """
+    Up to `count` members after the cursor, newest first. The cursor is the
+    last (score, member) returned: if that member still has that score the
+    page continues from its rank (exact even across equal scores), otherwise
+    from the next lower score.
+    """
+    if not cursor:
+        items = await r.zrevrangebyscore(key, "+inf", since_ms, start=0, num=count, withscores=True)
+    else:
+        score, member = decode_cursor(cursor)
+        pipe = r.pipeline(transaction=False)
+        pipe.zscore(key, member)
+        pipe.zrevrank(key, member)
+        current, rank = await pipe.execute()
+        if current is not None and int(current) == score and rank is not None:
+            items = await r.zrevrange(key, rank + 1, rank + count, withscores=True)
+            items = [(m, s) for m, s in items if s >= since_ms]
+        else:
+            items = await r.zrevrangebyscore(key, f"({score}", since_ms, start=0, num=count, withscores=True)
+    return [(m.decode() if isinstance(m, bytes) else m, s) for m, s in items]
+
+
+async def list_patients(r, surgeon: str = "", procedure: str = "", alerted: bool = False,
+                        since_ms: int = 0, limit: int = 50, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    One page of patient summaries, newest first (by last alert when
+    `alerted`, else by when they were added). Filters combine: the smallest
+    matching set is walked and membership in the others is checked per page.
+    """
+    limit = max(1, min(limit, COHORT_PAGE_MAX))
+    keys = ([COHORT_ALERT_KEY] if alerted else []) \
+        + ([_facet_key("surgeon", surgeon)] if surgeon else []) \
+        + ([_facet_key("procedure", procedure)] if procedure else [])
+    keys = keys or [COHORT_ALL_KEY]
+
+    pipe = r.pipeline(transaction=False)
+    for k in keys:
+        pipe.zcard(k)
+    sizes = await pipe.execute()
+    # Ordering follows the alert set when asked for; otherwise walk the smallest
+    base = keys[0] if alerted else min(keys, key=lambda k: sizes[keys.index(k)])
+    others = [k for k in keys if k != base]
+    total = sizes[keys.index(base)]
+
+    rows: List[Tuple[str, float]] = []
+    examined = 0
+    next_cursor = cursor
+    while len(rows) < limit and examined < COHORT_SCAN_BUDGET:
+        want = limit - len(rows) if not others else min(limit * 4, COHORT_PAGE_MAX * 4)
+        items = await _page(r, base, want, next_cursor, since_ms)
+        if not items:
+            next_cursor = None
+            break
+        examined += len(items)
+        if others:
+            pipe = r.pipeline(transaction=False)
+            for k in others:
+                pipe.zmscore(k, [m for m, _ in items])
+            member_scores = await pipe.execute()
+            keep = [all(s[i] is not None for s in member_scores) for i in range(len(items))]
+        else:
+            keep = [True] * len(items)
+        for i, (item, ok) in enumerate(zip(items, keep)):
+            next_cursor = encode_cursor(item[1], item[0])
+            if ok:
+                rows.append(item)
+                if len(rows) == limit:
+                    if i == len(items) - 1 and len(items) < want:
+                        next_cursor = None   # this was the last member
+                    break
+        else:
+            if len(items) < want:
+                next_cursor = None
+                break
+
+    return {"patients": await _summaries(r, rows), "next_cursor": next_cursor,
+            "total": total if not others else None}
+
+
+async def _summaries(r, rows: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
+    pipe = r.pipeline(transaction=False)
+    for pid, _ in rows:
+        pipe.hmget(PATIENT_KEY.format(pid), *SUMMARY_FIELDS)
+    out = []
+    for (pid, _), values in zip(rows, await pipe.execute() if rows else []):
+        d = {f: (v.decode() if v is not None else None) for f, v in zip(SUMMARY_FIELDS, values)}
+        for f in ("age", "added", "last_alert"):
+            d[f] = int(d[f]) if d[f] else None
+        out.append({"patient_id": pid, **d})
+    return out
+
+
+async def facets(r) -> Dict[str, List[Dict[str, Any]]]:
+    """Surgeons and procedures with patient counts, for filter pickers."""
+    out = {}
+    for facet in FACETS:
+        labels = {k.decode(): v.decode() for k, v in (await r.hgetall(COHORT_LABELS_KEY.format(facet))).items()}
+        pipe = r.pipeline(transaction=False)
+        for name in labels.values():
+            pipe.zcard(_facet_key(facet, name))
+        counts = await pipe.execute() if labels else []
+        out[facet] = sorted(({"name": name, "patients": n} for name, n in zip(labels.values(), counts) if n),
+                            key=lambda x: (-x["patients"], x["name"]))
+    return out
+
+
+async def backfill(r, batch: int = 500, alerts: bool = True) -> Dict[str, int]:
+    """Indexes every postop:patient:* hash, then last-alert times from the alert stream."""
+    from rag import scan_keys
+    from alerts import ALERT_STREAM
+
+    indexed = 0
+    async for _, keys in scan_keys(r, PATIENT_KEY.format("*"), batch):
+        if not keys:
+            continue
+        pipe = r.pipeline(transaction=False)
+        for k in keys:
+            pipe.hmget(k, "profile", "surgeon", "procedure", "added")
+        res = await pipe.execute()
+        pipe = r.pipeline(transaction=False)
+        for k, (raw, surgeon, procedure, added) in zip(keys, res):
+            if not raw:
+                continue
+            try:
+                profile = json.loads(raw)
+            except ValueError:
+                continue
+            pid = (k.decode() if isinstance(k, bytes) else k)[len(PATIENT_KEY.format("")):]
+            previous = {f: v.decode() for f, v in zip(FACETS, (surgeon, procedure)) if v is not None}
+            index_patient(pipe, pid, profile, int(added) if added else None, previous)
+            indexed += 1
+        await pipe.execute()
+
+    alerted = 0
+    if alerts:
+        start = "-"
+        while True:
+            entries = await r.xrange(ALERT_STREAM, min=start, max="+", count=batch)
+            if not entries:
+                break
+            pipe = r.pipeline(transaction=False)
+            for entry_id, fields in entries:
+                pid = fields.get(b"patient_id", b"").decode()
+                if pid:
+                    # Stream ids start with the append time in ms
+                    record_alert(pipe, pid, int(entry_id.split(b"-")[0]), fields.get(b"reason", b"").decode())
+                    alerted += 1
+            await pipe.execute()
+            last = entries[-1][0].decode()
+            ms, seq = last.split("-")
+            start = f"{ms}-{int(seq) + 1}"
+    return {"patients": indexed, "alerts": alerted}
+
+
+async def main(batch: int, alerts: bool):
+    from rag import get_redis
+    t0 = time.perf_counter()
+    stats = await backfill(await get_redis(), batch, alerts)
+    print(f"Indexed {stats['patients']} patients and {stats['alerts']} alerts in {time.perf_counter() - t0:.1f}s.")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build the doctor patient-list indexes")
+    ap.add_argument("--backfill", action="store_true", required=True)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--no-alerts", action="store_true", help="skip replaying the alert stream")
+    args = ap.parse_args()
+    asyncio.run(main(args.batch, not args.no_alerts))
@@ -0,0 +1,152 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from redisvl.query import FilterQuery
+from redisvl.query.filter import Tag
+
+from vecformat import VECTOR_QUANT, RERANK_CANDIDATES, from_bytes, quantize_int8, search_int8, shortlist_int8
+
+CONTEXT_STORE_MAX_PATIENTS = int(os.getenv("CONTEXT_STORE_MAX_PATIENTS", "20000"))
+CONTEXT_STORE_TTL_S = float(os.getenv("CONTEXT_STORE_TTL_S", "600"))
+CONTEXT_STORE_MAX_DOCS = int(os.getenv("CONTEXT_STORE_MAX_DOCS", "64"))
+
+
+class _Entry:
+    __slots__ = ("version", "loaded_at", "docs", "matrix", "codes", "scales")
+
+    def __init__(self, version: str, docs: List[Dict[str, Any]], matrix: np.ndarray):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.docs = docs
+        self.matrix: Optional[np.ndarray] = matrix
+        self.codes: Optional[np.ndarray] = None
+        self.scales: Optional[np.ndarray] = None
+        if VECTOR_QUANT == "int8" and len(matrix):
+            # A quarter of the float32 footprint; search re-ranks from Redis
+            self.codes, self.scales = quantize_int8(matrix)
+            self.matrix = None
+
+    def nbytes(self) -> int:
+        if self.codes is not None:
+            return self.codes.nbytes + self.scales.nbytes
+        return self.matrix.nbytes if self.matrix is not None else 0
+
+
+class PatientContextStore:
+    """
+    Per-patient in-process copy of doc texts and their normalized embeddings.
+
+    Each patient only has a handful of docs, so an exact dot product over a
+    (n_docs, dims) matrix is cheaper than an HNSW query against the shared
+    index. Entries are keyed by the patient's data version and reloaded
+    when it changes (see rag.bump_patient_version).
+
+    With VECTOR_QUANT=int8 the matrix is kept as int8 codes; a search
+    shortlists RERANK_CANDIDATES docs on the codes and re-scores them (all
+    of them, for patients with fewer docs) with the stored vectors fetched
+    from Redis, so ranks and distances are exact.
+    """
+    def __init__(self, vector_field: str, max_patients: int = CONTEXT_STORE_MAX_PATIENTS,
+                 ttl_s: float = CONTEXT_STORE_TTL_S):
+        self.vector_field = vector_field
+        self.vector_dtype = "float32"   # set with vector_field by rag on generation activation
+        self.max_patients = max_patients
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.loads = 0
+
+    def invalidate(self, patient_id: str):
+        self._entries.pop(patient_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def _load(self, r, index, patient_id: str, version: str) -> _Entry:
+        q = FilterQuery(
+            filter_expression=Tag("patient_id") == patient_id,
+            return_fields=["patient_id", "kind", "text"],
+            num_results=CONTEXT_STORE_MAX_DOCS,
+        )
+        docs = await index.query(q) or []
+        pipe = r.pipeline(transaction=False)
+        for d in docs:
+            pipe.hget(d["id"], self.vector_field)
+        raw_vecs = await pipe.execute() if docs else []
+
+        kept, rows = [], []
+        for d, raw in zip(docs, raw_vecs):
+            if not raw:
+                continue
+            text = d.get("text")
+            if isinstance(text, (bytes, bytearray)):
+                text = text.decode()
+            kept.append({"id": d["id"], "patient_id": patient_id, "kind": d.get("kind"), "text": text})
+            rows.append(from_bytes(raw, self.vector_dtype))
+        matrix = np.vstack(rows) if rows else np.zeros((0, 0), dtype="float32")
+
+        entry = _Entry(version, kept, matrix)
+        self._entries[patient_id] = entry
+        self._entries.move_to_end(patient_id)
+        while len(self._entries) > self.max_patients:
+            self._entries.popitem(last=False)
+        self.loads += 1
+        return entry
+
+    async def search(self, r, index, patient_id: str, qvec: np.ndarray, k: int,
+                     version: str) -> List[Dict[str, Any]]:
+        entry = self._entries.get(patient_id)
+        if (entry is None or entry.version != version
+                or time.monotonic() - entry.loaded_at > self.ttl_s):
+            entry = await self._load(r, index, patient_id, version)
+        else:
+            self._entries.move_to_end(patient_id)
+            self.hits += 1
+        if not entry.docs:
+            return []
+
+        if entry.codes is not None:
+            top, scores = await self._search_int8(r, entry, qvec, k)
+        else:
+            all_scores = entry.matrix @ np.asarray(qvec, dtype="float32")
+            top = np.argsort(-all_scores)[:k]
+            scores = all_scores[top]
+        out = []
+        for i, score in zip(top, scores):
+            hit = dict(entry.docs[i])
+            # Same meaning as RediSearch's cosine vector_distance
+            hit["vector_distance"] = float(1.0 - score)
+            out.append(hit)
+        return out
+
+    async def _search_int8(self, r, entry: _Entry, qvec: np.ndarray, k: int):
+        docs = entry.docs
+        # Always re-scored exactly, even when the shortlist is every doc (~5
+        # per patient): vector_distance feeds PROMPT_CONTEXT_MAX_DISTANCE, so
+        # it must not be an int8 approximation. One pipelined HGET round trip
+        candidates = shortlist_int8(entry.codes, entry.scales, qvec, max(k, RERANK_CANDIDATES))
+        pipe = r.pipeline(transaction=False)
+        for i in candidates:
+            pipe.hget(docs[i]["id"], self.vector_field)
+        raw_vecs = await pipe.execute()
+        rows, keep = [], []
+        for i, raw in zip(candidates, raw_vecs):
+            if raw:
+                rows.append(from_bytes(raw, self.vector_dtype))
+                keep.append(i)
+        if not rows:
+            # Docs vanished under us; fall back to the approximate scores
+            return search_int8(entry.codes, entry.scales, qvec, k)
+        scores = np.vstack(rows) @ np.asarray(qvec, dtype="float32")
+        order = np.argsort(-scores)[:k]
+        return np.asarray(keep)[order], scores[order]
+
+    def stats(self) -> dict:
+        return {
+            "patients": len(self._entries), "hits": self.hits, "loads": self.loads,
+            "quant": VECTOR_QUANT,
+            "vector_bytes": sum(e.nbytes() for e in self._entries.values()),
+        }
@@ -0,0 +1,123 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+from metrics import EMBED_QUEUE_DEPTH
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+# Document / bulk-import encodes get their own thread, so a 256-text import
+# chunk never sits in front of chat query embeddings
+EMBED_DOC_WORKERS = int(os.getenv("EMBED_DOC_WORKERS", "1"))
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent single-text embedding requests for up to
+    max_wait_ms (or batch_size items), encodes them as one batch in a
+    thread pool and resolves each caller's future. `encode(texts, model)`
+    gets the model the callers asked for (None: the current one).
+    """
+    def __init__(self, encode: Callable[[List[str], Optional[str]], "object"],
+                 batch_size: int = EMBED_BATCH_SIZE,
+                 max_wait_ms: float = EMBED_MAX_WAIT_MS,
+                 workers: int = EMBED_WORKERS,
+                 doc_workers: int = EMBED_DOC_WORKERS):
+        self.encode = encode
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="embed")
+        self.doc_executor = ThreadPoolExecutor(max_workers=doc_workers, thread_name_prefix="embed-docs")
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # counters
+        self.batches = 0
+        self.items = 0
+        self.max_batch = 0
+        self.encode_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def embed(self, text: str, model: Optional[str] = None):
+        """Returns the normalized float32 vector for a single text."""
+        self._ensure_started()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, model, fut))
+        EMBED_QUEUE_DEPTH.set(self._queue.qsize())
+        return await fut
+
+    async def embed_many(self, texts: List[str], model: Optional[str] = None):
+        """Encodes a caller-built document batch off the loop, beside (not ahead of) queries."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.doc_executor, self.encode, texts, model)
+
+    async def _collect(self) -> List[Tuple[str, Optional[str], asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            EMBED_QUEUE_DEPTH.set(self._queue.qsize())
+            # Callers normally share one model; a batch spanning a model swap is split
+            by_model: dict = {}
+            for t, m, f in batch:
+                if not f.cancelled():
+                    by_model.setdefault(m, []).append((t, f))
+            for model, live in by_model.items():
+                t0 = time.perf_counter()
+                try:
+                    vecs = await loop.run_in_executor(self.executor, self.encode, [t for t, _ in live], model)
+                except Exception as e:
+                    for _, f in live:
+                        if not f.done():
+                            f.set_exception(e)
+                    continue
+                self.encode_seconds += time.perf_counter() - t0
+                self.batches += 1
+                self.items += len(live)
+                self.max_batch = max(self.max_batch, len(live))
+                for (_, f), v in zip(live, vecs):
+                    if not f.done():
+                        f.set_result(v)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "encode_seconds": round(self.encode_seconds, 4),
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.executor.shutdown(wait=False)
+        self.doc_executor.shutdown(wait=False)
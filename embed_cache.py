@@ -0,0 +1,101 @@
+import os
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from textutil import normalize_text
+from metrics import CACHE_LOOKUPS
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "4096"))
+EMBED_CACHE_TTL_S = float(os.getenv("EMBED_CACHE_TTL_S", "3600"))
+EMBED_CACHE_REDIS_TTL_S = int(os.getenv("EMBED_CACHE_REDIS_TTL_S", str(7 * 24 * 3600)))
+EMBED_CACHE_REDIS = os.getenv("EMBED_CACHE_REDIS", "1") == "1"
+
+KEY_PREFIX = "postop:embcache:"
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for query embeddings keyed by (model, normalized text):
+    an in-process LRU with TTL, then a shared Redis tier of float32 bytes.
+    """
+    def __init__(self, model_name: str, size: int = EMBED_CACHE_SIZE,
+                 ttl_s: float = EMBED_CACHE_TTL_S,
+                 redis_ttl_s: int = EMBED_CACHE_REDIS_TTL_S,
+                 use_redis: bool = EMBED_CACHE_REDIS):
+        self.model_name = model_name
+        self.size = size
+        self.ttl_s = ttl_s
+        self.redis_ttl_s = redis_ttl_s
+        self.use_redis = use_redis
+        self._lru: "OrderedDict[str, tuple[float, np.ndarray]]" = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{KEY_PREFIX}{self.model_name}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[np.ndarray]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        ts, vec = item
+        if time.monotonic() - ts > self.ttl_s:
+            del self._lru[key]
+            return None
+        self._lru.move_to_end(key)
+        return vec
+
+    def _put_local(self, key: str, vec: np.ndarray):
+        self._lru[key] = (time.monotonic(), vec)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    async def get(self, r, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        vec = self._get_local(key)
+        if vec is not None:
+            self.local_hits += 1
+            CACHE_LOOKUPS.labels("embedding", "local_hit").inc()
+            return vec
+        if self.use_redis and r is not None:
+            try:
+                raw = await r.get(key)
+            except Exception as e:
+                print(f"Warning: embedding cache read failed: {e}")
+                raw = None
+            if raw:
+                vec = np.frombuffer(raw, dtype="float32")
+                self._put_local(key, vec)
+                self.redis_hits += 1
+                CACHE_LOOKUPS.labels("embedding", "redis_hit").inc()
+                return vec
+        self.misses += 1
+        CACHE_LOOKUPS.labels("embedding", "miss").inc()
+        return None
+
+    async def put(self, r, text: str, vec: np.ndarray):
+        key = self._key(text)
+        vec = np.asarray(vec, dtype="float32")
+        self._put_local(key, vec)
+        if self.use_redis and r is not None:
+            try:
+                await r.set(key, vec.tobytes(), ex=self.redis_ttl_s)
+            except Exception as e:
+                print(f"Warning: embedding cache write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._lru),
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,330 @@
+# eval_retrieval.py
+# Offline evaluation of the HNSW settings in schema.yaml and the chat top-k.
+# Generates synthetic patients (recombined from seed.PATIENTS) and labeled
+# questions, builds a throwaway index per m/ef_construction, and measures
+# recall@k against exact search, query latency and FT.INFO memory for every
+# ef_runtime and k. Writes a markdown report (plus JSON rows) to pick from.
+#
+#   python eval_retrieval.py --spawn-redis
+#   python eval_retrieval.py --redis-url redis://localhost:6379 --patients 5000 \
+#       --m 8,16,32 --ef-construction 100,200,400 --ef-runtime 10,20,50,100 -k 1,3,6,10
+#
+# Only eval:* keys are written; they are deleted at the end (--keep to inspect).
+import os, copy, json, time, random, asyncio, argparse
+from collections import defaultdict
+
+import numpy as np
+import yaml
+
+from rag import SCHEMA_PATH, build_patient_docs, embed, create_index
+from seed import PATIENTS
+from vecformat import VECTOR_DTYPE, to_bytes
+
+EVAL_INDEX = "eval:index:m{}:efc{}"
+EVAL_PREFIX = "eval:doc:"
+FIRST_NAMES = ["Alice", "Bob", "Carol", "Daniel", "Priya", "Omar", "Mei", "Jonas", "Fatima", "Luis",
+               "Grace", "Hiro", "Amara", "Sven", "Nadia", "Tomás", "Ines", "Kwame", "Olga", "Ravi"]
+LAST_NAMES = ["Lee", "Singh", "Wu", "Ortiz", "Patel", "Haddad", "Chen", "Berg", "Khan", "Garcia",
+              "Okafor", "Tanaka", "Novak", "Silva", "Rossi", "Dubois", "Kim", "Ivanova", "Mensah", "Brown"]
+SURGEONS = ["Dr. Patel", "Dr. Nguyen", "Dr. Green", "Dr. Johnson", "Dr. Okoye", "Dr. Lindqvist", "Dr. Haas"]
+
+# Questions patients actually ask, labeled with the doc kind that answers them.
+# {med}, {allergy}, {flag} and {surgeon} are filled from the patient's profile.
+QUESTIONS = {
+    "summary": ["what surgery did I have", "who is my surgeon", "what was my operation called",
+                "remind me what procedure {surgeon} did"],
+    "contacts": ["who do I call in an emergency", "what is the phone number for the ward",
+                 "who should I contact if something is wrong", "is there a number I can ring at night"],
+    "allergies": ["am I allergic to anything", "is it safe to take {allergy}",
+                  "what are my allergies", "the pharmacy asked about my allergies"],
+    "meds": ["when do I take my {med}", "how much {med} should I take", "what medications am I on",
+             "I forgot my pills this morning, what do I take", "how often should I take painkillers"],
+    "red_flags": ["what symptoms should worry me", "when should I go to the emergency room",
+                  "I have {flag}, is that bad", "what are the warning signs after surgery"],
+}
+
+
+def percentile(samples, p):
+    return float(np.percentile(samples, p) * 1000) if samples else 0.0
+
+
+def synthetic_patients(n: int, seed: int = 0):
+    """Profiles mixing the seed patients' procedures, meds, allergies and red flags."""
+    rng = random.Random(seed)
+    out = []
+    for i in range(n):
+        base = copy.deepcopy(rng.choice(PATIENTS)["profile"])
+        donor = rng.choice(PATIENTS)["profile"]
+        base["name"] = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+        base["age"] = rng.randint(18, 90)
+        base["surgeon"] = rng.choice(SURGEONS)
+        base["emergency_contact"] = {"name": base["emergency_contact"]["name"],
+                                     "phone": f"+1-555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"}
+        if rng.random() < 0.3:
+            base["allergies"] = sorted(set(base["allergies"]) | set(donor["allergies"]))
+        if rng.random() < 0.2:
+            base["allergies"] = []   # some docs sets have no allergies doc
+        meds = base["medications"] + [m for m in donor["medications"] if rng.random() < 0.3]
+        base["medications"] = rng.sample(meds, k=max(1, len(meds) - rng.randint(0, 1)))
+        flags = list(dict.fromkeys(base["red_flags"] + [f for f in donor["red_flags"] if rng.random() < 0.2]))
+        base["red_flags"] = rng.sample(flags, k=max(2, len(flags) - rng.randint(0, 2)))
+        out.append((f"eval{i}", base))
+    return out
+
+
+def labeled_questions(patients, per_patient: int, seed: int = 1):
+    """(patient_id, question, expected kind), only for kinds the patient has a doc for."""
+    rng = random.Random(seed)
+    out = []
+    for pid, profile in patients:
+        kinds = [k for k in QUESTIONS if k != "allergies" or [a for a in profile["allergies"] if a != "none"]]
+        for kind in rng.sample(kinds, k=min(per_patient, len(kinds))):
+            q = rng.choice(QUESTIONS[kind]).format(
+                med=rng.choice(profile["medications"])["name"].lower(),
+                allergy=(profile["allergies"] or ["penicillin"])[0],
+                flag=rng.choice(profile["red_flags"]).split(">")[0].strip(),
+                surgeon=profile["surgeon"])
+            out.append((pid, q, kind))
+    return out
+
+
+def eval_schema(m: int, ef_construction: int, dims: int) -> dict:
+    with open(SCHEMA_PATH) as f:
+        schema = yaml.safe_load(f)
+    schema["index"]["name"] = EVAL_INDEX.format(m, ef_construction)
+    schema["index"]["prefix"] = EVAL_PREFIX
+    for fl in schema["fields"]:
+        if fl["type"] == "vector":
+            fl["attrs"].update(dims=dims, m=m, ef_construction=ef_construction)
+    return schema
+
+
+def vector_field(schema: dict) -> str:
+    return next(fl["name"] for fl in schema["fields"] if fl["type"] == "vector")
+
+
+async def load_docs(r, docs, vecs, field: str, batch: int = 1000):
+    for i in range(0, len(docs), batch):
+        pipe = r.pipeline(transaction=False)
+        for d, v in zip(docs[i:i + batch], vecs[i:i + batch]):
+            pipe.hset(d["key"], mapping={"patient_id": d["patient_id"], "kind": d["kind"],
+                                         "text": d["text"], field: to_bytes(v)})
+        await pipe.execute()
+
+
+async def build(r, schema: dict):
+    """Creates the index over the loaded eval docs; returns (index, build seconds, FT.INFO)."""
+    from redisvl.index import AsyncSearchIndex
+    index = AsyncSearchIndex.from_dict(schema)
+    await index.set_client(r)
+    if await index.exists():
+        await index.delete(drop=False)
+    t0 = time.perf_counter()
+    await create_index(index)
+    while True:
+        info = await index.info()
+        if not int(info.get("indexing", 0)) and float(info.get("percent_indexed", 1)) >= 1:
+            return index, time.perf_counter() - t0, info
+        await asyncio.sleep(0.2)
+
+
+def exact_topk(docs_matrix, rows, qvec, k):
+    scores = docs_matrix[rows] @ qvec
+    return [rows[i] for i in np.argsort(-scores)[:k]]
+
+
+async def knn(r, index_name: str, field: str, qblob: bytes, k: int, ef: int, patient_id=None):
+    from redis.commands.search.query import Query
+    prefilter = f"(@patient_id:{{{patient_id}}})" if patient_id else "*"
+    q = (Query(f"{prefilter}=>[KNN {k} @{field} $vec EF_RUNTIME {ef} AS dist]")
+         .sort_by("dist").return_fields("kind", "dist").paging(0, k).dialect(2))
+    t0 = time.perf_counter()
+    res = await r.ft(index_name).search(q, query_params={"vec": qblob})
+    return res.docs, time.perf_counter() - t0
+
+
+async def evaluate(r, args):
+    patients = synthetic_patients(args.patients, args.seed)
+    questions = labeled_questions(patients, args.questions_per_patient, args.seed + 1)
+    if args.max_queries and len(questions) > args.max_queries:
+        questions = random.Random(args.seed).sample(questions, args.max_queries)
+
+    docs = []
+    for pid, profile in patients:
+        for d in build_patient_docs(pid, profile):
+            d["key"] = EVAL_PREFIX + d["id"].split(":", 2)[2]
+            docs.append(d)
+    print(f"{len(patients)} patients, {len(docs)} docs, {len(questions)} labeled questions")
+
+    t0 = time.perf_counter()
+    doc_vecs = embed([d["text"] for d in docs])
+    q_vecs = embed([q for _, q, _ in questions])
+    print(f"Embedded in {time.perf_counter() - t0:.1f}s")
+
+    # Exact ground truth, computed once: filtered per patient (what /chat does)
+    # and over the whole corpus (what stresses the HNSW graph)
+    key_row = {d["key"]: i for i, d in enumerate(docs)}
+    rows_by_patient = defaultdict(list)
+    for i, d in enumerate(docs):
+        rows_by_patient[d["patient_id"]].append(i)
+    all_rows = list(range(len(docs)))
+    kmax = max(args.k)
+    truth = {"patient": [], "global": []}
+    for (pid, _, _), qv in zip(questions, q_vecs):
+        truth["patient"].append(exact_topk(doc_vecs, rows_by_patient[pid], qv, kmax))
+        truth["global"].append(exact_topk(doc_vecs, all_rows, qv, kmax))
+
+    # How often the labeled doc is retrieved at all, and what each k costs in prompt
+    label_rows = []
+    for k in args.k:
+        hit = np.mean([any(docs[i]["kind"] == kind for i in truth["patient"][qi][:k])
+                       for qi, (_, _, kind) in enumerate(questions)])
+        top1 = np.mean([docs[truth["patient"][qi][0]]["kind"] == kind for qi, (_, _, kind) in enumerate(questions)])
+        tokens = np.mean([sum(len(docs[i]["text"]) // 4 for i in truth["patient"][qi][:k])
+                          for qi in range(len(questions))])
+        label_rows.append({"k": k, "label_hit": float(hit), "label_top1": float(top1), "context_tokens": float(tokens)})
+
+    qblobs = [to_bytes(v) for v in q_vecs]
+    rows = []
+    base_schema = eval_schema(args.m[0], args.ef_construction[0], doc_vecs.shape[1])
+    field = vector_field(base_schema)
+    await load_docs(r, docs, doc_vecs, field)
+    for m in args.m:
+        for efc in args.ef_construction:
+            schema = eval_schema(m, efc, doc_vecs.shape[1])
+            index, build_s, info = await build(r, schema)
+            mem_mb = float(info.get("vector_index_sz_mb", 0))
+            print(f"m={m} ef_construction={efc}: built in {build_s:.1f}s, vector_index_sz_mb={mem_mb:.2f}")
+            for scope in args.scopes:
+                for ef in args.ef_runtime:
+                    for k in args.k:
+                        recalls, samples = [], []
+                        for qi, (pid, _, _) in enumerate(questions):
+                            hits, secs = await knn(r, index.name, field, qblobs[qi], k, ef,
+                                                   pid if scope == "patient" else None)
+                            samples.append(secs)
+                            expected = set(truth[scope][qi][:k])
+                            got = {key_row.get(h.id) for h in hits}
+                            recalls.append(len(expected & got) / max(1, len(expected)))
+                        rows.append({"scope": scope, "m": m, "ef_construction": efc, "ef_runtime": ef, "k": k,
+                                     "recall": float(np.mean(recalls)), "p50_ms": percentile(samples, 50),
+                                     "p95_ms": percentile(samples, 95), "p99_ms": percentile(samples, 99),
+                                     "index_mb": mem_mb, "build_s": build_s})
+            await index.delete(drop=False)
+    return {"patients": len(patients), "docs": len(docs), "queries": len(questions),
+            "dtype": VECTOR_DTYPE, "labels": label_rows, "rows": rows}
+
+
+def recommend(rows, scope: str, k: int, target: float):
+    """Cheapest setting (memory, then p95) that reaches the recall target at k."""
+    ok = [x for x in rows if x["scope"] == scope and x["k"] == k and x["recall"] >= target]
+    return min(ok, key=lambda x: (x["index_mb"], x["p95_ms"], x["ef_runtime"])) if ok else None
+
+
+def report(result, args) -> str:
+    lines = [
+        "# Retrieval evaluation",
+        "",
+        f"{result['patients']} synthetic patients, {result['docs']} docs, {result['queries']} labeled questions, "
+        f"vectors stored as {result['dtype']}. Recall is against exact (brute-force) search over the same vectors.",
+        "",
+        "`patient` scope is what /chat runs (KNN filtered to one patient's docs); `global` searches every doc "
+        "and is where m / ef_construction / ef_runtime actually matter. With only a handful of docs per patient "
+        "RediSearch usually answers the filtered query by brute force, so patient-scope recall is expected to be "
+        "flat across HNSW settings.",
+        "",
+        "## Choosing k",
+        "",
+        "| k | labeled doc in top-k | labeled doc is top-1 | avg context tokens |",
+        "|---|---|---|---|",
+    ]
+    for x in result["labels"]:
+        lines.append(f"| {x['k']} | {x['label_hit']:.3f} | {x['label_top1']:.3f} | {x['context_tokens']:.0f} |")
+    good_k = [x["k"] for x in result["labels"] if x["label_hit"] >= args.target_hit]
+    lines += ["", f"Smallest k with labeled-doc hit rate >= {args.target_hit}: "
+                  f"**{min(good_k) if good_k else 'none'}** (chat currently uses RAG_TOP_K)."]
+
+    lines += ["", "## Recommended HNSW settings", ""]
+    for scope in args.scopes:
+        for k in args.k:
+            best = recommend(result["rows"], scope, k, args.target_recall)
+            lines.append(f"- {scope}, k={k}: " + (
+                f"m={best['m']}, ef_construction={best['ef_construction']}, ef_runtime={best['ef_runtime']} "
+                f"(recall {best['recall']:.4f}, p95 {best['p95_ms']:.2f}ms, {best['index_mb']:.2f}MB)"
+                if best else f"nothing reached recall {args.target_recall}"))
+
+    for scope in args.scopes:
+        lines += ["", f"## {scope} scope", "",
+                  "| m | ef_construction | ef_runtime | k | recall@k | p50 ms | p95 ms | p99 ms | index MB | build s |",
+                  "|---|---|---|---|---|---|---|---|---|---|"]
+        for x in result["rows"]:
+            if x["scope"] == scope:
+                lines.append(f"| {x['m']} | {x['ef_construction']} | {x['ef_runtime']} | {x['k']} | "
+                             f"{x['recall']:.4f} | {x['p50_ms']:.2f} | {x['p95_ms']:.2f} | {x['p99_ms']:.2f} | "
+                             f"{x['index_mb']:.2f} | {x['build_s']:.1f} |")
+    lines += ["", "Apply a choice by editing m / ef_construction (and ef_runtime) in schema.yaml and running "
+                  "`python reindex.py`; set RAG_TOP_K for k."]
+    return "\n".join(lines) + "\n"
+
+
+async def cleanup(r):
+    from rag import scan_keys
+    async for _, keys in scan_keys(r, f"{EVAL_PREFIX}*", 1000):
+        if keys:
+            await r.delete(*keys)
+
+
+async def main(args):
+    import redis.asyncio as redis
+    r = redis.Redis.from_url(os.environ["REDIS_URL"])
+    try:
+        result = await evaluate(r, args)
+    finally:
+        if not args.keep:
+            await cleanup(r)
+        await r.aclose()
+    with open(args.out, "w") as f:
+        f.write(report(result, args))
+    with open(os.path.splitext(args.out)[0] + ".json", "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+def ints(s: str):
+    return [int(x) for x in s.split(",") if x]
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Recall / latency / memory of HNSW settings on synthetic patients")
+    ap.add_argument("--patients", type=int, default=2000)
+    ap.add_argument("--questions-per-patient", type=int, default=2)
+    ap.add_argument("--max-queries", type=int, default=1000, help="0 = every generated question")
+    ap.add_argument("--m", type=ints, default=[8, 16, 32])
+    ap.add_argument("--ef-construction", type=ints, default=[100, 200, 400])
+    ap.add_argument("--ef-runtime", type=ints, default=[10, 50, 100])
+    ap.add_argument("-k", type=ints, default=[1, 3, 6])
+    ap.add_argument("--scopes", type=lambda s: s.split(","), default=["patient", "global"])
+    ap.add_argument("--target-recall", type=float, default=0.99)
+    ap.add_argument("--target-hit", type=float, default=0.95)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="eval_report.md")
+    ap.add_argument("--keep", action="store_true", help="leave the eval:* docs in Redis")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--redis-url")
+    g.add_argument("--spawn-redis", action="store_true", help="start a throwaway local redis-stack-server")
+    args = ap.parse_args()
+
+    proc = None
+    if args.spawn_redis:
+        from loadtest import spawn_redis
+        proc, os.environ["REDIS_URL"] = spawn_redis()
+    elif args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    else:
+        from rag import REDIS_URL
+        os.environ.setdefault("REDIS_URL", REDIS_URL)
+    try:
+        asyncio.run(main(args))
+    finally:
+        if proc:
+            proc.terminate()
@@ -0,0 +1,38 @@
+# gunicorn.conf.py
+# Prometheus multiprocess mode: each worker writes metric files to
+# PROMETHEUS_MULTIPROC_DIR and /metrics aggregates them.
+import os, gc, glob
+
+bind = "0.0.0.0:7860"
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Import the app (and, with EMBED_PRELOAD=1, the embedding model) once in the
+# master so workers share the weights copy-on-write after fork.
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def _reset_metrics_dir():
+    # Runs when this file is loaded, i.e. before a preloaded app imports
+    # metrics.py (which opens <dir>/*.db straight away). Stale files from a
+    # previous run would be summed into the new totals.
+    d = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if d:
+        os.makedirs(d, exist_ok=True)
+        for f in glob.glob(os.path.join(d, "*.db")):
+            os.remove(f)
+
+
+_reset_metrics_dir()
+
+
+def when_ready(server):
+    # Move preloaded objects out of the GC's reach so collections in the
+    # workers don't touch (and un-share) their pages.
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,50 @@
+import re
+from typing import Optional
+
+from textutil import normalize_text
+
+# Canonical small-talk replies. Each pattern must match the WHOLE normalized
+# message, so "hi, my wound is bleeding" still goes through triage.
+# Add a row here to extend the fast path.
+INTENT_RULES = [
+    {
+        "name": "greeting",
+        "patterns": [
+            r"(hi|hello|hey|hiya|howdy)( there)?( (doc|doctor|team|bot|nurse))?",
+            r"good (morning|afternoon|evening)( (doc|doctor|team))?",
+        ],
+        "reply": "Hello! I'm here to help with your post-operative questions. We are here for you if you need anything.",
+    },
+    {
+        "name": "thanks",
+        "patterns": [
+            r"(thanks|thank you|thank u|thx|ty)( (so|very) much| a lot| again)?( (doc|doctor|team))?",
+            r"(ok|okay|great|perfect)[,.!]? (thanks|thank you)",
+        ],
+        "reply": "You're very welcome! We are here for you if you have any other questions.",
+    },
+    {
+        "name": "goodbye",
+        "patterns": [
+            r"(bye|goodbye|good bye|bye bye|see you|see ya)( (now|for now|then))?",
+            r"good ?night",
+        ],
+        "reply": "Goodbye! Take care and please remember to stay on track with your prescribed medications. We are here for you.",
+    },
+]
+
+_COMPILED = [
+    (rule, re.compile("|".join(f"(?:{p})" for p in rule["patterns"])))
+    for rule in INTENT_RULES
+]
+
+
+def classify(message: str) -> Optional[dict]:
+    """Returns the matching rule for pure small-talk messages, else None."""
+    text = normalize_text(message)
+    if not text or len(text) > 40:
+        return None
+    for rule, rx in _COMPILED:
+        if rx.fullmatch(text):
+            return rule
+    return None
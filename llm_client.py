@@ -1,34 +1,224 @@
 import os
-import google.generativeai as genai 
+import json
+import random
+import asyncio
+import google.generativeai as genai
+from google.api_core import exceptions as gexc
+
+from metrics import LLM_INFLIGHT
 
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
+# "gemini" talks to the real API, "fake" answers in-process (load tests, offline dev)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "20"))          # overall deadline per chat
+LLM_ATTEMPT_TIMEOUT_S = float(os.getenv("LLM_ATTEMPT_TIMEOUT_S", "12"))
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "16"))      # per worker
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_S = float(os.getenv("LLM_RETRY_BASE_S", "0.25"))
+
+FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "300"))
+FAKE_LLM_JITTER_MS = float(os.getenv("FAKE_LLM_JITTER_MS", "0"))
+FAKE_LLM_RESPONSE = os.getenv("FAKE_LLM_RESPONSE", json.dumps({
+    "triage_level": 1,
+    "assistant": "This sounds like a normal part of recovery. Keep following your care plan and reach out if anything changes.",
+    "alert": False,
+}))
+
+# Returned (as model output) when the deadline passes, so the caller's normal
+# JSON parsing path still produces a well-formed answer.
+FALLBACK_RESPONSE = json.dumps({
+    "triage_level": 2,
+    "assistant": "Sorry, I'm taking longer than expected to answer. If your symptoms are worsening, please contact your care team directly.",
+    "alert": False,
+})
+
+TRANSIENT_ERRORS = (
+    gexc.ResourceExhausted,
+    gexc.ServiceUnavailable,
+    gexc.InternalServerError,
+    gexc.DeadlineExceeded,
+    gexc.TooManyRequests,
+    asyncio.TimeoutError,
+    ConnectionError,
+)
+
 _client = None
 def get_client():
     global _client
     if _client is None:
-        api_key = os.getenv("GEMINI_API_KEY") 
+        api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set.")
-        genai.configure(api_key=api_key) 
+        genai.configure(api_key=api_key)
         _client = genai
 
     return _client
 
-def chat_llm(system_prompt: str, user: str) -> str:
+
+class GeminiBackend:
+    def __init__(self, model_name: str = GEMINI_MODEL):
+        self.model_name = model_name
+        self._models = {}
+
+    def model(self, system: str):
+        # One GenerativeModel per system instruction (the triage template, the
+        # memory summarizer), built once and reused; the instruction then
+        # stays a byte-identical prefix across calls
+        if system not in self._models:
+            self._models[system] = get_client().GenerativeModel(
+                self.model_name, system_instruction=system or None)
+        return self._models[system]
+
+    async def generate(self, system: str, user: str) -> str:
+        resp = await self.model(system).generate_content_async(
+            contents=[{"role": "user", "parts": [{"text": user}]}],
+        )
+        try:
+            return resp.text.strip()
+        except (AttributeError, ValueError):
+            print(f"Warning: Could not extract text from Gemini response: {resp}")
+            return "(Could not generate a response)"
+
+    async def stream(self, system: str, user: str):
+        resp = await self.model(system).generate_content_async(
+            contents=[{"role": "user", "parts": [{"text": user}]}],
+            stream=True,
+        )
+        async for chunk in resp:
+            try:
+                text = chunk.text
+            except (AttributeError, ValueError):
+                continue
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """In-process stand-in with configurable latency and a canned JSON reply."""
+    def __init__(self, latency_ms: float = FAKE_LLM_LATENCY_MS,
+                 jitter_ms: float = FAKE_LLM_JITTER_MS,
+                 response: str = FAKE_LLM_RESPONSE):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.response = response
+
+    async def generate(self, system: str, user: str) -> str:
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        await asyncio.sleep(delay / 1000.0)
+        return self.response
+
+    async def stream(self, system: str, user: str, chunk_chars: int = 12):
+        # Spread the latency: time-to-first-token is a fifth of the total
+        delay = (self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000.0
+        chunks = [self.response[i:i + chunk_chars] for i in range(0, len(self.response), chunk_chars)]
+        await asyncio.sleep(delay / 5)
+        per_chunk = (delay * 4 / 5) / max(1, len(chunks))
+        for c in chunks:
+            yield c
+            await asyncio.sleep(per_chunk)
+
+
+_backend = None
+_semaphore = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = FakeBackend() if LLM_BACKEND == "fake" else GeminiBackend()
+    return _backend
+
+def set_backend(backend):
+    """Swap the backend (e.g. a FakeBackend in benchmarks)."""
+    global _backend
+    _backend = backend
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+    return _semaphore
+
+async def _generate_with_retries(backend, system: str, user: str) -> str:
+    attempt = 0
+    while True:
+        try:
+            return await asyncio.wait_for(backend.generate(system, user), LLM_ATTEMPT_TIMEOUT_S)
+        except TRANSIENT_ERRORS as e:
+            if attempt >= LLM_MAX_RETRIES:
+                raise
+            # Full jitter exponential backoff
+            delay = random.uniform(0, LLM_RETRY_BASE_S * (2 ** attempt))
+            print(f"Warning: transient LLM error ({type(e).__name__}), retrying in {delay:.2f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+async def _bounded_generate(system: str, user: str) -> str:
+    async with _get_semaphore():
+        LLM_INFLIGHT.inc()
+        try:
+            return await _generate_with_retries(get_backend(), system, user)
+        finally:
+            LLM_INFLIGHT.dec()
+
+async def chat_llm(system_prompt: str, user: str) -> str:
+    """
+    Simple text-in/text-out, bounded by LLM_TIMEOUT_S and LLM_MAX_INFLIGHT.
+    system_prompt goes out as the model's system instruction, user as the turn.
+    Returns FALLBACK_RESPONSE if no answer arrives in time.
+    """
+    try:
+        # The deadline covers queueing for the semaphore as well as retries
+        return await asyncio.wait_for(_bounded_generate(system_prompt, user), LLM_TIMEOUT_S)
+    except TRANSIENT_ERRORS as e:
+        print(f"Warning: LLM call failed ({type(e).__name__}), using fallback answer")
+        return FALLBACK_RESPONSE
+
+async def stream_llm(system_prompt: str, user: str):
     """
-    Simple text-in/text-out.
+    Streaming variant of chat_llm: yields text chunks as the model produces
+    them. Transient errors are retried only before the first chunk; if
+    nothing arrives by the deadline, FALLBACK_RESPONSE is yielded instead.
     """
-    client = get_client()
-    model = client.GenerativeModel(GEMINI_MODEL) 
-    
-    resp = model.generate_content(
-        contents=[
-            {"role": "user", "parts": [{"text": f"{system_prompt}\n\nUSER: {user}"}]}
-        ],
-    )
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_TIMEOUT_S
+    sem = _get_semaphore()
+    try:
+        await asyncio.wait_for(sem.acquire(), LLM_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        print("Warning: LLM queue wait exceeded deadline, using fallback answer")
+        yield FALLBACK_RESPONSE
+        return
+    LLM_INFLIGHT.inc()
     try:
-        return resp.text.strip()
-    except (AttributeError, ValueError):
-        print(f"Warning: Could not extract text from Gemini response: {resp}")
-        return "(Could not generate a response)"
\ No newline at end of file
+        attempt = 0
+        emitted = False
+        while True:
+            agen = get_backend().stream(system_prompt, user).__aiter__()
+            try:
+                while True:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        chunk = await asyncio.wait_for(agen.__anext__(), remaining)
+                    except StopAsyncIteration:
+                        return
+                    emitted = True
+                    yield chunk
+            except TRANSIENT_ERRORS as e:
+                if emitted:
+                    print(f"Warning: LLM stream interrupted ({type(e).__name__})")
+                    return
+                if attempt >= LLM_MAX_RETRIES or deadline - loop.time() <= 0:
+                    print(f"Warning: LLM stream failed ({type(e).__name__}), using fallback answer")
+                    yield FALLBACK_RESPONSE
+                    return
+                delay = random.uniform(0, LLM_RETRY_BASE_S * (2 ** attempt))
+                attempt += 1
+                await asyncio.sleep(delay)
+            finally:
+                await agen.aclose()
+    finally:
+        LLM_INFLIGHT.dec()
+        sem.release()
@@ -0,0 +1,201 @@
+# loadtest.py
+# Offline latency benchmark for /auth/login, /chat and /admin/add_patient.
+# Drives the real FastAPI app in-process (httpx ASGI transport) with a fake LLM
+# and a throwaway local Redis Stack, then prints p50/p95/p99 and throughput.
+#
+#   python loadtest.py --spawn-redis --concurrency 32 --requests 500
+#   python loadtest.py --redis-url redis://localhost:6379 --llm-latency-ms 800
+import os, sys, time, shutil, socket, asyncio, argparse, itertools, tempfile, subprocess
+
+CHAT_MESSAGES = [
+    "hi",
+    "is this pain normal",
+    "when do I take my meds",
+    "can I shower today",
+    "my incision is a little red",
+    "I feel nauseous after my medication",
+    "thank you",
+    "is it normal to have bruising",
+]
+
+
+def percentile(sorted_vals, p):
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100.0 * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.shed = 0          # 429s: admission control working, not failures
+        self.wall = 0.0
+
+    def report(self) -> str:
+        lat = sorted(x * 1000 for x in self.latencies)   # served requests only
+        n = len(lat)
+        rps = n / self.wall if self.wall else 0.0
+        mean = sum(lat) / n if n else 0.0
+        return (f"{self.name:12s} n={n:5d} err={self.errors:4d} 429={self.shed:4d}  mean={mean:8.1f}ms  "
+                f"p50={percentile(lat, 50):8.1f}ms  p95={percentile(lat, 95):8.1f}ms  "
+                f"p99={percentile(lat, 99):8.1f}ms  {rps:8.1f} req/s")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_redis():
+    binary = shutil.which("redis-stack-server")
+    if not binary:
+        sys.exit("redis-stack-server not found on PATH; install Redis Stack or pass --redis-url "
+                 "(e.g. docker run -p 6379:6379 redis/redis-stack-server)")
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix="postop-bench-")
+    proc = subprocess.Popen([binary, "--port", str(port), "--dir", workdir, "--save", "", "--appendonly", "no"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return proc, f"redis://127.0.0.1:{port}"
+
+
+async def loop_lag_monitor(samples, interval=0.01):
+    """Records how late the loop wakes up; large values mean something blocked it."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - t0 - interval)
+
+
+async def run_stage(stage: Stage, total: int, concurrency: int, make_request):
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            i = next(counter)
+            if i >= total:
+                return
+            t0 = time.perf_counter()
+            try:
+                res = await make_request(i)
+                status = res.status_code
+            except Exception as e:
+                print(f"{stage.name}: {type(e).__name__}: {e}")
+                status = 0
+            if status == 429:
+                stage.shed += 1
+                continue
+            stage.latencies.append(time.perf_counter() - t0)
+            if not 0 < status < 400:
+                stage.errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    stage.wall = time.perf_counter() - t0
+
+
+async def main(args):
+    import httpx
+    from app import app
+    import llm_client
+    import seed as seeder
+
+    llm_client.set_backend(llm_client.FakeBackend(
+        latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms,
+        response=args.llm_response or llm_client.FAKE_LLM_RESPONSE))
+
+    lag = []
+    stages = []
+    async with app.router.lifespan_context(app):
+        await seeder.main()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            monitor = asyncio.create_task(loop_lag_monitor(lag))
+            patients = seeder.PATIENTS
+
+            async def login(i):
+                p = patients[i % len(patients)]
+                return await client.post("/auth/login", json={"user_id": p["user_id"], "password": p["password"]})
+
+            tokens = []
+            for p in patients:
+                res = await client.post("/auth/login", json={"user_id": p["user_id"], "password": p["password"]})
+                tokens.append(res.json()["access_token"])
+            doc = await client.post("/auth/login", json={"user_id": "admin", "password": "test123"})
+            doctor_token = doc.json()["access_token"]
+
+            async def chat(i):
+                return await client.post(
+                    "/chat", json={"message": CHAT_MESSAGES[i % len(CHAT_MESSAGES)]},
+                    headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"})
+
+            run_id = int(time.time())
+
+            async def add_patient(i):
+                pid = f"bench-{run_id}-{i}"
+                return await client.post("/admin/add_patient", headers={"Authorization": f"Bearer {doctor_token}"}, json={
+                    "user_id": pid, "patient_id": pid, "name": f"Bench Patient {i}", "age": 50,
+                    "surgeon": "Dr. Bench", "procedure": "Appendectomy",
+                    "emergency_name": "Surgery Desk", "emergency_phone": "+1-555-000-0000",
+                    "allergies": ["none"],
+                    "medications": [{"name": "Ibuprofen", "dose": "400mg", "freq": "q6h prn pain"}],
+                    "red_flags": ["fever > 38.5°C", "wound drainage"],
+                })
+
+            plan = {"login": login, "chat": chat, "add_patient": add_patient}
+            for name in args.stages.split(","):
+                stage = Stage(name)
+                n = args.requests if name != "add_patient" else max(1, args.requests // 10)
+                await run_stage(stage, n, args.concurrency, plan[name])
+                stages.append(stage)
+            monitor.cancel()
+
+    print(f"\nconcurrency={args.concurrency} llm_latency={args.llm_latency_ms}ms")
+    for s in stages:
+        print(s.report())
+    lag_ms = sorted(x * 1000 for x in lag)
+    print(f"{'loop lag':12s} p50={percentile(lag_ms, 50):.1f}ms  p99={percentile(lag_ms, 99):.1f}ms  "
+          f"max={lag_ms[-1] if lag_ms else 0:.1f}ms")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Offline latency benchmark for the post-op bot")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=200, help="per stage (add_patient runs a tenth)")
+    ap.add_argument("--stages", default="login,chat,add_patient")
+    ap.add_argument("--llm-latency-ms", type=float, default=300)
+    ap.add_argument("--llm-jitter-ms", type=float, default=100)
+    ap.add_argument("--llm-response", help="canned JSON the fake LLM returns")
+    ap.add_argument("--rate-limits", action="store_true",
+                    help="keep the per-patient/doctor token buckets (off by default: a few seeded "
+                         "patients would otherwise be shed)")
+    g = ap.add_mutually_exclusive_group()
+    g.add_argument("--redis-url")
+    g.add_argument("--spawn-redis", action="store_true", help="start a throwaway local redis-stack-server")
+    args = ap.parse_args()
+
+    proc = None
+    if args.spawn_redis:
+        proc, os.environ["REDIS_URL"] = spawn_redis()
+    elif args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    os.environ["LLM_BACKEND"] = "fake"
+    if not args.rate_limits:
+        # Read by ratelimit.py at import, i.e. before main() imports the app
+        os.environ["RATE_PATIENT_PER_MIN"] = "0"
+        os.environ["RATE_DOCTOR_PER_MIN"] = "0"
+    try:
+        asyncio.run(main(args))
+    finally:
+        if proc:
+            proc.terminate()
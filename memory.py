@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import asyncio
+from typing import Any, Dict, Set
+
+from llm_client import chat_llm, FALLBACK_RESPONSE
+from metrics import stage
+from ratelimit import acquire_llm_slot, release_llm_slot
+
+# Per-patient conversation memory. Recent turns live in a capped Redis list;
+# once they add up to more than CONV_TOKEN_BUDGET, the oldest ones are folded
+# into a rolling summary in the background. The prompt only ever carries the
+# summary plus the last CONV_RECENT_TURNS turns, so it stays bounded however
+# long the recovery conversation runs.
+CONV_KEY = "postop:conv:{}"               # list of JSON turns, oldest first
+CONV_META_KEY = "postop:conv:meta:{}"     # hash: summary, tokens (unsummarized), summarized
+CONV_LOCK_KEY = "postop:conv:lock:{}"
+CONV_RECENT_TURNS = int(os.getenv("CONV_RECENT_TURNS", "6"))          # turns in the prompt
+CONV_MAX_TURNS = int(os.getenv("CONV_MAX_TURNS", "60"))               # hard cap on the list
+CONV_TOKEN_BUDGET = int(os.getenv("CONV_TOKEN_BUDGET", "800"))        # compact above this
+CONV_TURN_MAX_CHARS = int(os.getenv("CONV_TURN_MAX_CHARS", "600"))
+CONV_SUMMARY_MAX_CHARS = int(os.getenv("CONV_SUMMARY_MAX_CHARS", "1200"))
+CONV_TTL_S = int(os.getenv("CONV_TTL_S", str(30 * 24 * 3600)))
+CONV_LOCK_TTL_S = int(os.getenv("CONV_LOCK_TTL_S", "60"))
+
+SUMMARY_PROMPT = """
+    You maintain a running summary of a post-operative patient's conversation with their care assistant.
+    Merge the previous summary and the new turns into ONE updated summary of at most 120 words.
+    Keep symptoms (with dates/values), what the patient was advised, triage levels and any open questions.
+    Drop greetings and small talk. Reply with the summary text only, no JSON, no preamble.
+"""
+
+# Trims the summarized turns and recounts the tokens of what is left, in
+# one step, so the counter can't drift from the list (e.g. after turns were
+# dropped by the CONV_MAX_TURNS cap). Each turn carries the estimate
+# record_turns added for it; older turns without one are estimated here in
+# characters, not bytes (Lua string.len would overcount "°C" or accents).
+_COMPACT_LUA = """
+redis.call('LTRIM', KEYS[1], ARGV[1], -1)
+local tokens = 0
+for _, raw in ipairs(redis.call('LRANGE', KEYS[1], 0, -1)) do
+  local ok, turn = pcall(cjson.decode, raw)
+  if ok and type(turn) == 'table' then
+    if type(turn.tokens) == 'number' then
+      tokens = tokens + turn.tokens
+    elseif type(turn.text) == 'string' then
+      local chars = select(2, string.gsub(turn.text, '[^\\128-\\191]', ''))
+      tokens = tokens + math.max(1, math.floor(chars / 4))
+    end
+  end
+end
+redis.call('HSET', KEYS[2], 'summary', ARGV[2], 'updated', ARGV[3], 'tokens', tokens)
+redis.call('HINCRBY', KEYS[2], 'summarized', ARGV[1])
+return tokens
+"""
+
+_tasks: Set[asyncio.Task] = set()
+_compact_script = None
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting English text
+    return max(1, len(text) // 4)
+
+
+def _turn_tokens(turn: Dict[str, Any]) -> int:
+    return turn.get("tokens") or estimate_tokens(turn.get("text", ""))
+
+
+def _clip(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+async def load_history(r, patient_id: str, turns: int = CONV_RECENT_TURNS) -> Dict[str, Any]:
+    """The rolling summary and the last `turns` turns, in one round trip."""
+    pipe = r.pipeline(transaction=False)
+    pipe.lrange(CONV_KEY.format(patient_id), -turns, -1)
+    pipe.hget(CONV_META_KEY.format(patient_id), "summary")
+    raw_turns, summary = await pipe.execute()
+    out = []
+    for raw in raw_turns or []:
+        try:
+            out.append(json.loads(raw))
+        except ValueError:
+            continue
+    return {"summary": summary.decode() if summary else "", "turns": out}
+
+
+def format_history(history: Dict[str, Any]) -> str:
+    parts = []
+    if history.get("summary"):
+        parts.append(f"Summary of earlier conversation: {history['summary']}")
+    for t in history.get("turns", []):
+        who = "Patient" if t.get("role") == "user" else "Assistant"
+        parts.append(f"{who}: {t.get('text', '')}")
+    return "\n".join(parts)
+
+
+async def record_turns(r, patient_id: str, message: str, answer: str):
+    """Appends the exchange and schedules a compaction when the budget is exceeded."""
+    now = int(time.time())
+    turns = [
+        {"role": "user", "text": _clip(message, CONV_TURN_MAX_CHARS), "ts": now},
+        {"role": "assistant", "text": _clip(answer, CONV_TURN_MAX_CHARS), "ts": now},
+    ]
+    for t in turns:
+        t["tokens"] = estimate_tokens(t["text"])
+    tokens = sum(t["tokens"] for t in turns)
+    key, meta = CONV_KEY.format(patient_id), CONV_META_KEY.format(patient_id)
+    pipe = r.pipeline(transaction=False)
+    pipe.rpush(key, *[json.dumps(t, ensure_ascii=False) for t in turns])
+    pipe.hincrby(meta, "tokens", tokens)
+    pipe.expire(key, CONV_TTL_S)
+    pipe.expire(meta, CONV_TTL_S)
+    length, pending, _, _ = await pipe.execute()
+    if int(length) > CONV_MAX_TURNS:
+        # Over the hard cap (compaction keeps failing): drop the oldest
+        # unsummarized turns and take them off the pending count too
+        dropped = await r.lpop(key, int(length) - CONV_MAX_TURNS) or []
+        lost = sum(_turn_tokens(json.loads(x)) for x in dropped)
+        pending = await r.hincrby(meta, "tokens", -lost)
+    if int(pending) > CONV_TOKEN_BUDGET:
+        task = asyncio.create_task(compact(r, patient_id))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+
+
+async def compact(r, patient_id: str) -> bool:
+    """
+    Folds everything but the last CONV_RECENT_TURNS turns into the summary.
+    A short Redis lock keeps workers from summarizing the same patient twice.
+    """
+    lock = CONV_LOCK_KEY.format(patient_id)
+    if not await r.set(lock, "1", nx=True, ex=CONV_LOCK_TTL_S):
+        return False
+    try:
+        key, meta = CONV_KEY.format(patient_id), CONV_META_KEY.format(patient_id)
+        pipe = r.pipeline(transaction=False)
+        pipe.llen(key)
+        pipe.hget(meta, "summary")
+        length, summary = await pipe.execute()
+        n = int(length) - CONV_RECENT_TURNS
+        if n <= 0:
+            return False
+        old = [json.loads(x) for x in await r.lrange(key, 0, n - 1)]
+        previous = summary.decode() if summary else ""
+
+        # Background summaries count against the global LLM cap like chats
+        # do; when it is full they wait for a later exchange
+        lease = await acquire_llm_slot(r)
+        if lease is None:
+            return False
+        try:
+            with stage("memory_compact"):
+                text = await chat_llm(
+                    SUMMARY_PROMPT,
+                    f"PREVIOUS SUMMARY:\n{previous or '(none)'}\n\nNEW TURNS:\n{format_history({'turns': old})}")
+        finally:
+            await release_llm_slot(r, lease)
+        if text == FALLBACK_RESPONSE:
+            return False  # LLM unavailable; the next exchange retries
+        text = _clip(text.strip(), CONV_SUMMARY_MAX_CHARS)
+
+        # New turns are only ever appended, so trimming the first n is safe
+        # even if the patient sent more messages meanwhile
+        global _compact_script
+        if _compact_script is None:
+            _compact_script = r.register_script(_COMPACT_LUA)
+        await _compact_script(keys=[key, meta], args=[n, text, int(time.time())], client=r)
+        return True
+    except Exception as e:
+        print(f"Warning: conversation compaction failed for {patient_id}: {e}")
+        return False
+    finally:
+        await r.delete(lock)
+
+
+async def clear_history(r, patient_id: str):
+    await r.delete(CONV_KEY.format(patient_id), CONV_META_KEY.format(patient_id))
+
+
+async def close_memory():
+    """Lets in-flight compactions finish on shutdown."""
+    if _tasks:
+        await asyncio.gather(*list(_tasks), return_exceptions=True)
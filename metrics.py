@@ -0,0 +1,74 @@
+import os
+import time
+import asyncio
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from prometheus_client import multiprocess
+
+# Under gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker writes its
+# samples to a shared directory and /metrics aggregates them (see gunicorn.conf.py).
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", "0.5"))
+
+_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40)
+
+STAGE_SECONDS = Histogram(
+    "postop_stage_seconds", "Time spent per hot-path stage", ["stage"], buckets=_BUCKETS)
+JSON_PARSE_FAILURES = Counter(
+    "postop_llm_json_parse_failures_total", "LLM replies that extract_json could not parse")
+TRIAGE_LEVELS = Counter(
+    "postop_triage_total", "Chat answers by triage level", ["level"])
+ALERTS = Counter(
+    "postop_alerts_total", "Alerts raised", ["source"])
+CACHE_LOOKUPS = Counter(
+    "postop_cache_lookups_total", "Cache lookups", ["cache", "result"])
+ADMISSIONS = Counter(
+    "postop_admissions_total", "Admission decisions for chat and doctor requests", ["result"])
+LLM_INFLIGHT = Gauge(
+    "postop_llm_inflight", "LLM calls currently in flight", multiprocess_mode="livesum")
+EMBED_QUEUE_DEPTH = Gauge(
+    "postop_embed_queue_depth", "Queries waiting for the embedding batcher", multiprocess_mode="livesum")
+LOOP_LAG = Gauge(
+    "postop_event_loop_lag_seconds", "Most recent event-loop lag sample", multiprocess_mode="max")
+WORKER_STARTUP_SECONDS = Gauge(
+    "postop_worker_startup_seconds", "Worker start to ready (model warm)", multiprocess_mode="all")
+WORKER_RSS_BYTES = Gauge(
+    "postop_worker_rss_bytes", "Worker resident memory when it became ready", multiprocess_mode="all")
+PROMPT_TOKENS = Histogram(
+    "postop_prompt_tokens", "Estimated prompt tokens per chat request", ["part"],
+    buckets=(25, 50, 100, 200, 400, 800, 1600, 3200))
+LOOP_LAG_SECONDS = Histogram(
+    "postop_event_loop_lag_seconds_hist", "Event-loop lag samples", buckets=_BUCKETS)
+
+
+@contextmanager
+def stage(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - t0)
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL_S):
+    """Measures how late the loop wakes from sleep; anything large means a blocking call."""
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - t0 - interval)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_SECONDS.observe(lag)
+
+
+def render():
+    """Returns (body, content_type) for the Prometheus scrape."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
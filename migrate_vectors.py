@@ -0,0 +1,22 @@
+# migrate_vectors.py
+# Moves the stored doc vectors to another format (float32 <-> float16).
+#   python migrate_vectors.py --dtype float16
+#   python reindex.py --cleanup        # once traffic looks good
+# This is a reindex.py build with a new dtype: the vectors are converted
+# (not re-embedded) into a new index generation next to the live one, and
+# workers switch to it together when it is complete, so vector search stays
+# up and no worker ever reads or writes the wrong format. Safe to re-run:
+# an interrupted migration resumes.
+import asyncio, argparse
+
+from reindex import build
+from vecformat import DTYPES
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Convert stored doc vectors between float32 and float16")
+    ap.add_argument("--dtype", choices=sorted(DTYPES), required=True)
+    ap.add_argument("--batch", type=int, default=500)
+    ap.add_argument("--restart", action="store_true", help="discard a saved partial build")
+    args = ap.parse_args()
+    asyncio.run(build(None, args.batch, args.restart, args.dtype))
@@ -0,0 +1,191 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from pydantic import BaseModel
+
+from rag import VERSION_KEY
+from redflags import RedFlagMatcher, compile_red_flags
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "20000"))
+PROFILE_CACHE_TTL_S = float(os.getenv("PROFILE_CACHE_TTL_S", "300"))
+
+
+class NewPatient(BaseModel):
+    user_id: str
+    password: str = "test123"
+    patient_id: str
+    name: str
+    age: int
+    surgeon: str
+    procedure: str
+    emergency_name: str
+    emergency_phone: str
+    allergies: list[str] = []
+    medications: list[dict]  
+    red_flags: list[str] = []
+
+    def profile(self) -> Dict[str, Any]:
+        """The JSON blob stored under postop:patient:<id> 'profile'."""
+        return {
+            "name": self.name, "age": self.age, "surgeon": self.surgeon, "procedure": self.procedure,
+            "emergency_contact": {"name": self.emergency_name, "phone": self.emergency_phone},
+            "allergies": self.allergies,
+            "medications": self.medications,
+            "red_flags": self.red_flags,
+        }
+
+
+@dataclass
+class EmergencyContact:
+    name: str = ""
+    phone: str = ""
+
+
+@dataclass
+class PatientProfile:
+    patient_id: str
+    name: str = ""
+    age: Optional[int] = None
+    surgeon: str = ""
+    procedure: str = ""
+    emergency_contact: EmergencyContact = field(default_factory=EmergencyContact)
+    allergies: List[str] = field(default_factory=list)
+    medications: List[Dict[str, Any]] = field(default_factory=list)
+    red_flags: List[str] = field(default_factory=list)
+    version: str = "0"
+    # Compiled with the profile so every chat message can be screened in microseconds
+    red_flag_matcher: Optional[RedFlagMatcher] = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_dict(cls, patient_id: str, d: Dict[str, Any], version: str = "0") -> "PatientProfile":
+        ec = d.get("emergency_contact") or {}
+        red_flags = list(d.get("red_flags") or [])
+        return cls(
+            patient_id=patient_id,
+            name=d.get("name", ""),
+            age=d.get("age"),
+            surgeon=d.get("surgeon", ""),
+            procedure=d.get("procedure", ""),
+            emergency_contact=EmergencyContact(ec.get("name", ""), ec.get("phone", "")),
+            allergies=list(d.get("allergies") or []),
+            medications=list(d.get("medications") or []),
+            red_flags=red_flags,
+            version=version,
+            red_flag_matcher=compile_red_flags(red_flags),
+        )
+
+    @property
+    def contact_hint(self) -> str:
+        ec = self.emergency_contact
+        if not (ec.name or ec.phone):
+            return ""
+        return f"Emergency: {ec.name} {ec.phone}".strip()
+
+
+class _TTLCache:
+    def __init__(self, size: int, ttl_s: float):
+        self.size = size
+        self.ttl_s = ttl_s
+        self._d: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str):
+        item = self._d.get(key)
+        if item is None:
+            return None
+        ts, val = item
+        if time.monotonic() - ts > self.ttl_s:
+            del self._d[key]
+            return None
+        self._d.move_to_end(key)
+        return val
+
+    def put(self, key: str, val):
+        self._d[key] = (time.monotonic(), val)
+        self._d.move_to_end(key)
+        while len(self._d) > self.size:
+            self._d.popitem(last=False)
+
+    def pop(self, key: str):
+        self._d.pop(key, None)
+
+    def __len__(self):
+        return len(self._d)
+
+
+class ProfileCache:
+    """
+    Read-through cache for login records and structured patient profiles.
+
+    Profiles carry the patient's data version (postop:ver:<id>); callers
+    that already know the current version pass it in and stale entries are
+    reloaded. Login records rely on the TTL plus local invalidation.
+    """
+    def __init__(self, size: int = PROFILE_CACHE_SIZE, ttl_s: float = PROFILE_CACHE_TTL_S):
+        self._users = _TTLCache(size, ttl_s)
+        self._doctors = _TTLCache(1024, ttl_s)
+        self._profiles = _TTLCache(size, ttl_s)
+        self.hits = 0
+        self.misses = 0
+
+    async def get_user(self, r, user_id: str) -> Optional[Dict[str, str]]:
+        return await self._get_hash(r, self._users, f"postop:user:{user_id}")
+
+    async def get_doctor(self, r, user_id: str) -> Optional[Dict[str, str]]:
+        return await self._get_hash(r, self._doctors, f"postop:doctor:{user_id}")
+
+    async def _get_hash(self, r, cache: _TTLCache, key: str):
+        val = cache.get(key)
+        if val is not None:
+            self.hits += 1
+            return val
+        self.misses += 1
+        data = await r.hgetall(key)
+        if not data:
+            return None  # unknown ids are not cached, new accounts show up immediately
+        val = {k.decode(): v.decode() for k, v in data.items()}
+        cache.put(key, val)
+        return val
+
+    async def get_profile(self, r, patient_id: str, version: Optional[str] = None) -> Optional[PatientProfile]:
+        prof = self._profiles.get(patient_id)
+        if prof is not None and (version is None or prof.version == version):
+            self.hits += 1
+            return prof
+        self.misses += 1
+        pipe = r.pipeline(transaction=False)
+        pipe.hget(f"postop:patient:{patient_id}", "profile")
+        pipe.get(VERSION_KEY.format(patient_id))
+        raw, ver = await pipe.execute()
+        if not raw:
+            return None
+        try:
+            prof = PatientProfile.from_dict(patient_id, json.loads(raw.decode()),
+                                            ver.decode() if ver else "0")
+        except (ValueError, TypeError) as e:
+            print(f"Warning: bad profile for {patient_id}: {e}")
+            return None
+        self._profiles.put(patient_id, prof)
+        return prof
+
+    def invalidate(self, patient_id: Optional[str] = None, user_id: Optional[str] = None):
+        if patient_id:
+            self._profiles.pop(patient_id)
+        if user_id:
+            self._users.pop(f"postop:user:{user_id}")
+            self._doctors.pop(f"postop:doctor:{user_id}")
+
+    def stats(self) -> dict:
+        return {"users": len(self._users), "profiles": len(self._profiles),
+                "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[ProfileCache] = None
+
+def get_profile_cache() -> ProfileCache:
+    global _cache
+    if _cache is None:
+        _cache = ProfileCache()
+    return _cache
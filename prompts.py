@@ -0,0 +1,141 @@
+import os
+import textwrap
+from dataclasses import dataclass, field
+from string import Template
+from typing import Any, Dict, Iterable, List
+
+from memory import estimate_tokens
+from metrics import PROMPT_TOKENS
+from textutil import normalize_text
+
+# The triage rules never change between requests, so they are built once
+# and sent as the model's system instruction (llm_client); only the user
+# turn (retrieved context, conversation, message) varies. Bump
+# PROMPT_VERSION whenever the template text changes.
+PROMPT_VERSION = "triage-v3"
+# Cosine distance (vector_distance) above which a retrieved doc is not
+# relevant enough to go in the prompt; the nearest PROMPT_CONTEXT_MIN_LINES always do
+PROMPT_CONTEXT_MAX_DISTANCE = float(os.getenv("PROMPT_CONTEXT_MAX_DISTANCE", "0.8"))
+PROMPT_CONTEXT_MIN_LINES = int(os.getenv("PROMPT_CONTEXT_MIN_LINES", "1"))
+PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "400"))
+PROMPT_MESSAGE_TOKENS = int(os.getenv("PROMPT_MESSAGE_TOKENS", "300"))
+PROMPT_LOG_TOKENS = os.getenv("PROMPT_LOG_TOKENS", "1") == "1"
+
+TRIAGE_TEMPLATE = textwrap.dedent("""
+    You are a post-operative patient assistant. Use ONLY the PATIENT CONTEXT given with each message.
+    You MUST return a JSON object with keys: "triage_level", "assistant", and "alert".
+
+    --- Triage Rules ---
+    - Level 1: Routine/self-care guidance based on meds/instructions in context.
+    - Level 2: Give Level 1 advice AND ask the patient to schedule an appointment with their clinician.
+    - Level 3: Inform the patient they will be contacted *shortly* by their emergency contact (listed in the context). Set "alert": true.
+
+    --- Special Conversational Rules ---
+    - If the user says "hi", "hello", or "hey":
+    - Set "triage_level": 1.
+    - Set "assistant": "Hello! I'm here to help with your post-operative questions. We are here for you if you need anything."
+    - Set "alert": false.
+    - If the user says "thanks" or "thank you":
+    - Set "triage_level": 1.
+    - Set "assistant": "You're very welcome! We are here for you if you have any other questions."
+    - Set "alert": false.
+    - If the user says "bye" or "goodbye":
+    - Set "triage_level": 1.
+    - Set "assistant": "Goodbye! Take care and please remember to stay on track with your prescribed medications. We are here for you."
+    - Set "alert": false.
+
+    --- General Rules ---
+    - For all other medical or recovery questions, use the Triage Rules.
+    - **NEVER** mention medications, dosage, or frequency unless the patient explicitly asks about their medication OR the response is a sign-off (Bye/Goodbye).
+    - Never invent medications; quote names/dose/frequency only from context.
+    - If info is missing, say so and include clinician contact.
+    - Use CONVERSATION SO FAR (if present) to understand follow-up questions; don't repeat earlier advice verbatim.
+    - Always sound caring and reassuring.
+""").strip()
+TRIAGE_TEMPLATE_TOKENS = estimate_tokens(TRIAGE_TEMPLATE)
+
+_TURN = Template("PATIENT CONTEXT:\n$context\n$conversation\nUSER: $message")
+
+
+@dataclass
+class Prompt:
+    system: str
+    user: str
+    ctx_lines: List[str] = field(default_factory=list)
+    tokens: Dict[str, int] = field(default_factory=dict)
+    dropped: int = 0       # retrieved lines left out (too far, duplicate or over budget)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(self.tokens.values())
+
+
+def clip_tokens(text: str, budget: int) -> str:
+    limit = budget * 4     # same ~4 chars/token as memory.estimate_tokens
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def select_context(hits: Iterable[Dict[str, Any]], pinned: Iterable[str] = (),
+                   max_distance: float = PROMPT_CONTEXT_MAX_DISTANCE,
+                   budget: int = PROMPT_CONTEXT_TOKENS) -> List[str]:
+    """
+    Context lines for the prompt: `pinned` lines first, then hits nearest
+    first while they are within max_distance (the nearest
+    PROMPT_CONTEXT_MIN_LINES regardless), skipping duplicates, until the
+    token budget is spent.
+    """
+    def distance(h):
+        try:
+            return float(h.get("vector_distance"))
+        except (TypeError, ValueError):
+            return 0.0   # no score (e.g. a filter-only hit): treat as relevant
+
+    lines, seen, used = [], set(), 0
+    candidates = [t for t in pinned if t]
+    for i, h in enumerate(sorted(hits, key=distance)):
+        if i >= PROMPT_CONTEXT_MIN_LINES and distance(h) > max_distance:
+            break
+        text = h.get("text")
+        if isinstance(text, (bytes, bytearray)):
+            text = text.decode()
+        if text:
+            candidates.append(text)
+    for text in candidates:
+        key = normalize_text(text)
+        if key in seen:
+            continue
+        cost = estimate_tokens(text)
+        if used + cost > budget:
+            continue
+        seen.add(key)
+        used += cost
+        lines.append(f"- {text}")
+    return lines
+
+
+def build_prompt(hits: List[Dict[str, Any]], message: str, history: str = "",
+                 pinned: Iterable[str] = ()) -> Prompt:
+    """The system instruction and user turn for one chat message, within the token budgets."""
+    pinned = [t for t in pinned if t]
+    ctx_lines = select_context(hits, pinned)
+    message = clip_tokens(message, PROMPT_MESSAGE_TOKENS)
+    context = "\n".join(ctx_lines) if ctx_lines else "(no context)"
+    conversation = f"\nCONVERSATION SO FAR:\n{history}\n" if history else ""
+    prompt = Prompt(
+        system=TRIAGE_TEMPLATE,
+        user=_TURN.substitute(context=context, conversation=conversation, message=message),
+        ctx_lines=ctx_lines,
+        tokens={"system": TRIAGE_TEMPLATE_TOKENS, "context": estimate_tokens(context),
+                "history": estimate_tokens(history) if history else 0, "message": estimate_tokens(message)},
+        dropped=max(0, len(hits) + len(pinned) - len(ctx_lines)),
+    )
+    for part, n in prompt.tokens.items():
+        PROMPT_TOKENS.labels(part).observe(n)
+    return prompt
+
+
+def log_prompt(patient_id: str, prompt: Prompt):
+    if PROMPT_LOG_TOKENS:
+        parts = " ".join(f"{k}={v}" for k, v in prompt.tokens.items())
+        print(f"prompt {PROMPT_VERSION} patient={patient_id} tokens={prompt.total_tokens} ({parts}) "
+              f"context_lines={len(prompt.ctx_lines)} dropped={prompt.dropped}")
@@ -1,12 +1,24 @@
 import os
+import json
 import asyncio
-from typing import List, Dict, Any
+import hashlib
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional
+
+import yaml
 import redis.asyncio as redis
 # from redisvl.index import SearchIndex
 from redisvl.index import AsyncSearchIndex
 from sentence_transformers import SentenceTransformer
-from redisvl.query import VectorQuery
+from redisvl.query import VectorQuery, FilterQuery
 from redisvl.query.filter import Tag
+from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+from redis.exceptions import ResponseError
+
+from embed_batcher import EmbeddingBatcher
+from embed_cache import EmbeddingCache
+from context_store import PatientContextStore
+from vecformat import VECTOR_DTYPE, to_bytes
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -15,57 +27,436 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:8001")
 SCHEMA_PATH = os.getenv("SCHEMA_PATH", "schema.yaml")
 EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2")
 
+# Shared connection pool (one per worker process)
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "50"))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+
+# "redis" = HNSW query on postop:index, "local" = exact search over an
+# in-process per-patient matrix (falls back to the index on errors)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "redis")
+# Docs retrieved per chat message (see eval_retrieval.py for how to pick it)
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "6"))
+
 VECTOR_FIELD = "embedding" 
 RETURN_FIELDS = ["patient_id", "kind", "text", "vector_distance"]
+VERSION_KEY = "postop:ver:{}"
+# JSON of the IndexGeneration that reads and writes go to (see reindex.py)
+ACTIVE_INDEX_KEY = "postop:index:active"
+INDEX_REFRESH_S = float(os.getenv("INDEX_REFRESH_S", "5"))
+DOC_KEY = "postop:doc:{}:{}:{}"       # patient_id, kind, content hash
+DOC_SET_KEY = "postop:docs:{}"        # ids of a patient's current docs
+
 
+_models: Dict[str, Any] = {}
+_model_name = EMBED_MODEL_NAME   # follows the active index generation
+_batcher: Optional[EmbeddingBatcher] = None
+_embed_cache: Optional[EmbeddingCache] = None
+_pool: Optional[redis.BlockingConnectionPool] = None
+_rag: Optional["PatientRAG"] = None
+_rag_lock = asyncio.Lock()
 
-_model = None
+def get_pool() -> redis.BlockingConnectionPool:
+    global _pool
+    if _pool is None:
+        # Blocking pool: callers wait for a free connection instead of
+        # opening sockets beyond REDIS_POOL_SIZE.
+        _pool = redis.BlockingConnectionPool.from_url(
+            REDIS_URL,
+            encoding="utf-8",
+            decode_responses=False,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=REDIS_SOCKET_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True,
+        )
+    return _pool
 
 async def get_redis():
-    print(REDIS_URL)
-    return redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=False)
+    # Clients are cheap wrappers; the sockets live in the shared pool.
+    return redis.Redis(connection_pool=get_pool())
+
+async def scan_keys(r: redis.Redis, match: str, count: int = 500, cursor: int = 0):
+    """Yields (next_cursor, keys) per SCAN page; pass a saved cursor to resume."""
+    while True:
+        cursor, keys = await r.scan(cursor=cursor, match=match, count=count)
+        yield int(cursor), [k.decode() if isinstance(k, bytes) else k for k in keys]
+        if int(cursor) == 0:
+            return
+
+async def watch_index_generation(interval: float = INDEX_REFRESH_S):
+    """Background loop: picks up a generation swapped in by reindex.py."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await (await get_rag()).refresh(await get_redis())
+        except Exception as e:
+            print(f"Warning: index generation check failed: {e}")
+
+async def get_rag() -> "PatientRAG":
+    """Returns the process-wide PatientRAG, creating and validating it once."""
+    global _rag
+    if _rag is not None:
+        return _rag
+    async with _rag_lock:
+        if _rag is None:
+            pr = PatientRAG()
+            await pr.init(await get_redis())
+            _rag = pr
+    return _rag
+
+async def close_redis():
+    global _pool, _rag
+    _rag = None
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
+
+async def get_patient_version(r: redis.Redis, patient_id: str) -> str:
+    v = await r.get(VERSION_KEY.format(patient_id))
+    return v.decode() if v else "0"
 
-def get_embedder():
-    global _model
-    if _model is None:
-        _model = SentenceTransformer(EMBED_MODEL_NAME)
-    return _model
+async def bump_patient_version(r: redis.Redis, patient_id: str) -> int:
+    """Marks a patient's docs/profile as changed; caches compare this version."""
+    return await r.incr(VERSION_KEY.format(patient_id))
 
-def embed(texts: List[str]):
-    model = get_embedder()
+def doc_id(patient_id: str, kind: str, text: str) -> str:
+    """Content-addressed id: the same (patient, kind, text) always maps to the same key."""
+    digest = hashlib.sha1(f"{patient_id}\0{kind}\0{text}".encode("utf-8")).hexdigest()[:20]
+    return DOC_KEY.format(patient_id, kind, digest)
+
+def doc_kind(key: str) -> str:
+    # postop:doc:<patient_id>:<kind>:<hash, or a random hex id for older docs>
+    return key.rsplit(":", 2)[-2]
+
+def build_patient_docs(patient_id: str, profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Turns a profile dict into the small set of retrievable docs (summary, contacts, ...)."""
+    docs = []
+    def add(kind, text):
+        docs.append({"id": doc_id(patient_id, kind, text),
+                     "patient_id": patient_id, "kind": kind, "text": text})
+    ec = profile.get("emergency_contact") or {}
+    add("summary", f"{profile['name']} ({profile['age']}y). Procedure: {profile['procedure']} by {profile['surgeon']}.")
+    add("contacts", f"Emergency: {ec.get('name', '')} {ec.get('phone', '')}")
+    if profile.get("allergies"):
+        add("allergies", "Allergies: " + ", ".join(profile["allergies"]))
+    if profile.get("medications"):
+        meds_lines = [f"{m.get('name', '')} {m.get('dose', '')} {m.get('freq', '')}".strip()
+                      for m in profile["medications"]]
+        add("meds", "Medication plan: " + "; ".join(meds_lines))
+    if profile.get("red_flags"):
+        add("red_flags", "Critical symptoms: " + "; ".join(profile["red_flags"]))
+    return docs
+
+def get_embedder(model_name: Optional[str] = None):
+    name = model_name or _model_name
+    if name not in _models:
+        _models[name] = SentenceTransformer(name)
+    return _models[name]
+
+def embed(texts: List[str], model_name: Optional[str] = None):
+    model = get_embedder(model_name)
     return model.encode(texts, normalize_embeddings=True).astype("float32")
 
+async def load_model(model_name: str):
+    """Loads a model off the loop without making it the current one (see use_model)."""
+    if model_name in _models:
+        return _models[model_name]
+    return await asyncio.to_thread(SentenceTransformer, model_name)
+
+def use_model(model_name: str, model):
+    """Makes a loaded model the one queries and docs are embedded with by default."""
+    global _model_name, _models
+    if model_name != _model_name:
+        _models = {model_name: model}
+        _model_name = model_name
+
+def get_batcher() -> EmbeddingBatcher:
+    global _batcher
+    if _batcher is None:
+        _batcher = EmbeddingBatcher(embed)
+    return _batcher
+
+def get_embed_cache(model_name: Optional[str] = None) -> EmbeddingCache:
+    global _embed_cache
+    name = model_name or _model_name
+    if name != _model_name:
+        return EmbeddingCache(name)    # a query that straddled a model swap; not kept
+    if _embed_cache is None or _embed_cache.model_name != _model_name:
+        _embed_cache = EmbeddingCache(_model_name)
+    return _embed_cache
+
+async def embed_query(text: str, r: Optional[redis.Redis] = None, model_name: Optional[str] = None):
+    """
+    Embeds one query off the event loop, micro-batched with concurrent callers.
+    Repeated (normalized) queries are served from the embedding cache.
+    Pass the generation's model so the vector matches the field it searches.
+    """
+    cache = get_embed_cache(model_name)
+    vec = await cache.get(r, text)
+    if vec is None:
+        vec = await get_batcher().embed(text, cache.model_name)
+        await cache.put(r, text, vec)
+    return vec
+
+async def aembed(texts: List[str], model_name: Optional[str] = None):
+    """Embeds a document batch in the document embedding pool."""
+    return await get_batcher().embed_many(texts, model_name or _model_name)
+
+async def close_embedder():
+    global _batcher
+    if _batcher is not None:
+        await _batcher.close()
+        _batcher = None
+
+async def create_index(index: AsyncSearchIndex, dtype: str = VECTOR_DTYPE, overwrite: bool = False):
+    """Creates the index with the vector field stored as `dtype` (float32/float16)."""
+    if dtype == "float32":
+        return await index.create(overwrite=overwrite)
+    # redisvl 0.3 only models FLOAT32/FLOAT64, so patch the TYPE argument of
+    # the vector field and issue FT.CREATE ourselves.
+    fields = index.schema.redis_fields
+    for f in fields:
+        if f.args and f.args[0] == "VECTOR":
+            f.args[f.args.index("TYPE") + 1] = dtype.upper()
+    if await index.exists():
+        if not overwrite:
+            return
+        await index.delete(drop=False)
+    await index.client.ft(index.name).create_index(
+        fields=fields,
+        definition=IndexDefinition(prefix=[index.prefix], index_type=IndexType.HASH),
+    )
+
+@dataclass
+class IndexGeneration:
+    """
+    One build of the vector index. Generations share the doc hashes
+    (postop:doc:*) but each embeds into its own vector field, so a new
+    model, HNSW setting or vector dtype can be built next to the live one
+    and swapped in by rewriting ACTIVE_INDEX_KEY. The dtype lives here, not
+    in each worker's env, so every worker reads and writes the same format.
+    """
+    gen: int
+    name: str
+    field: str
+    model: str
+    dims: int
+    dtype: str = "float32"    # generations recorded before dtype was stored were float32
+
+    @classmethod
+    def initial(cls) -> "IndexGeneration":
+        # Generation 0 is the index as schema.yaml has always defined it
+        with open(SCHEMA_PATH) as f:
+            schema = yaml.safe_load(f)
+        vec = next(fl for fl in schema["fields"] if fl["type"] == "vector")
+        # VECTOR_DTYPE only decides the format of a brand-new deployment
+        # (PatientRAG.init keeps the TYPE of an index built before generations)
+        return cls(0, schema["index"]["name"], vec["name"], EMBED_MODEL_NAME, int(vec["attrs"]["dims"]),
+                   VECTOR_DTYPE)
+
+    @classmethod
+    def numbered(cls, gen: int, model: str, dims: int, dtype: str) -> "IndexGeneration":
+        base = cls.initial()
+        return cls(gen, f"{base.name}:v{gen}", f"{VECTOR_FIELD}_v{gen}", model, dims, dtype)
+
+    @classmethod
+    def from_json(cls, raw) -> "IndexGeneration":
+        return cls(**json.loads(raw))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+def build_index(generation: IndexGeneration) -> AsyncSearchIndex:
+    """schema.yaml (current HNSW params) renamed to the generation's index and vector field."""
+    with open(SCHEMA_PATH) as f:
+        schema = yaml.safe_load(f)
+    schema["index"]["name"] = generation.name
+    for fl in schema["fields"]:
+        if fl["type"] == "vector":
+            fl["name"] = generation.field
+            fl["attrs"]["dims"] = generation.dims
+    return AsyncSearchIndex.from_dict(schema)
+
+async def index_vector_dtype(r: redis.Redis, name: str, field: str) -> Optional[str]:
+    """The stored TYPE of an existing index's vector field ("float32"...), None if there is no index."""
+    def s(v):
+        return v.decode() if isinstance(v, bytes) else str(v)
+    try:
+        info = await r.ft(name).info()
+    except ResponseError:
+        return None
+    for attr in info.get("attributes", []):
+        kv = {s(k).lower(): v for k, v in zip(attr[::2], attr[1::2])}
+        if s(kv.get("attribute", kv.get("identifier", ""))) == field:
+            # Servers that don't report data_type predate float16 fields
+            return s(kv.get("data_type", "float32")).lower()
+    return "float32"
+
+async def get_active_generation(r: redis.Redis) -> Optional[IndexGeneration]:
+    raw = await r.get(ACTIVE_INDEX_KEY)
+    return IndexGeneration.from_json(raw) if raw else None
+
+async def record_initial_generation(r: redis.Redis):
+    """
+    Records generation 0 unless a generation is already active (or another
+    worker just did). This is the first start on this Redis, or the first
+    after upgrading from before generations were recorded: an index that
+    already exists keeps the vector TYPE it was built with.
+    """
+    if await r.exists(ACTIVE_INDEX_KEY):
+        return
+    initial = IndexGeneration.initial()
+    existing = await index_vector_dtype(r, initial.name, initial.field)
+    if existing is not None and existing != initial.dtype:
+        print(f"Warning: {initial.name} stores {existing} vectors, ignoring VECTOR_DTYPE={initial.dtype}; "
+              f"convert it with: python migrate_vectors.py --dtype {initial.dtype}")
+        initial.dtype = existing
+    await r.set(ACTIVE_INDEX_KEY, initial.to_json(), nx=True)
+
 class PatientRAG:
     def __init__(self):
-        # self.index = SearchIndex.from_yaml(SCHEMA_PATH) 
-        self.index = AsyncSearchIndex.from_yaml(SCHEMA_PATH)
+        self.generation: Optional[IndexGeneration] = None
+        self.index: Optional[AsyncSearchIndex] = None
+        self.local = PatientContextStore(VECTOR_FIELD)
+
+    @property
+    def field(self) -> str:
+        return self.generation.field
 
-        # RedisVL handles index creation / existence
     async def init(self, r: redis.Redis):
-        await self.index.connect(redis_url=REDIS_URL)
+        generation = await get_active_generation(r)
+        if generation is None:
+            await record_initial_generation(r)
+            generation = await get_active_generation(r)
+        await self._activate(r, generation, create=True)
 
-        if not await self.index.exists():
-            await self.index.create(overwrite=True)
+    async def _activate(self, r: redis.Redis, generation: IndexGeneration, create: bool = False):
+        # Everything that awaits happens first and touches nothing shared...
+        model = await load_model(generation.model)
+        index = build_index(generation)
+        # Reuse the shared pool instead of opening a separate connection
+        await index.set_client(r)
+        if create and not await index.exists():
+            await create_index(index, dtype=generation.dtype, overwrite=True)
+        # ...then the swap, with no await in it: a request sees either the old
+        # or the new generation (model, index, field, dtype), never a mix
+        use_model(generation.model, model)
+        self.index, self.generation = index, generation
+        self.local.vector_field, self.local.vector_dtype = generation.field, generation.dtype
+        self.local.clear()
 
-    async def upsert_docs(self, r: redis.Redis, docs: List[Dict[str, Any]]):
+    async def refresh(self, r: redis.Redis) -> bool:
+        """Switches to the active generation if a reindex swapped it; True if it changed."""
+        generation = await get_active_generation(r)
+        if generation is None or generation.gen == self.generation.gen:
+            return False
+        await self._activate(r, generation)
+        print(f"Switched to index generation {generation.gen} ({generation.name}, {generation.model})")
+        return True
+
+    async def upsert_docs(self, r: redis.Redis, docs: List[Dict[str, Any]],
+                          full: bool = False) -> Dict[str, int]:
         """
-        docs: [{'id': 'postop:doc:<uuid>', 'patient_id':'p1','kind':'meds','text':'...'}]
+        docs: [{'id': doc_id(...), 'patient_id':'p1','kind':'meds','text':'...'}]
+
+        Idempotent: docs whose id (a content hash) is already stored are not
+        re-embedded, and a patient's older docs of the same kinds are deleted
+        (of any kind with full=True, i.e. docs is the patient's whole set).
+        The patient version only moves when something actually changed.
         """
-        vecs = embed([d["text"] for d in docs])
-        for d, v in zip(docs, vecs):
-            d["embedding"] = v.tobytes()  # RedisVL will cast for hash
-        await self.index.load(docs)
+        pids = sorted({d["patient_id"] for d in docs})
+        existing = await self._existing_doc_ids(r, pids)
+
+        generation, index = self.generation, self.index
+        field = generation.field
+        pipe = r.pipeline(transaction=False)
+        for d in docs:
+            pipe.hexists(d["id"], field)
+        stored = await pipe.execute()
+        new_docs = [d for d, ok in zip(docs, stored) if not ok]
+
+        if new_docs:
+            vecs = await aembed([d["text"] for d in new_docs], generation.model)
+            for d, v in zip(new_docs, vecs):
+                d[field] = to_bytes(v, generation.dtype)
+            await index.load(new_docs)
+
+        keep = {d["id"] for d in docs}
+        kinds = {(d["patient_id"], d["kind"]) for d in docs}
+        stale = {pid: [k for k in existing[pid]
+                       if k not in keep and (full or (pid, doc_kind(k)) in kinds)]
+                 for pid in pids}
+        pipe = r.pipeline(transaction=False)
+        for pid in pids:
+            if stale[pid]:
+                pipe.delete(*stale[pid])
+                pipe.srem(DOC_SET_KEY.format(pid), *stale[pid])
+            pipe.sadd(DOC_SET_KEY.format(pid), *[d["id"] for d in docs if d["patient_id"] == pid])
+        await pipe.execute()
+
+        changed = {d["patient_id"] for d in new_docs} | {pid for pid in pids if stale[pid]}
+        for pid in changed:
+            self.local.invalidate(pid)
+            await bump_patient_version(r, pid)
+        return {"docs": len(docs), "embedded": len(new_docs), "unchanged": len(docs) - len(new_docs),
+                "deleted": sum(len(v) for v in stale.values())}
+
+    async def _existing_doc_ids(self, r: redis.Redis, pids: List[str]) -> Dict[str, List[str]]:
+        pipe = r.pipeline(transaction=False)
+        for pid in pids:
+            pipe.smembers(DOC_SET_KEY.format(pid))
+        members = await pipe.execute()
+        out = {}
+        for pid, ids in zip(pids, members):
+            if ids:
+                out[pid] = [i.decode() if isinstance(i, bytes) else i for i in ids]
+            else:
+                # Docs written before the id set existed: ask the index once
+                q = FilterQuery(filter_expression=Tag("patient_id") == pid,
+                                return_fields=["kind"], num_results=1000)
+                out[pid] = [d["id"] for d in await self.index.query(q) or []]
+        return out
+
+    async def search(self, r: redis.Redis, patient_id: str, query: str, k: int = 6,
+                     version: Optional[str] = None, qvec=None, qvec_model: Optional[str] = None):
+        """
+        `qvec` was embedded with `qvec_model` (embed_query's model_name); if a
+        reindex swapped the generation since, the query is embedded again.
+        """
+        generation, index = self.generation, self.index
+        if qvec is None or (qvec_model is not None and qvec_model != generation.model):
+            qvec = await embed_query(query, r, generation.model)
+        if RETRIEVAL_MODE == "local" and self.generation is generation:
+            try:
+                if version is None:
+                    version = await get_patient_version(r, patient_id)
+                hits = await self.local_search(r, patient_id, qvec, k, version)
+                # The store is cleared on a swap; hits from a mid-search swap are dropped
+                if hits and self.generation is generation:
+                    return hits
+            except Exception as e:
+                print(f"Warning: local retrieval failed, using index: {e}")
+        return await self.index_search(patient_id, qvec, k, generation, index)
+
+    async def local_search(self, r: redis.Redis, patient_id: str, qvec, k: int, version: str):
+        return await self.local.search(r, self.index, patient_id, qvec, k, version)
 
-    async def search(self, r: redis.Redis, patient_id: str, query: str, k: int = 6):
-        qvec = embed([query])[0].tolist()
+    async def index_search(self, patient_id: str, qvec, k: int,
+                           generation: Optional[IndexGeneration] = None,
+                           index: Optional[AsyncSearchIndex] = None):
+        if generation is None:
+            generation, index = self.generation, self.index
         tag_filter = Tag("patient_id") == patient_id
         q = VectorQuery(
-            vector=qvec,
-            vector_field_name=VECTOR_FIELD,
+            # Pre-encoded so the query blob matches the index TYPE (redisvl 0.3
+            # cannot encode float16 itself)
+            vector=to_bytes(qvec, generation.dtype),
+            vector_field_name=generation.field,
             return_fields=RETURN_FIELDS,
             filter_expression=tag_filter,
             num_results=k,
-            dtype="float32",
         )
-        results = await self.index.query(q)
-        return results or []
\ No newline at end of file
+        results = await index.query(q)
+        return results or []
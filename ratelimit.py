@@ -0,0 +1,119 @@
+import os
+import math
+import uuid
+from typing import Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from llm_client import LLM_TIMEOUT_S
+from metrics import ADMISSIONS
+
+# Token buckets: RATE_*_PER_MIN refill rate, RATE_*_BURST bucket size.
+RATE_PATIENT_PER_MIN = float(os.getenv("RATE_PATIENT_PER_MIN", "12"))
+RATE_PATIENT_BURST = float(os.getenv("RATE_PATIENT_BURST", "5"))
+RATE_DOCTOR_PER_MIN = float(os.getenv("RATE_DOCTOR_PER_MIN", "120"))
+RATE_DOCTOR_BURST = float(os.getenv("RATE_DOCTOR_BURST", "30"))
+# Cluster-wide cap on concurrent LLM calls (all workers, all replicas)
+LLM_GLOBAL_MAX_INFLIGHT = int(os.getenv("LLM_GLOBAL_MAX_INFLIGHT", "64"))
+LLM_SHED_RETRY_AFTER_S = int(os.getenv("LLM_SHED_RETRY_AFTER_S", "2"))
+# A lease outlives the LLM deadline so a crashed worker's slots free themselves
+LLM_LEASE_MS = int((LLM_TIMEOUT_S + 10) * 1000)
+
+BUCKET_KEY = "postop:rl:{}:{}"        # kind, id
+INFLIGHT_KEY = "postop:rl:llm_inflight"
+
+# Refill-on-read token bucket; the server clock keeps every worker consistent.
+# Returns {allowed, retry_after_ms}.
+_BUCKET_LUA = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed, retry = 0, 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, retry}
+"""
+
+# Counting semaphore as a sorted set of leases scored by expiry.
+# ARGV: lease id, lease ms, limit, force (1 = admit even when full).
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if ARGV[4] ~= '1' and redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+_scripts = {}
+
+
+def _script(r, name: str, source: str):
+    # Registered once; the client is passed per call (evalsha, loading on NOSCRIPT)
+    if name not in _scripts:
+        _scripts[name] = r.register_script(source)
+    return _scripts[name]
+
+
+async def take(r, kind: str, key: str, per_min: float, burst: float, cost: float = 1) -> Tuple[bool, int]:
+    """Takes `cost` tokens from the bucket; returns (allowed, retry_after_s)."""
+    if per_min <= 0:
+        return True, 0
+    try:
+        allowed, retry_ms = await _script(r, "bucket", _BUCKET_LUA)(
+            keys=[BUCKET_KEY.format(kind, key)], args=[per_min / 60.0, burst, cost], client=r)
+    except RedisError as e:
+        # Fail open: every other stage needs Redis anyway and will surface the outage
+        print(f"Warning: rate limiter unavailable ({e}), admitting")
+        return True, 0
+    return bool(allowed), max(1, math.ceil(int(retry_ms) / 1000)) if not allowed else 0
+
+
+async def take_patient(r, patient_id: str) -> Tuple[bool, int]:
+    return await take(r, "patient", patient_id, RATE_PATIENT_PER_MIN, RATE_PATIENT_BURST)
+
+
+async def take_doctor(r, user_id: str) -> Tuple[bool, int]:
+    return await take(r, "doctor", user_id, RATE_DOCTOR_PER_MIN, RATE_DOCTOR_BURST)
+
+
+async def acquire_llm_slot(r, urgent: bool = False) -> Optional[str]:
+    """
+    Returns a lease id, or None when LLM_GLOBAL_MAX_INFLIGHT calls are already
+    running. Urgent (red-flag) requests always get a slot and still count.
+    """
+    lease = uuid.uuid4().hex
+    try:
+        ok = await _script(r, "acquire", _ACQUIRE_LUA)(
+            keys=[INFLIGHT_KEY], args=[lease, LLM_LEASE_MS, LLM_GLOBAL_MAX_INFLIGHT, int(urgent)], client=r)
+    except RedisError as e:
+        print(f"Warning: LLM slot accounting unavailable ({e}), admitting")
+        return lease
+    return lease if ok else None
+
+
+async def release_llm_slot(r, lease: Optional[str]):
+    if lease:
+        try:
+            await r.zrem(INFLIGHT_KEY, lease)
+        except RedisError as e:
+            print(f"Warning: could not release LLM slot ({e}); it expires in {LLM_LEASE_MS}ms")
+
+
+def record_admission(result: str):
+    ADMISSIONS.labels(result).inc()
@@ -0,0 +1,349 @@
+import os
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from textutil import normalize_text
+
+# Red flags every patient gets on top of their own list (this used to be the
+# hard-coded keyword fallback in app.finish_chat).
+DEFAULT_RED_FLAGS = (
+    "chest pain",
+    "shortness of breath",
+    "severe pain",
+    "fever > 39°C",
+    "yellowing of eyes/skin",
+)
+RED_FLAG_CACHE_SIZE = int(os.getenv("RED_FLAG_CACHE_SIZE", "4096"))
+# All parts of a red flag must be mentioned within this many words of each
+# other, in the same sentence ("my calf is in severe pain", not "I kept my
+# meds ... threw up once")
+RED_FLAG_WINDOW = int(os.getenv("RED_FLAG_WINDOW", "8"))
+
+# Ways patients say the words that show up in red_flags. Keys may be phrases;
+# a red flag's words are grouped into the longest key that matches, and a
+# message must mention every group of a red flag for it to fire.
+# Add a row here to teach the matcher a new term; avoid everyday words
+# ("more", "still", "kept") that show up in harmless sentences.
+SYNONYMS: Dict[str, List[str]] = {
+    "shortness of breath": ["short of breath", "shortness of breath", "out of breath", "breathless",
+                            "cant breathe", "can't breathe", "cannot breathe", "hard to breathe",
+                            "trouble breathing", "difficulty breathing", "struggling to breathe"],
+    "chest pain": ["chest pain", "chest pains", "pain in my chest", "chest hurts", "chest is hurting",
+                   "chest tightness", "tight chest", "chest pressure"],
+    "right upper quadrant": ["right upper quadrant", "upper right", "right upper", "right side",
+                             "under my ribs", "under my right ribs"],
+    "fever": ["fever", "feverish", "temperature", "temp", "febrile"],
+    "pain": ["pain", "pains", "painful", "hurts", "hurting", "ache", "aches", "aching", "sore"],
+    "severe": ["severe", "really bad", "very bad", "terrible", "unbearable", "excruciating",
+               "extreme", "intense", "worst", "agonizing", "agonising"],
+    "heavy": ["heavy", "heavily", "a lot", "a lot of", "lots of", "soaking", "gushing", "pouring"],
+    "worsening": ["worsening", "worse", "getting worse", "increasing"],
+    "increasing": ["increasing", "getting bigger", "growing", "spreading", "worse", "worsening",
+                   "more and more", "redder", "more swollen"],
+    "persistent": ["persistent", "keeps", "keep on", "constant", "constantly", "nonstop",
+                   "non stop", "won't stop", "wont stop", "can't stop", "cant stop", "all day"],
+    "persistent vomiting": ["persistent vomiting", "keep vomiting", "keeps vomiting", "keep throwing up",
+                            "keeps throwing up", "can't stop vomiting", "cant stop vomiting",
+                            "can't stop throwing up", "cant stop throwing up", "vomiting constantly",
+                            "vomiting nonstop", "throwing up all day"],
+    "vomiting": ["vomiting", "vomit", "vomited", "throwing up", "threw up", "puking", "being sick"],
+    "yellowing": ["yellowing", "yellow", "jaundice", "jaundiced"],
+    "bleeding": ["bleeding", "bleed", "bleeds", "blood", "hemorrhage", "haemorrhage"],
+    "discharge": ["discharge", "pus", "oozing", "leaking", "drainage"],
+    "foul-smelling": ["foul-smelling", "foul smelling", "foul", "smelly", "smells", "smell", "stinks", "odor", "odour"],
+    "swelling": ["swelling", "swollen", "swelled", "puffy"],
+    "redness": ["redness", "red", "inflamed"],
+    "dizziness": ["dizziness", "dizzy", "lightheaded", "light headed", "room spinning"],
+    "fainting": ["fainting", "faint", "fainted", "passed out", "pass out", "blacked out"],
+    "abdominal": ["abdominal", "abdomen", "belly", "stomach", "tummy"],
+    "calf": ["calf", "calves", "lower leg"],
+    "leg": ["leg", "legs", "calf", "calves", "thigh", "ankle"],
+    "vaginal": ["vaginal", "vagina", "down there"],
+    "eyes": ["eyes", "eye"],
+    "skin": ["skin"],
+}
+
+# Words in a red flag that don't have to appear in the message
+_FILLER = {"of", "the", "a", "an", "in", "on", "my", "after", "day", "days", "post", "op", "new", "sudden"}
+_ALT = {"or", "/"}
+_SENTENCE_BREAKS = {".", "!", "?", ";"}
+_NEGATION_BREAKS = {"but", "and", "or", "though", "although", "however", ","} | _SENTENCE_BREAKS
+# Only clearly conditional questions ("what if I get...", "in case I...",
+# "should I call if...") are not symptoms; a plain "if" often is one
+# ("if I breathe deeply I get chest pain", "I wonder if this pain is normal")
+_HYPOTHETICALS = {"incase", "suppose", "supposing"}
+_ADVICE = {"should", "shall", "call", "contact", "ring", "phone"}
+# ...unless the clause then says it is happening now ("should I call if I have chest pain")
+_PRESENT = {"have", "i've", "ive", "i'm", "im", "am", "this", "now", "already", "currently"}
+_NEGATIONS = {"no", "not", "without", "never", "denies", "dont", "don't", "didnt", "didn't", "isnt", "isn't"}
+
+_TOKEN = re.compile(r"[a-z0-9']+(?:-[a-z0-9']+)*|/")
+# Messages keep punctuation as tokens so sentences and clauses can be told apart
+# (numbers first, so "39.2" stays one token and "40mg" splits into "40", "mg")
+_MSG_TOKEN = re.compile(r"\d+(?:\.\d+)?|[a-z0-9']+(?:-[a-z0-9']+)*|/|[.,;!?]")
+_THRESHOLD = re.compile(r"(>=|≥|>|over|above|at least)\s*(\d+(?:\.\d+)?)\s*(?:°|deg(?:rees)?)?\s*([cf])?\b")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?$")
+_DEGREES = {"degree", "degrees", "deg"}
+# A number followed by one of these is a dose, an age or a duration, not a temperature
+_NOT_TEMPERATURE = {"mg", "mcg", "g", "kg", "ml", "l", "lb", "lbs", "pounds", "units", "iu", "tablets",
+                    "pills", "percent", "year", "years", "yr", "yrs", "month", "months", "week", "weeks",
+                    "day", "days", "hour", "hours", "hr", "hrs", "minute", "minutes", "min", "mins",
+                    "second", "seconds", "times", "am", "pm", "bpm", "mmhg"}
+_TEMPERATURE = -1   # pseudo concept id: a temperature at or above the rule's threshold
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall(normalize_text(text))
+
+
+class _Automaton:
+    """Aho-Corasick over whole words: finds every pattern in one pass over the message."""
+    __slots__ = ("goto", "fail", "out")
+
+    def __init__(self, patterns: Iterable[Tuple[Tuple[str, ...], int]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, int]]] = [[]]  # (concept id, pattern length)
+        for words, cid in patterns:
+            node = 0
+            for w in words:
+                nxt = self.goto[node].get(w)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[node][w] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = nxt
+            self.out[node].append((cid, len(words)))
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for w, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and w not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(w, 0) if node else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def scan(self, words: List[str]) -> Iterable[Tuple[int, int, int]]:
+        """Yields (concept id, start word index, length) for every match."""
+        node = 0
+        for i, w in enumerate(words):
+            while node and w not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(w, 0)
+            for cid, n in self.out[node]:
+                yield cid, i - n + 1, n
+
+
+class _Rule:
+    __slots__ = ("flag", "groups", "threshold")
+
+    def __init__(self, flag: str, groups: List[FrozenSet[int]], threshold: Optional[float]):
+        self.flag = flag
+        self.groups = groups          # each group: concept ids, any one satisfies it
+        self.threshold = threshold    # °C; the message must state a temperature at or above it
+
+
+class RedFlagMatcher:
+    """
+    Compiled red-flag list for one patient.
+
+    Each red flag becomes groups of concepts ("severe calf pain" ->
+    severe, calf, pain), every concept expands to its SYNONYMS, and all
+    variants of all flags go into one word-level Aho-Corasick automaton, so
+    a message is scanned once whatever the number of flags. Flags with a
+    number ("fever > 38°C") also need a temperature at or above it in the
+    message, within the same window as the rest of the flag ("fever 39",
+    "temp 102F"; not "my 40 mg shot"). A flag's parts must appear within
+    RED_FLAG_WINDOW words of each other in one sentence; negated ("no fever")
+    and hypothetical ("what if I get chest pain") mentions don't count.
+    """
+    def __init__(self, red_flags: Iterable[str]):
+        self._concepts: Dict[str, int] = {}
+        self.rules: List[_Rule] = []
+        for flag in red_flags:
+            rule = self._compile(flag)
+            if rule is not None:
+                self.rules.append(rule)
+        patterns = []
+        for key, cid in self._concepts.items():
+            for variant in set(SYNONYMS.get(key, []) + [key]):
+                patterns.append((tuple(_tokens(variant)), cid))
+        self._automaton = _Automaton(p for p in patterns if p[0])
+
+    def _concept(self, key: str) -> int:
+        return self._concepts.setdefault(key, len(self._concepts))
+
+    def _compile(self, flag: str) -> Optional[_Rule]:
+        text = normalize_text(flag)
+        threshold = None
+        m = _THRESHOLD.search(text)
+        if m:
+            threshold = _to_celsius(float(m.group(2)), m.group(3))
+            text = text[:m.start()] + " " + text[m.end():]
+        words = _tokens(text)
+
+        groups: List[set] = []
+        join_next = False
+        i = 0
+        while i < len(words):
+            w = words[i]
+            if w in _ALT:
+                join_next = bool(groups)
+                i += 1
+                continue
+            if w in _FILLER or w.isdigit():
+                i += 1
+                continue
+            key, n = _longest_key(words, i)
+            cid = self._concept(key)
+            if join_next:
+                groups[-1].add(cid)
+            else:
+                groups.append({cid})
+            join_next = False
+            i += n
+        if not groups:
+            return None
+        return _Rule(flag, [frozenset(g) for g in groups], threshold)
+
+    def match(self, message: str) -> List[str]:
+        """Red flags the message mentions, in profile order."""
+        if not self.rules:
+            return []
+        text = normalize_text(message)
+        words = _MSG_TOKEN.findall(text)
+        sentence, n = [], 0
+        for w in words:
+            sentence.append(n)
+            n += w in _SENTENCE_BREAKS
+        found: Dict[int, List[Tuple[int, int]]] = {}   # concept -> [(start, end)]
+        for cid, start, length in self._automaton.scan(words):
+            if not _negated(words, start) and not _hypothetical(words, start, sentence):
+                found.setdefault(cid, []).append((start, start + length - 1))
+        if not found:
+            return []
+        temps = None
+        hits = []
+        for rule in self.rules:
+            if not _within_window(rule.groups, found, sentence):
+                continue
+            if rule.threshold is not None:
+                if temps is None:
+                    temps = _temperatures(words)
+                spans = [(i, i) for i, c in temps if c >= rule.threshold]
+                if not spans or not _within_window(rule.groups + [frozenset({_TEMPERATURE})],
+                                                   {**found, _TEMPERATURE: spans}, sentence):
+                    continue
+            hits.append(rule.flag)
+        return hits
+
+
+def _longest_key(words: List[str], i: int) -> Tuple[str, int]:
+    for n in range(min(4, len(words) - i), 1, -1):
+        phrase = " ".join(words[i:i + n])
+        if phrase in SYNONYMS:
+            return phrase, n
+    return words[i], 1
+
+
+def _within_window(groups: List[FrozenSet[int]], found: Dict[int, List[Tuple[int, int]]],
+                   sentence: List[int]) -> bool:
+    """True if one mention per group fits in RED_FLAG_WINDOW words of a single sentence."""
+    options = []
+    for g in groups:
+        spans = [s for cid in g for s in found.get(cid, ())]
+        if not spans:
+            return False
+        options.append(spans)
+    # Anchor the window at each mention of the first group and look for the rest nearby
+    for a_start, a_end in options[0]:
+        lo, hi = a_start, a_end
+        ok = True
+        for spans in options[1:]:
+            best = None
+            for s, e in spans:
+                if sentence[s] != sentence[a_start]:
+                    continue
+                span = max(hi, e) - min(lo, s) + 1
+                if span <= RED_FLAG_WINDOW and (best is None or span < best[0]):
+                    best = (span, s, e)
+            if best is None:
+                ok = False
+                break
+            lo, hi = min(lo, best[1]), max(hi, best[2])
+        if ok:
+            return True
+    return False
+
+
+def _hypothetical(words: List[str], start: int, sentence: List[int]) -> bool:
+    # "what should I do if I get chest pain", "in case the wound is red"
+    trigger = None
+    for i in range(start - 1, -1, -1):
+        w = words[i]
+        if w in _NEGATION_BREAKS and w not in ("and", "or"):
+            break
+        if w in _HYPOTHETICALS or (w == "case" and i and words[i - 1] == "in") or w == "if":
+            trigger = i
+            break
+    if trigger is None:
+        return False
+    clause = words[trigger + 1:start]
+    if any(w in _PRESENT for w in clause):
+        return False
+    if words[trigger] != "if":
+        return True
+    # "what if ...", or "if" inside a question about what to do
+    before = [w for i, w in enumerate(words[:trigger]) if sentence[i] == sentence[trigger]]
+    return bool(before) and (before[-1] == "what" or any(w in _ADVICE for w in before))
+
+
+def _negated(words: List[str], start: int) -> bool:
+    # "no fever", "I don't have a fever"; "no fever but severe pain" still counts the pain
+    for w in reversed(words[max(0, start - 3):start]):
+        if w in _NEGATION_BREAKS:
+            return False
+        if w in _NEGATIONS:
+            return True
+    return False
+
+
+def _to_celsius(value: float, unit: Optional[str]) -> float:
+    if unit == "f" or (unit is None and value > 45):
+        return (value - 32) * 5 / 9
+    return value
+
+
+def _temperatures(words: List[str]) -> List[Tuple[int, float]]:
+    """(word index, °C) of every number in the message that reads as a body temperature."""
+    out = []
+    for i, w in enumerate(words):
+        if not _NUMBER.match(w):
+            continue
+        unit = words[i + 1] if i + 1 < len(words) else None
+        if unit in _DEGREES:
+            unit = words[i + 2] if i + 2 < len(words) else None
+        if unit in _NOT_TEMPERATURE:
+            continue
+        c = _to_celsius(float(w), unit if unit in ("c", "f") else None)
+        if 34.0 <= c <= 45.0:
+            out.append((i, c))
+    return out
+
+
+@lru_cache(maxsize=RED_FLAG_CACHE_SIZE)
+def _compile_cached(red_flags: Tuple[str, ...]) -> RedFlagMatcher:
+    return RedFlagMatcher(red_flags)
+
+
+def compile_red_flags(red_flags: Iterable[str]) -> RedFlagMatcher:
+    """Matcher for a patient's red flags plus DEFAULT_RED_FLAGS; shared by identical lists."""
+    flags = tuple(dict.fromkeys([*(red_flags or []), *DEFAULT_RED_FLAGS]))
+    return _compile_cached(flags)
@@ -0,0 +1,234 @@
+# reindex.py
+# Builds a new index generation next to the live one and swaps reads to it.
+#   python reindex.py                                  # schema.yaml HNSW params changed
+#   python reindex.py --model sentence-transformers/all-mpnet-base-v2
+#   python reindex.py --dtype float16                  # same model, vectors converted, no re-embedding
+#   python reindex.py --cleanup                        # after a swap: drop the old index + vectors
+#
+# Every postop:doc:* hash is re-embedded into a new vector field
+# (embedding_v<N>) indexed by postop:index:v<N>; the live index keeps serving
+# from its own field meanwhile. Progress (SCAN cursor, counts) is kept in
+# postop:index:building, so an interrupted run picks up where it stopped.
+# When the build is complete, postop:index:active is rewritten in one SET and
+# workers switch within INDEX_REFRESH_S.
+import json, time, asyncio, argparse, hashlib
+from dataclasses import asdict
+from typing import Optional
+
+from rag import (get_redis, get_embedder, embed, create_index, build_index, scan_keys,
+                 get_active_generation, record_initial_generation, IndexGeneration, ACTIVE_INDEX_KEY, INDEX_REFRESH_S, SCHEMA_PATH)
+from vecformat import DTYPES, to_bytes, from_bytes
+
+BUILD_KEY = "postop:index:building"    # JSON: target generation + resume state
+RETIRED_KEY = "postop:index:retired"   # JSON: the generation replaced by the last swap
+INDEX_ALIAS = "postop:index:live"      # FT.ALIAS for ad-hoc FT.SEARCH against the live index
+DOC_PREFIX = "postop:doc:"
+
+
+def _schema_fingerprint() -> str:
+    with open(SCHEMA_PATH, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+class Progress:
+    def __init__(self, label: str, every_s: float = 5.0):
+        self.label = label
+        self.every_s = every_s
+        self.t0 = self.last = time.perf_counter()
+        self.scanned = self.embedded = 0
+
+    def add(self, scanned: int, embedded: int):
+        self.scanned += scanned
+        self.embedded += embedded
+        now = time.perf_counter()
+        if now - self.last >= self.every_s:
+            self.last = now
+            self.report()
+
+    def report(self, final: bool = False):
+        secs = time.perf_counter() - self.t0
+        rate = self.embedded / secs if secs else 0.0
+        print(f"{self.label}{' done' if final else ''}: scanned {self.scanned}, embedded {self.embedded} "
+              f"in {secs:.1f}s ({rate:.1f} docs/s)")
+
+
+async def _plan(r, model: Optional[str], restart: bool, dtype: Optional[str] = None) -> dict:
+    """The build to run: the saved one if it still matches, else a new generation."""
+    active = await get_active_generation(r)
+    model = model or active.model
+    dtype = dtype or active.dtype
+    fingerprint = _schema_fingerprint()
+    raw = await r.get(BUILD_KEY)
+    if raw and not restart:
+        build = json.loads(raw)
+        saved = IndexGeneration(**build["generation"])
+        if saved.model == model and saved.dtype == dtype and build["schema"] == fingerprint:
+            print(f"Resuming generation {build['generation']['gen']} at cursor {build['cursor']} "
+                  f"({build['embedded']} embedded so far)")
+            return build
+        print("Saved build targets a different model, dtype or schema; starting over")
+    if raw:
+        # Its vectors came from another model/schema; don't let them be reused
+        abandoned = IndexGeneration(**json.loads(raw)["generation"])
+        await _drop_generation(r, abandoned)
+        await _strip_field(r, abandoned.field)
+
+    gen = max(active.gen, json.loads(raw)["generation"]["gen"] if raw else 0) + 1
+    dims = int(get_embedder(model).get_sentence_embedding_dimension())
+    generation = IndexGeneration.numbered(gen, model, dims, dtype)
+    build = {"generation": asdict(generation), "schema": fingerprint, "cursor": 0,
+             "embedded": 0, "started": int(time.time())}
+    await r.set(BUILD_KEY, json.dumps(build))
+    return build
+
+
+async def _embed_missing(r, generation: IndexGeneration, keys, batch: int,
+                         source: Optional[IndexGeneration] = None) -> int:
+    """
+    Writes the generation's vector for docs that don't have one yet. With a
+    `source` generation of the same model, its stored vectors are converted
+    to the new dtype instead of being re-embedded.
+    """
+    if not keys:
+        return 0
+    pipe = r.pipeline(transaction=False)
+    for k in keys:
+        pipe.hget(k, "text")
+        pipe.hexists(k, generation.field)
+        if source:
+            pipe.hget(k, source.field)
+    res = await pipe.execute()
+    step = 3 if source else 2
+    srcs = res[2::3] if source else [None] * len(keys)
+    todo, converted = [], {}
+    for k, t, done, src in zip(keys, res[0::step], res[1::step], srcs):
+        if not t or done:
+            continue
+        if source and src:
+            converted[k] = to_bytes(from_bytes(src, source.dtype), generation.dtype)
+        else:
+            todo.append((k, t.decode() if isinstance(t, bytes) else t))
+    if converted:
+        pipe = r.pipeline(transaction=False)
+        for k, blob in converted.items():
+            pipe.hset(k, generation.field, blob)
+        await pipe.execute()
+    for i in range(0, len(todo), batch):
+        chunk = todo[i:i + batch]
+        vecs = await asyncio.to_thread(embed, [t for _, t in chunk], generation.model)
+        pipe = r.pipeline(transaction=False)
+        for (k, _), v in zip(chunk, vecs):
+            pipe.hset(k, generation.field, to_bytes(v, generation.dtype))
+        await pipe.execute()
+    return len(todo) + len(converted)
+
+
+async def _full_pass(r, generation: IndexGeneration, batch: int, label: str,
+                     source: Optional[IndexGeneration] = None) -> int:
+    progress = Progress(label)
+    async for _, keys in scan_keys(r, f"{DOC_PREFIX}*", batch):
+        progress.add(len(keys), await _embed_missing(r, generation, keys, batch, source))
+    progress.report(final=True)
+    return progress.embedded
+
+
+async def _wait_indexed(index):
+    while True:
+        info = await index.info()
+        if not int(info.get("indexing", 0)) and float(info.get("percent_indexed", 1)) >= 1:
+            return info
+        await asyncio.sleep(0.5)
+
+
+async def _drop_generation(r, generation: IndexGeneration):
+    index = build_index(generation)
+    await index.set_client(r)
+    if await index.exists():
+        await index.delete(drop=False)   # docs stay; only the index goes
+
+
+async def _strip_field(r, field: str, batch: int = 500) -> int:
+    removed = 0
+    async for _, keys in scan_keys(r, f"{DOC_PREFIX}*", batch):
+        if keys:
+            pipe = r.pipeline(transaction=False)
+            for k in keys:
+                pipe.hdel(k, field)
+            removed += sum(await pipe.execute())
+    return removed
+
+
+async def build(model: Optional[str], batch: int, restart: bool, dtype: Optional[str] = None):
+    r = await get_redis()
+    # A fresh (or pre-generation) Redis has no active generation yet: it is generation 0
+    await record_initial_generation(r)
+    plan = await _plan(r, model, restart, dtype)
+    generation = IndexGeneration(**plan["generation"])
+    active = await get_active_generation(r)
+    # Same embeddings, only the format or HNSW params change: convert, don't re-embed
+    source = active if (active.model, active.dims) == (generation.model, generation.dims) else None
+    index = build_index(generation)
+    await index.set_client(r)
+    if not await index.exists():
+        await create_index(index, dtype=generation.dtype)
+
+    # Main pass: SCAN from the saved cursor, checkpointing after every page
+    progress = Progress(f"gen {generation.gen} build")
+    progress.embedded = plan["embedded"]
+    async for cursor, keys in scan_keys(r, f"{DOC_PREFIX}*", batch, cursor=plan["cursor"]):
+        progress.add(len(keys), await _embed_missing(r, generation, keys, batch, source))
+        plan.update(cursor=cursor, embedded=progress.embedded)
+        await r.set(BUILD_KEY, json.dumps(plan))
+    progress.report(final=True)
+
+    # Docs added while we were scanning are still on the old field only
+    for attempt in range(3):
+        if not await _full_pass(r, generation, batch, f"gen {generation.gen} catch-up {attempt + 1}", source):
+            break
+    info = await _wait_indexed(index)
+
+    previous = await get_active_generation(r)
+    pipe = r.pipeline(transaction=True)
+    pipe.set(ACTIVE_INDEX_KEY, generation.to_json())
+    pipe.set(RETIRED_KEY, previous.to_json())
+    pipe.delete(BUILD_KEY)
+    await pipe.execute()
+    try:
+        await r.execute_command("FT.ALIASUPDATE", INDEX_ALIAS, generation.name)
+    except Exception as e:
+        print(f"Warning: could not point {INDEX_ALIAS} at {generation.name}: {e}")
+    print(f"Swapped to generation {generation.gen} ({generation.name}, {generation.model}, {generation.dtype}, "
+          f"{info.get('num_docs')} docs); workers follow within {INDEX_REFRESH_S}s")
+
+    # Workers that haven't switched yet still write the old field only
+    await asyncio.sleep(2 * INDEX_REFRESH_S)
+    await _full_pass(r, generation, batch, f"gen {generation.gen} post-swap", source)
+    print(f"Run `python reindex.py --cleanup` to drop generation {previous.gen} once traffic looks good.")
+
+
+async def cleanup(batch: int):
+    """Drops the retired generation's index and strips its vector field from the docs."""
+    r = await get_redis()
+    raw = await r.get(RETIRED_KEY)
+    if not raw:
+        print("Nothing to clean up.")
+        return
+    retired, active = IndexGeneration.from_json(raw), await get_active_generation(r)
+    if retired.gen == active.gen:
+        print("Retired generation is the active one; refusing.")
+        return
+    await _drop_generation(r, retired)
+    removed = await _strip_field(r, retired.field, batch) if retired.field != active.field else 0
+    await r.delete(RETIRED_KEY)
+    print(f"Dropped {retired.name}; removed {removed} {retired.field} vectors.")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Rebuild the vector index as a new generation and swap to it")
+    ap.add_argument("--model", help="embedding model for the new generation (default: the active one)")
+    ap.add_argument("--dtype", choices=sorted(DTYPES), help="vector storage format (default: the active one)")
+    ap.add_argument("--batch", type=int, default=256)
+    ap.add_argument("--restart", action="store_true", help="discard a saved partial build")
+    ap.add_argument("--cleanup", action="store_true", help="drop the generation replaced by the last swap")
+    args = ap.parse_args()
+    asyncio.run(cleanup(args.batch) if args.cleanup else build(args.model, args.batch, args.restart, args.dtype))
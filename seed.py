@@ -1,9 +1,12 @@
 # seed.py
-import asyncio, uuid, json
-from rag import PatientRAG, get_redis
+import asyncio, json
+from rag import get_redis, get_rag, build_patient_docs
+from cohort import reindex_patient
 
 DOCTORS = [
-  {"user_id":"admin","password":"test123","role":"doctor","name":"Dr. Admin"}
+  {"user_id":"admin","password":"test123","role":"doctor","name":"Dr. Admin"},
+  # Sees only Dr. Patel's patients' alerts (alerts.py routes by surgeon)
+  {"user_id":"patel","password":"test123","role":"doctor","name":"Dr. Patel","surgeon":"Dr. Patel"},
 ]
 
 PATIENTS = [
@@ -106,28 +109,20 @@ async def main():
         pipe.hset(f"postop:patient:{p['patient_id']}", mapping={"profile": json.dumps(p["profile"])})
     
     for d in DOCTORS:
-        pipe.hset(f"postop:doctor:{d['user_id']}", mapping={"password": d["password"], "role":"doctor", "name": d["name"]})
+        pipe.hset(f"postop:doctor:{d['user_id']}", mapping={"password": d["password"], "role":"doctor", "name": d["name"],
+                                                            "surgeon": d.get("surgeon", "")})
 
     await pipe.execute()
+    for p in PATIENTS:
+        await reindex_patient(r, p["patient_id"], p["profile"])
 
-    pr = PatientRAG(); await pr.init(r)
+    pr = await get_rag()
     docs = []
     for p in PATIENTS:
-        pid = p["patient_id"]
-        prof = p["profile"]
-        def add(kind, text):
-            docs.append({
-              "id": f"postop:doc:{uuid.uuid4()}",
-              "patient_id": pid, "kind": kind, "text": text
-            })
-        add("summary", f"{prof['name']} ({prof['age']}y). Procedure: {prof['procedure']} by {prof['surgeon']}.")
-        add("contacts", f"Emergency: {prof['emergency_contact']['name']} {prof['emergency_contact']['phone']}")
-        add("allergies", "Allergies: " + ", ".join(prof["allergies"]))
-        meds_lines = [f"{m['name']} {m['dose']} {m['freq']}" for m in prof["medications"]]
-        add("meds", "Medication plan: " + "; ".join(meds_lines))
-        add("red_flags", "Critical symptoms: " + "; ".join(prof["red_flags"]))
-    await pr.upsert_docs(r, docs)
-    print(f"Seeded {len(PATIENTS)} patients and {len(docs)} docs.")
+        docs.extend(build_patient_docs(p["patient_id"], p["profile"]))
+    stats = await pr.upsert_docs(r, docs, full=True)
+    print(f"Seeded {len(PATIENTS)} patients and {len(docs)} docs "
+          f"({stats['embedded']} embedded, {stats['unchanged']} unchanged, {stats['deleted']} stale removed).")
 
 if __name__ == "__main__":
     asyncio.run(main())
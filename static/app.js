@@ -148,28 +148,22 @@ $("chatForm").addEventListener("submit", async (e) => {
   setLoading(true);
 
   try {
-    const res = await fetch("/chat", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        ...(jwt ? { Authorization: `Bearer ${jwt}` } : {})
+    // Stream the reply (SSE over fetch); fall back to the plain endpoint
+    let live = null;
+    const data = await streamChat(text, {
+      onToken: (delta) => {
+        if (!live) { setLoading(false); live = startAssistant(); }
+        live.append(delta);
+      },
+      onMeta: (meta) => {
+        if (!live) { setLoading(false); live = startAssistant(); }
+        live.setMeta({ triage: normTriage(meta.triage_level), alerted: meta.alert_sent === true });
+        if (meta.alert_sent) {
+          setCriticalError("🚨 Critical situation detected. An alert has been sent to your doctor.");
+        }
       },
-      body: JSON.stringify({ message: text })
     });
 
-    let data, raw;
-    const ct = (res.headers.get("content-type") || "").toLowerCase();
-    if (ct.includes("application/json")) {
-      data = await res.json();
-    } else {
-      raw = await res.text();
-      data = safeParseAny(raw) || { assistant: cleanAssistantText(raw) };
-    }
-    if (!res.ok) {
-      throw new Error(data?.detail || data?.message || raw || `Chat failed (${res.status})`);
-    }
-    const inner = typeof data.assistant === "string" ? safeParseAny(data.assistant) : null;
-    if (inner && typeof inner === "object") data = { ...data, ...inner };
     const triage  = normTriage(data.triage_level ?? data.triage);
     const alerted = data.alert === true || data.alert_sent === true;
     const msgText =
@@ -179,7 +173,12 @@ $("chatForm").addEventListener("submit", async (e) => {
 
     // Remove loading bubble *before* pushing assistant reply
     setLoading(false); 
-    pushAssistant(msgText, { triage, alerted });
+    if (live) {
+      live.setText(msgText);
+      live.setMeta({ triage, alerted });
+    } else {
+      pushAssistant(msgText, { triage, alerted });
+    }
 
     if (alerted) {
       setCriticalError("🚨 Critical situation detected. An alert has been sent to your doctor.");
@@ -200,6 +199,69 @@ $("chatForm").addEventListener("submit", async (e) => {
 });
 
 
+// Reads /chat/stream server-sent events, returns the final "done" payload
+async function streamChat(text, { onToken, onMeta } = {}) {
+  const headers = {
+    "Content-Type": "application/json",
+    ...(jwt ? { Authorization: `Bearer ${jwt}` } : {})
+  };
+  const res = await fetch("/chat/stream", {
+    method: "POST", headers, body: JSON.stringify({ message: text })
+  });
+  if (!res.ok || !res.body) {
+    if (res.status === 404 || res.status === 405) return postChat(text, headers);
+    const raw = await res.text();
+    const data = safeParseAny(raw);
+    throw new Error(data?.detail || data?.message || raw || `Chat failed (${res.status})`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buf = "", done = null;
+  while (true) {
+    const { value, done: eof } = await reader.read();
+    if (eof) break;
+    buf += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buf.indexOf("\n\n")) !== -1) {
+      const frame = buf.slice(0, sep);
+      buf = buf.slice(sep + 2);
+      let event = "message", dataLines = [];
+      for (const line of frame.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trimStart());
+      }
+      let payload = null;
+      try { payload = JSON.parse(dataLines.join("\n")); } catch { continue; }
+      if (event === "token") onToken?.(payload.text || "");
+      else if (event === "meta") onMeta?.(payload);
+      else if (event === "done") done = payload;
+    }
+  }
+  if (!done) throw new Error("Chat stream ended unexpectedly");
+  return done;
+}
+
+async function postChat(text, headers) {
+  const res = await fetch("/chat", {
+    method: "POST", headers, body: JSON.stringify({ message: text })
+  });
+  let data, raw;
+  const ct = (res.headers.get("content-type") || "").toLowerCase();
+  if (ct.includes("application/json")) {
+    data = await res.json();
+  } else {
+    raw = await res.text();
+    data = safeParseAny(raw) || { assistant: cleanAssistantText(raw) };
+  }
+  if (!res.ok) {
+    throw new Error(data?.detail || data?.message || raw || `Chat failed (${res.status})`);
+  }
+  const inner = typeof data.assistant === "string" ? safeParseAny(data.assistant) : null;
+  if (inner && typeof inner === "object") data = { ...data, ...inner };
+  return data;
+}
+
 // This array will hold our medication objects
 let currentMedsArray = [];
 
@@ -343,36 +405,51 @@ function pushMsg(who, text){
 }
 
 function pushAssistant(text, {triage, alerted} = {}){
+  const live = startAssistant();
+  live.setMeta({ triage, alerted });
+  live.setText(text);
+}
+
+// Creates an assistant bubble that can be filled in while the reply streams
+function startAssistant(){
   const wrap = document.createElement("div");
   wrap.className = 'flex justify-start message-wrap-new';
   
   const bubble = document.createElement("div");
   bubble.className = 'bubble-assistant max-w-[85%] rounded-2xl px-4 py-3 whitespace-pre-wrap leading-relaxed';
-  if (triage || alerted) {
-    const hdr = document.createElement('div');
-    hdr.className = 'flex items-center gap-2 mb-2';
-    if (triage) {
-      const t = document.createElement('span');
-      t.className = triage.class + ' inline-flex items-center gap-1 px-2 py-0.5 rounded-full text-xs font-medium';
-      t.textContent = `Priority: ${triage.label}`;
-      hdr.appendChild(t);
-    }
-    if (alerted) {
-      const a = document.createElement('span');
-      a.className = 'inline-flex items-center gap-1 px-2 py-0.5 rounded-full text-xs font-medium bg-rose-100 text-rose-800';
-      a.textContent = '⚠️ Alert sent';
-      hdr.appendChild(a);
-    }
-    bubble.appendChild(hdr);
-  }
+
+  const hdr = document.createElement('div');
+  hdr.className = 'flex items-center gap-2 mb-2 hidden';
+  bubble.appendChild(hdr);
 
   const body = document.createElement("div");
-  body.textContent = text;
   bubble.appendChild(body);
 
   wrap.appendChild(bubble);
   messages.appendChild(wrap);
   messages.scrollTop = messages.scrollHeight;
+
+  const scroll = () => { messages.scrollTop = messages.scrollHeight; };
+  return {
+    append(delta) { body.textContent += delta; scroll(); },
+    setText(text) { body.textContent = text; scroll(); },
+    setMeta({triage, alerted} = {}) {
+      hdr.innerHTML = "";
+      if (triage) {
+        const t = document.createElement('span');
+        t.className = triage.class + ' inline-flex items-center gap-1 px-2 py-0.5 rounded-full text-xs font-medium';
+        t.textContent = `Priority: ${triage.label}`;
+        hdr.appendChild(t);
+      }
+      if (alerted) {
+        const a = document.createElement('span');
+        a.className = 'inline-flex items-center gap-1 px-2 py-0.5 rounded-full text-xs font-medium bg-rose-100 text-rose-800';
+        a.textContent = '⚠️ Alert sent';
+        hdr.appendChild(a);
+      }
+      hdr.classList.toggle('hidden', !(triage || alerted));
+    },
+  };
 }
 
 const setLoading = (on) => {
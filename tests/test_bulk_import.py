@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+import pytest
+
+from bulk_import import aiter_lines, parse_csv, parse_ndjson
+
+
+async def _chunks(chunks):
+    for c in chunks:
+        yield c
+
+
+def lines(chunks):
+    async def collect():
+        return [line async for line in aiter_lines(_chunks(chunks))]
+    return asyncio.run(collect())
+
+
+def rows(parser, text):
+    async def collect():
+        return [row async for row in parser(text.split("\n"))]
+    return asyncio.run(collect())
+
+
+def test_lines_split_across_chunks():
+    assert lines([b'{"a":', b' 1}\n{"b"', b': 2}\n', b'\n{"c": 3}']) == ['{"a": 1}', '{"b": 2}', "", '{"c": 3}']
+
+
+@pytest.mark.parametrize("text", ['{"name":"Tomás"}\n', '{"red_flags":["fever > 38°C"]}'])
+def test_multibyte_character_split_across_chunks(text):
+    data = text.encode("utf-8")
+    for cut in range(1, len(data)):
+        assert lines([data[:cut], data[cut:]]) == [text.rstrip("\n")]
+
+
+def test_one_byte_chunks():
+    data = '{"name":"Zoë"}\n{"name":"José"}'.encode("utf-8")
+    got = lines([data[i:i + 1] for i in range(len(data))])
+    assert [json.loads(line)["name"] for line in got] == ["Zoë", "José"]
+
+
+def test_ndjson_reports_bad_rows_and_keeps_going():
+    got = rows(parse_ndjson, '{"name": "a"}\n\nnot json\n[1, 2]\n{"name": "b"}')
+    assert got[0] == (1, {"name": "a"})
+    assert got[1][0] == 2 and got[1][1].startswith("invalid JSON")
+    assert got[2] == (3, "expected a JSON object")
+    assert got[3] == (4, {"name": "b"})
+
+
+def test_csv_lists_medications_and_quoted_newlines():
+    text = ('patient_id,name,red_flags,medications,notes\n'
+            'p9,Ana,chest pain; fever > 38°C,Aspirin|81mg|daily; Metoprolol|50mg|bid,"line one\nline two"\n'
+            'p10,Ben,,"[{""name"": ""Ibuprofen"", ""dose"": ""400mg"", ""freq"": ""q6h""}]",\n')
+    (n1, first), (n2, second) = rows(parse_csv, text)
+    assert (n1, n2) == (1, 2)
+    assert first["red_flags"] == ["chest pain", "fever > 38°C"]
+    assert first["medications"] == [{"name": "Aspirin", "dose": "81mg", "freq": "daily"},
+                                    {"name": "Metoprolol", "dose": "50mg", "freq": "bid"}]
+    assert first["notes"] == "line one\nline two"
+    assert "red_flags" not in second
+    assert second["medications"] == [{"name": "Ibuprofen", "dose": "400mg", "freq": "q6h"}]
+
+
+def test_csv_bad_rows():
+    got = rows(parse_csv, 'patient_id,medications\np1,"[not json"\np2,"unterminated\n')
+    assert got[0][0] == 1 and got[0][1].startswith("bad medications column")
+    assert got[1] == (2, "unterminated quoted field")
@@ -0,0 +1,190 @@
+import asyncio
+
+import pytest
+
+import cohort
+from cohort import COHORT_ALL_KEY, decode_cursor, encode_cursor, index_patient, list_patients, record_alert
+
+
+class FakeRedis:
+    """The sorted-set and hash commands cohort.py uses, in memory (bytes out, like the app's client)."""
+
+    def __init__(self):
+        self.z, self.h = {}, {}
+
+    def pipeline(self, transaction=False):
+        return _Pipeline(self)
+
+    def _desc(self, key):
+        return sorted(self.z.get(key, {}).items(), key=lambda kv: (kv[1], kv[0]), reverse=True)
+
+    @staticmethod
+    def _out(items, withscores):
+        return [(m.encode(), s) if withscores else m.encode() for m, s in items]
+
+    async def zadd(self, key, mapping, nx=False, gt=False):
+        zset = self.z.setdefault(key, {})
+        for m, s in mapping.items():
+            if (nx and m in zset) or (gt and m in zset and zset[m] >= s):
+                continue
+            zset[m] = float(s)
+
+    async def zrem(self, key, member):
+        self.z.get(key, {}).pop(member, None)
+
+    async def zcard(self, key):
+        return len(self.z.get(key, {}))
+
+    async def zscore(self, key, member):
+        return self.z.get(key, {}).get(member)
+
+    async def zmscore(self, key, members):
+        return [self.z.get(key, {}).get(m) for m in members]
+
+    async def zrevrank(self, key, member):
+        members = [m for m, _ in self._desc(key)]
+        return members.index(member) if member in members else None
+
+    async def zrevrange(self, key, start, end, withscores=False):
+        return self._out(self._desc(key)[start:end + 1], withscores)
+
+    async def zrevrangebyscore(self, key, max, min, start=0, num=None, withscores=False):
+        def below_max(s):
+            if max == "+inf":
+                return True
+            if str(max).startswith("("):
+                return s < float(max[1:])
+            return s <= float(max)
+        items = [(m, s) for m, s in self._desc(key) if below_max(s) and s >= float(min)]
+        return self._out(items[start:start + num if num is not None else None], withscores)
+
+    async def hset(self, key, mapping):
+        self.h.setdefault(key, {}).update({k: str(v) for k, v in mapping.items()})
+
+    async def hsetnx(self, key, field, value):
+        self.h.setdefault(key, {}).setdefault(field, str(value))
+
+    async def hmget(self, key, *fields):
+        row = self.h.get(key, {})
+        return [row[f].encode() if f in row else None for f in fields]
+
+
+class _Pipeline:
+    def __init__(self, r):
+        self.r, self.calls = r, []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.calls.append(getattr(self.r, name)(*args, **kwargs))
+        return queue
+
+    async def execute(self):
+        calls, self.calls = self.calls, []
+        return [await c for c in calls]
+
+
+SURGEONS = ("Dr. Shah", "Dr. Patel", "Dr. Lee")
+PROCEDURES = ("Cholecystectomy", "Knee Replacement")
+
+
+def default_profile(i):
+    return {"name": f"Patient {i}", "age": 40 + i % 30, "surgeon": SURGEONS[i % 3], "procedure": PROCEDURES[i % 2]}
+
+
+def make_cohort(n=40, profile=default_profile):
+    r = FakeRedis()
+
+    async def fill():
+        pipe = r.pipeline()
+        for i in range(n):
+            # Pairs share an "added" time, so pages must split ties exactly
+            index_patient(pipe, f"p{i:02d}", profile(i), added_ms=1_000_000 + (i // 2) * 1000)
+        for i in range(0, n, 5):
+            record_alert(pipe, f"p{i:02d}", 2_000_000 + i, "fever")
+        await pipe.execute()
+    asyncio.run(fill())
+    return r
+
+
+def pages(r, limit, **filters):
+    async def walk():
+        ids, cursor, seen_pages = [], None, 0
+        while True:
+            page = await list_patients(r, limit=limit, cursor=cursor, **filters)
+            ids += [p["patient_id"] for p in page["patients"]]
+            cursor, seen_pages = page["next_cursor"], seen_pages + 1
+            if cursor is None or seen_pages > 100:
+                return ids, page
+    return asyncio.run(walk())
+
+
+def expected(r, key):
+    return [m for m, _ in r._desc(key)]
+
+
+@pytest.mark.parametrize("limit", [1, 3, 7, 40, 100])
+def test_pages_cover_everyone_once_in_order(limit):
+    r = make_cohort()
+    ids, _ = pages(r, limit)
+    assert ids == expected(r, COHORT_ALL_KEY)
+
+
+def test_first_page_has_total_and_summaries():
+    r = make_cohort()
+    page = asyncio.run(list_patients(r, limit=2))
+    assert page["total"] == 40
+    first = page["patients"][0]
+    assert first["patient_id"] == "p39"
+    assert first["surgeon"] == SURGEONS[39 % 3] and first["age"] == 40 + 39 % 30
+    assert first["added"] == 1_000_000 + 19 * 1000 and first["last_alert"] is None
+
+
+@pytest.mark.parametrize("limit", [1, 4, 50])
+def test_combined_filters(limit):
+    r = make_cohort()
+    ids, last = pages(r, limit, surgeon="Dr. Patel", procedure="Knee Replacement")
+    want = [m for m in expected(r, COHORT_ALL_KEY)
+            if SURGEONS[int(m[1:]) % 3] == "Dr. Patel" and PROCEDURES[int(m[1:]) % 2] == "Knee Replacement"]
+    assert ids == want
+    assert last["total"] is None
+
+
+def test_alerted_orders_by_last_alert():
+    r = make_cohort()
+    ids, _ = pages(r, 3, alerted=True, surgeon="Dr. Shah")
+    assert ids == [f"p{i:02d}" for i in range(35, -1, -5) if i % 3 == 0]
+
+
+def test_scan_budget_returns_short_pages_with_a_cursor(monkeypatch):
+    monkeypatch.setattr(cohort, "COHORT_SCAN_BUDGET", 5)
+    # Dr. Lee's set is walked (the smaller one); 1 in 20 of it matches
+    r = make_cohort(400, lambda i: {"name": f"Patient {i}", "surgeon": "Dr. Lee" if i % 2 else "Dr. Shah",
+                                    "procedure": "Rare" if i % 40 == 1 or i % 2 == 0 else "Common"})
+    first = asyncio.run(list_patients(r, limit=5, surgeon="Dr. Lee", procedure="Rare"))
+    assert len(first["patients"]) < 5 and first["next_cursor"]
+    ids, _ = pages(r, 5, surgeon="Dr. Lee", procedure="Rare")
+    assert ids == [m for m in expected(r, COHORT_ALL_KEY) if int(m[1:]) % 40 == 1]
+
+
+def test_cursor_survives_removal_of_its_member():
+    r = make_cohort()
+    page = asyncio.run(list_patients(r, limit=5))
+    last = page["patients"][-1]["patient_id"]
+    del r.z[COHORT_ALL_KEY][last]
+    rest, _ = pages(r, 5)
+    # Resumes below the removed member's score, skipping nobody older
+    nxt = asyncio.run(list_patients(r, limit=40, cursor=page["next_cursor"]))
+    older = [m for m in rest if r.z[COHORT_ALL_KEY][m] < page["patients"][-1]["added"]]
+    assert [p["patient_id"] for p in nxt["patients"]] == older
+
+
+def test_since_stops_at_the_cutoff():
+    r = make_cohort()
+    ids, _ = pages(r, 4, since_ms=1_000_000 + 15 * 1000)
+    assert ids == [m for m in expected(r, COHORT_ALL_KEY) if r.z[COHORT_ALL_KEY][m] >= 1_015_000]
+
+
+def test_cursor_round_trip_and_malformed():
+    assert decode_cursor(encode_cursor(1234.0, "p:7")) == (1234, "p:7")
+    with pytest.raises(ValueError):
+        decode_cursor("not-a-cursor")
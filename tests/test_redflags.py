@@ -0,0 +1,74 @@
+import pytest
+
+from redflags import compile_red_flags, DEFAULT_RED_FLAGS
+from seed import PATIENTS
+
+FLAGS = {p["patient_id"]: p["profile"]["red_flags"] for p in PATIENTS}
+
+
+def match(patient_id, message):
+    return compile_red_flags(FLAGS[patient_id]).match(message)
+
+
+@pytest.mark.parametrize("patient_id, message", [
+    # Everyday words far from the symptom
+    ("p1", "I kept my meds schedule but threw up once"),
+    ("p2", "I feel more comfortable today, my leg is a little red"),
+    ("p1", "I'm still taking ibuprofen and I threw up yesterday"),
+    # Hypotheticals
+    ("p4", "what should I do if I get chest pain"),
+    ("p4", "in case I get short of breath, who do I call?"),
+    ("p2", "should I call if my calf pain becomes severe"),
+    # Negations
+    ("p1", "no fever and no vomiting"),
+    ("p4", "I don't have chest pain"),
+    # Threshold not reached / parts in different sentences
+    ("p1", "I have a fever. It's 38 now"),
+    ("p2", "My leg looks fine. The swelling elsewhere is getting worse"),
+    ("p1", "I threw up once"),
+    # Numbers that aren't a temperature next to the fever mention
+    ("p4", "took my 40 mg atorvastatin, feel a bit feverish"),
+    ("p2", "slight fever after my 40 mg shot"),
+    ("p3", "I'm 39 years old and a little feverish"),
+])
+def test_no_false_alarm(patient_id, message):
+    assert match(patient_id, message) == []
+
+
+@pytest.mark.parametrize("patient_id, message, flag", [
+    ("p4", "I have chest pain", "chest pain"),
+    ("p4", "my chest hurts and I can't breathe", "shortness of breath"),
+    ("p1", "I keep throwing up", "persistent vomiting"),
+    ("p1", "I have been vomiting constantly since last night", "persistent vomiting"),
+    ("p2", "my calf is in severe pain", "severe calf pain"),
+    ("p2", "the swelling in my leg is getting worse", "increasing swelling or redness of leg"),
+    ("p2", "my leg is red and more swollen", "increasing swelling or redness of leg"),
+    ("p1", "my temperature is 39.2", "fever > 38.5°C after day 2"),
+    ("p1", "temp 102F this morning", "fever > 38.5°C after day 2"),
+    ("p3", "heavy bleeding down there", "heavy vaginal bleeding"),
+    ("p4", "I feel dizzy and fainted", "dizziness or fainting"),
+    ("p1", "my eyes look yellow", "yellowing of eyes/skin"),
+    # A negation or a hypothetical only covers its own clause
+    ("p1", "no fever but severe pain", "severe pain"),
+    ("p1", "if the pain gets worse should I call? I can't breathe right now", "shortness of breath"),
+    # A plain "if" is usually a report, not a hypothetical
+    ("p4", "if I breathe deeply I get chest pain", "chest pain"),
+    ("p4", "I wonder if this chest pain is normal", "chest pain"),
+    ("p2", "is it normal if my calf pain is severe and getting worse", "severe calf pain"),
+    ("p4", "doctor asked if I had chest pain and I do", "chest pain"),
+    ("p4", "should I call if I have chest pain right now", "chest pain"),
+    ("p2", "I have a fever of 38.5°C", "fever > 38°C"),
+])
+def test_flags_fire(patient_id, message, flag):
+    assert flag in match(patient_id, message)
+
+
+def test_defaults_apply_to_every_patient():
+    matcher = compile_red_flags([])
+    assert [f.split(">")[0].strip() for f in matcher.match("severe pain and a fever of 39.5")] == \
+        ["severe pain", "fever"]
+    assert set(f for f in DEFAULT_RED_FLAGS) >= set(matcher.match("chest pain, severe pain"))
+
+
+def test_results_follow_profile_order():
+    assert match("p4", "chest pain and I'm short of breath") == ["chest pain", "shortness of breath"]
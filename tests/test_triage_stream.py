@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from triage_stream import TriageStreamParser
+
+ANSWER = {
+    "triage_level": 2,
+    "assistant": 'Take "Ibuprofen 400mg" q6h.\nIf fever > 38°C, call Dr. O\'Brien \\ clinic 😀 — café',
+    "alert": False,
+}
+
+
+def feed_all(chunks):
+    parser = TriageStreamParser()
+    events = [e for c in chunks for e in parser.feed(c)]
+    return parser, events
+
+
+def streamed_text(events):
+    return "".join(payload for kind, payload in events if kind == "token")
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+def test_every_two_chunk_split(ensure_ascii):
+    raw = json.dumps(ANSWER, ensure_ascii=ensure_ascii)
+    for cut in range(1, len(raw)):
+        parser, events = feed_all([raw[:cut], raw[cut:]])
+        assert parser.assistant == ANSWER["assistant"], cut
+        assert streamed_text(events) == ANSWER["assistant"], cut
+        assert (parser.triage_level, parser.alert) == (2, False)
+
+
+def test_one_character_chunks():
+    raw = json.dumps(ANSWER)   # \u escapes, including a surrogate pair
+    parser, events = feed_all(list(raw))
+    assert streamed_text(events) == ANSWER["assistant"]
+    assert parser.raw == raw
+
+
+def test_meta_events_when_keys_appear():
+    chunks = ['{"triage_level": 3, "assis', 'tant": "Call now.", ', '"alert": true}']
+    _, events = feed_all(chunks)
+    metas = [payload for kind, payload in events if kind == "meta"]
+    assert metas == [{"triage_level": 3, "alert": None}, {"triage_level": 3, "alert": True}]
+
+
+def test_text_after_the_assistant_string_is_not_streamed():
+    parser, events = feed_all(['{"assistant": "Rest."', ', "note": "not for the patient"}'])
+    assert streamed_text(events) == "Rest."
+    assert parser.assistant == "Rest."
+
+
+def test_cut_off_stream_keeps_the_decoded_prefix():
+    raw = json.dumps(ANSWER)
+    parser, _ = feed_all([raw[:raw.index("call Dr.")]])
+    assert parser.assistant == ANSWER["assistant"][:ANSWER["assistant"].index("call Dr.")]
+    assert parser.triage_level == 2 and parser.alert is None
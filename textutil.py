@@ -0,0 +1,8 @@
+import re
+
+_WS = re.compile(r"\s+")
+_EDGE_PUNCT = " \t\n.,!?;:\"'`~-_()[]{}"
+
+def normalize_text(text: str) -> str:
+    """Lowercases, collapses whitespace and strips surrounding punctuation."""
+    return _WS.sub(" ", (text or "").lower()).strip(_EDGE_PUNCT)
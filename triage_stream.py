@@ -0,0 +1,96 @@
+import re
+from typing import List, Optional, Tuple
+
+_LEVEL_RE = re.compile(r'"triage_level"\s*:\s*"?(\d)')
+_ALERT_RE = re.compile(r'"alert"\s*:\s*(true|false)', re.IGNORECASE)
+_ASSISTANT_RE = re.compile(r'"assistant"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class TriageStreamParser:
+    """
+    Incrementally parses the model's {"triage_level", "assistant", "alert"}
+    JSON while it streams in. feed() returns events:
+      ("meta",  {"triage_level": int | None, "alert": bool | None})  when a key first appears
+      ("token", "<decoded assistant text delta>")
+    The full text is kept in .raw for the regular extract_json pass at the end.
+    """
+    def __init__(self):
+        self.raw = ""
+        self.triage_level: Optional[int] = None
+        self.alert: Optional[bool] = None
+        self.assistant = ""
+        self._pos: Optional[int] = None   # offset inside the assistant string
+        self._assistant_done = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, object]]:
+        self.raw += chunk
+        events: List[Tuple[str, object]] = []
+
+        changed = False
+        if self.triage_level is None:
+            m = _LEVEL_RE.search(self.raw)
+            if m:
+                self.triage_level = int(m.group(1))
+                changed = True
+        if self.alert is None:
+            m = _ALERT_RE.search(self.raw)
+            if m:
+                self.alert = m.group(1).lower() == "true"
+                changed = True
+        if changed:
+            events.append(("meta", {"triage_level": self.triage_level, "alert": self.alert}))
+
+        if self._pos is None:
+            m = _ASSISTANT_RE.search(self.raw)
+            if m:
+                self._pos = m.end()
+        if self._pos is not None and not self._assistant_done:
+            delta = self._scan()
+            if delta:
+                self.assistant += delta
+                events.append(("token", delta))
+        return events
+
+    def _scan(self) -> str:
+        """Decodes as much of the JSON string as is complete; stops at partial escapes."""
+        buf, i, out = self.raw, self._pos, []
+        while i < len(buf):
+            c = buf[i]
+            if c == '"':
+                self._assistant_done = True
+                i += 1
+                break
+            if c != "\\":
+                out.append(c)
+                i += 1
+                continue
+            if i + 1 >= len(buf):
+                break
+            e = buf[i + 1]
+            if e != "u":
+                out.append(_ESCAPES.get(e, e))
+                i += 2
+                continue
+            if i + 6 > len(buf):
+                break
+            try:
+                code = int(buf[i + 2:i + 6], 16)
+            except ValueError:
+                i += 6
+                continue
+            if 0xD800 <= code < 0xDC00:
+                # surrogate pair: wait for the low half
+                if i + 12 > len(buf):
+                    break
+                if buf[i + 6:i + 8] == "\\u":
+                    try:
+                        low = int(buf[i + 8:i + 12], 16)
+                        code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+                        i += 6
+                    except ValueError:
+                        pass
+            out.append(chr(code))
+            i += 6
+        self._pos = i
+        return "".join(out)
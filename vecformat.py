@@ -0,0 +1,81 @@
+import os
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# Storage format of the indexed doc vectors in Redis. float16 halves vector
+# memory (hash field + HNSW copy) at a negligible recall cost for MiniLM.
+# Only used for a new deployment's first index generation: after that the
+# dtype is part of the active IndexGeneration (change it with migrate_vectors.py).
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+# "int8": the in-process context store keeps scalar-quantized codes and
+# re-ranks its top candidates against the full-precision vectors in Redis.
+VECTOR_QUANT = os.getenv("VECTOR_QUANT", "none")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+
+DTYPES = {"float32": np.float32, "float16": np.float16}
+if VECTOR_DTYPE not in DTYPES:
+    raise ValueError(f"VECTOR_DTYPE must be one of {sorted(DTYPES)}, got {VECTOR_DTYPE!r}")
+if VECTOR_QUANT not in ("none", "int8"):
+    raise ValueError(f"VECTOR_QUANT must be 'none' or 'int8', got {VECTOR_QUANT!r}")
+
+
+def to_bytes(vec, dtype: str = VECTOR_DTYPE) -> bytes:
+    return np.asarray(vec, dtype=DTYPES[dtype]).tobytes()
+
+
+def from_bytes(raw: bytes, dtype: str = VECTOR_DTYPE) -> np.ndarray:
+    """Decodes a stored vector to float32 for scoring."""
+    return np.frombuffer(raw, dtype=DTYPES[dtype]).astype(np.float32)
+
+
+def detect_dtype(raw: bytes, dims: int) -> str:
+    """Infers the stored format from the byte length (used by migrations)."""
+    for name, t in DTYPES.items():
+        if len(raw) == dims * np.dtype(t).itemsize:
+            return name
+    raise ValueError(f"vector of {len(raw)} bytes does not match {dims} dims")
+
+
+def quantize_int8(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row scalar quantization: row ~= codes * scale."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix.astype(np.int8), np.zeros((matrix.shape[0],), dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Approximate dot products of a float query against int8 rows."""
+    return (codes.astype(np.float32) @ np.asarray(q, dtype=np.float32)) * scales
+
+
+def shortlist_int8(codes: np.ndarray, scales: np.ndarray, q: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the n best rows by int8 score (unordered)."""
+    approx = int8_scores(codes, scales, q)
+    if n >= len(approx):
+        return np.arange(len(approx))
+    return np.argpartition(-approx, n - 1)[:n]
+
+
+def search_int8(codes: np.ndarray, scales: np.ndarray, q: np.ndarray, k: int,
+                exact_rows: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+                candidates: int = RERANK_CANDIDATES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Top-k (indices, scores): int8 scores shortlist max(k, candidates) rows,
+    then exact float scores re-rank the shortlist when exact_rows is given.
+    """
+    short = shortlist_int8(codes, scales, q, max(k, candidates))
+    if exact_rows is not None:
+        scores = exact_rows(short) @ np.asarray(q, dtype=np.float32)
+    else:
+        scores = int8_scores(codes[short], scales[short], q)
+    order = np.argsort(-scores)[:k]
+    return short[order], scores[order]
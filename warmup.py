@@ -0,0 +1,73 @@
+import os
+import time
+import resource
+from typing import Optional
+
+from rag import get_embedder, get_batcher
+from metrics import WORKER_STARTUP_SECONDS, WORKER_RSS_BYTES
+
+# Load the embedding model at import time. With gunicorn --preload
+# (gunicorn.conf.py) that import happens once in the master, and forked
+# workers share the weights copy-on-write instead of each loading a copy.
+EMBED_PRELOAD = os.getenv("EMBED_PRELOAD", "0") == "1"
+
+_state = {"ready": False, "preloaded": False, "startup_seconds": None, "warm_seconds": None}
+
+
+def preload_model():
+    t0 = time.perf_counter()
+    get_embedder()
+    _state["preloaded"] = True
+    print(f"Preloaded embedding model in {time.perf_counter() - t0:.2f}s (pid {os.getpid()})")
+
+
+def _read_kb(path: str, field: str) -> Optional[int]:
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def memory() -> dict:
+    """RSS of this worker; PSS splits shared (copy-on-write) pages across workers."""
+    rss_kb = _read_kb("/proc/self/status", "VmRSS")
+    if rss_kb is None:
+        # ru_maxrss is KB on Linux; only a high-water mark, but portable
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    pss_kb = _read_kb("/proc/self/smaps_rollup", "Pss")
+    return {
+        "rss_mb": round(rss_kb / 1024, 1),
+        "pss_mb": round(pss_kb / 1024, 1) if pss_kb is not None else None,
+    }
+
+
+async def warm(started_at: float):
+    """Runs a dummy encode (off the loop) so the first patient doesn't pay for it."""
+    t0 = time.perf_counter()
+    await get_batcher().embed_many(["warmup"])
+    _state["warm_seconds"] = round(time.perf_counter() - t0, 3)
+    _state["startup_seconds"] = round(time.perf_counter() - started_at, 3)
+    _state["ready"] = True
+
+    mem = memory()
+    WORKER_STARTUP_SECONDS.set(_state["startup_seconds"])
+    WORKER_RSS_BYTES.set(mem["rss_mb"] * 1024 * 1024)
+    print(f"Worker {os.getpid()} ready in {_state['startup_seconds']}s "
+          f"(warm {_state['warm_seconds']}s, preloaded={_state['preloaded']}, "
+          f"rss={mem['rss_mb']}MB, pss={mem['pss_mb']}MB)")
+
+
+def is_ready() -> bool:
+    return _state["ready"]
+
+
+def status() -> dict:
+    return {"pid": os.getpid(), **_state, **memory()}
+
+
+if EMBED_PRELOAD:
+    preload_model()